@@ -0,0 +1,5 @@
+"""
+Benchmarks of each stage of the PyHP render pipeline.
+
+Run them from the root of the repository with `python -m benchmarks`.
+"""
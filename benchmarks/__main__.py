@@ -0,0 +1,76 @@
+"""
+PyHP benchmarks
+
+Times each stage of the render pipeline, for synthetic templates of several
+sizes, and optionally compares the results with a previous run.
+"""
+
+import json
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+try:
+    from runner import run_benchmarks, dump_results, load_results, \
+        compare_results, format_time, DEFAULT_REPEAT, DEFAULT_MIN_TIME
+    from stages import STAGES
+    from templates import SHAPES
+except ImportError:
+    from .runner import run_benchmarks, dump_results, load_results, \
+        compare_results, format_time, DEFAULT_REPEAT, DEFAULT_MIN_TIME
+    from .stages import STAGES
+    from .templates import SHAPES
+
+
+if __name__ == '__main__':
+    shape_names = [shape.name for shape in SHAPES]
+
+    parser = ArgumentParser(description='Benchmark the PyHP render pipeline')
+    parser.add_argument('--stage', action='append', choices=list(STAGES),
+                        help='Stage to benchmark (default: every stage)')
+    parser.add_argument('--shape', action='append', choices=shape_names,
+                        help='Template shape to benchmark (default: every '
+                             'shape)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='Number of times to time each stage')
+    parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME,
+                        help='Minimum seconds that each time is taken over')
+    parser.add_argument('--output', help='File to write the results to, as '
+                                         'JSON')
+    parser.add_argument('--compare', help='Results file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Fraction that a stage can be slower than in '
+                             'the compared results before it is reported '
+                             'as a regression')
+
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        args.stage or list(STAGES),
+        [shape for shape in SHAPES
+         if args.shape is None or shape.name in args.shape],
+        args.repeat, args.min_time)
+
+    if args.output is not None:
+        Path(args.output).write_text(json.dumps(dump_results(results),
+                                                indent=2),
+                                     encoding='utf-8')
+
+    baseline = [] if args.compare is None else load_results(Path(args.compare))
+    regressions = 0
+
+    for result, ratio in compare_results(baseline, results):
+        line = f'{result.stage:<18} {result.shape:<8} ' \
+               f'{format_time(result.median):>10}'
+
+        if ratio is not None:
+            line += f' {ratio:6.2f}x'
+            if ratio > 1 + args.threshold:
+                line += ' (regression)'
+                regressions += 1
+
+        print(line)
+
+    if regressions:
+        print(f'{regressions} regressions')
+        sys.exit(1)
@@ -0,0 +1,154 @@
+"""
+Sets up functions for timing the stages of the render pipeline, and for
+saving and comparing the results.
+
+Results are saved as JSON, with one entry per stage and template shape, so
+that the results from two commits can be compared.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import json
+import platform
+import subprocess
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import mean, median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Iterable, Optional
+
+try:
+    from stages import STAGES, Operation
+    from templates import SHAPES, TemplateShape, write_templates
+except ImportError:
+    from .stages import STAGES, Operation
+    from .templates import SHAPES, TemplateShape, write_templates
+
+
+DEFAULT_REPEAT = 5
+# Seconds that each repeat of an operation is timed for (at least)
+DEFAULT_MIN_TIME = 0.2
+
+
+@dataclass
+class BenchmarkResult:
+    """Stores the timings of a stage, in seconds per operation."""
+    # pylint: disable=too-many-instance-attributes
+    stage: str
+    shape: str
+    blocks: int
+    hypertext_lines: int
+    include_depth: int
+    number: int
+    min: float
+    median: float
+    mean: float
+
+    @property
+    def key(self) -> tuple[str, str]:
+        return self.stage, self.shape
+
+
+def time_operation(operation: Operation, repeat: int = DEFAULT_REPEAT,
+                   min_time: float = DEFAULT_MIN_TIME) -> tuple[int, list[float]]:
+    """
+    Find how many times the operation must be run to take at least min_time
+    seconds, then time that many runs repeat times, and return the number
+    of runs and the seconds per run of each repeat.
+    """
+    number = 1
+    while True:
+        elapsed = _time_runs(operation, number)
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    times = [elapsed / number]
+    times.extend(_time_runs(operation, number) / number
+                 for _ in range(repeat - 1))
+
+    return number, times
+
+
+def _time_runs(operation: Operation, number: int) -> float:
+    start = perf_counter()
+    for _ in range(number):
+        operation()
+    return perf_counter() - start
+
+
+def run_benchmarks(stages: Iterable[str] = STAGES,
+                   shapes: Iterable[TemplateShape] = SHAPES,
+                   repeat: int = DEFAULT_REPEAT,
+                   min_time: float = DEFAULT_MIN_TIME
+                   ) -> list[BenchmarkResult]:
+    """Time each stage for each shape of template."""
+    results = []
+
+    for shape in shapes:
+        with TemporaryDirectory() as temp_dir:
+            base_dir = Path(temp_dir).resolve()
+            write_templates(base_dir, shape)
+
+            for stage in stages:
+                number, times = time_operation(STAGES[stage](base_dir),
+                                               repeat, min_time)
+                results.append(BenchmarkResult(
+                    stage, shape.name, shape.blocks, shape.hypertext_lines,
+                    shape.include_depth, number, min(times), median(times),
+                    mean(times),
+                ))
+
+    return results
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True, check=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def dump_results(results: list[BenchmarkResult]) -> dict[str, Any]:
+    return {
+        'commit': get_commit(),
+        'time': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [asdict(result) for result in results],
+    }
+
+
+def load_results(path: Path) -> list[BenchmarkResult]:
+    data = json.loads(path.read_text(encoding='utf-8'))
+    return [BenchmarkResult(**result) for result in data['results']]
+
+
+def compare_results(baseline: list[BenchmarkResult],
+                    results: list[BenchmarkResult]
+                    ) -> list[tuple[BenchmarkResult, Optional[float]]]:
+    """
+    Return each result with the ratio of its median time to the median time
+    of the same stage and shape in the baseline (or None if the baseline
+    does not have it). Ratios above 1 are slower than the baseline.
+    """
+    baseline_medians = {result.key: result.median for result in baseline}
+    comparison = []
+
+    for result in results:
+        baseline_median = baseline_medians.get(result.key)
+        comparison.append((result, None if baseline_median is None
+                           else result.median / baseline_median))
+
+    return comparison
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.2f}{unit}'
+    return f'{seconds / 1e-9:.0f}ns'
@@ -0,0 +1,108 @@
+"""
+Sets up a benchmark for each stage of the render pipeline.
+
+Each stage is set up for a page written to the base directory, and returns
+the operation to time, which is run many times. Caches that are warm in a
+running server are warmed before timing.
+"""
+
+# pylint: disable=missing-function-docstring
+
+from pathlib import Path, PurePath
+from typing import Any, Callable
+
+from src.pyhp.file_processing import SystemFileProcessor
+from src.pyhp.hypertext_processing import UglySoup
+from src.pyhp.text_processing import prepare_code_text
+from src.pyhp.code_execution import run_code_text
+from src.pyhp.namespaces import DEFAULT_NAMESPACE_FACTORY
+from src.pyhp.template_cache import TemplateCache
+from src.pyhp.pyhp_interface import Pyhp
+from src.pyhp.pyhp_flask import create_app
+
+try:
+    from templates import PAGE_NAME
+except ImportError:
+    from .templates import PAGE_NAME
+
+
+Operation = Callable[[], Any]
+
+
+def get_true_path(base_dir: Path) -> Operation:
+    file_processor = SystemFileProcessor(base_dir)
+    path = PurePath(PAGE_NAME).with_suffix('')
+
+    return lambda: file_processor.get_true_path(path)
+
+
+def parse(base_dir: Path) -> Operation:
+    text = (base_dir / PAGE_NAME).read_text(encoding='utf-8')
+
+    return lambda: UglySoup(text)
+
+
+def get_code_texts(base_dir: Path) -> list[str]:
+    dom = UglySoup((base_dir / PAGE_NAME).read_text(encoding='utf-8'))
+    return [section.text for section in dom.sections
+            if section.is_pyhp_code]
+
+
+def prepare_code(base_dir: Path) -> Operation:
+    code_texts = get_code_texts(base_dir)
+
+    def operation():
+        for code_text in code_texts:
+            prepare_code_text(code_text)
+
+    return operation
+
+
+def run_code(base_dir: Path) -> Operation:
+    code_texts = [prepare_code_text(code_text)
+                  for code_text in get_code_texts(base_dir)]
+    globals_ = DEFAULT_NAMESPACE_FACTORY.create(
+        pyhp=Pyhp(PurePath(), SystemFileProcessor(base_dir)))
+
+    def operation():
+        for code_text in code_texts:
+            run_code_text(code_text, globals_, {})
+
+    return operation
+
+
+def pyhp_run(base_dir: Path) -> Operation:
+    file_processor = SystemFileProcessor(base_dir)
+    template_cache = TemplateCache()
+
+    def operation():
+        return Pyhp(PurePath(), file_processor,
+                    template_cache=template_cache).run(PAGE_NAME)
+
+    operation()
+
+    return operation
+
+
+def flask_request(base_dir: Path) -> Operation:
+    client = create_app(str(base_dir)).test_client()
+    url = f'/{PurePath(PAGE_NAME).stem}'
+
+    def operation():
+        response = client.get(url)
+        response.close()
+
+    operation()
+
+    return operation
+
+
+# In the order that a request passes through them
+STAGES: dict[str, Callable[[Path], Operation]] = {
+    'get_true_path': get_true_path,
+    'parse': parse,
+    'prepare_code_text': prepare_code,
+    'run_code_text': run_code,
+    'pyhp_run': pyhp_run,
+    'flask_request': flask_request,
+}
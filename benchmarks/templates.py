@@ -0,0 +1,80 @@
+"""
+Sets up the synthetic templates that the benchmarks render.
+
+Each shape describes a page by the number of code blocks it has, the
+number of lines of hypertext between them, and how many files deep its
+chain of includes is.
+"""
+
+# pylint: disable=missing-function-docstring
+
+from dataclasses import dataclass
+from pathlib import Path
+
+
+PAGE_NAME = 'page.pyhp'
+
+
+@dataclass(frozen=True)
+class TemplateShape:
+    """Describes the size of a synthetic page."""
+    name: str
+    blocks: int
+    hypertext_lines: int
+    include_depth: int = 0
+
+
+SHAPES = (
+    TemplateShape('small', blocks=5, hypertext_lines=5),
+    TemplateShape('medium', blocks=50, hypertext_lines=20),
+    TemplateShape('large', blocks=500, hypertext_lines=20),
+    TemplateShape('nested', blocks=5, hypertext_lines=5, include_depth=8),
+)
+
+
+def generate_template(blocks: int, hypertext_lines: int,
+                      include: str = '') -> str:
+    """
+    Return a page with the given number of code blocks, each of which is
+    preceded by hypertext_lines lines of hypertext. If include is given, the
+    page includes that file after its last block.
+    """
+    parts = ['<!DOCTYPE html>\n<html>\n<body>\n']
+
+    for block in range(blocks):
+        parts.extend(f'  <p class="row-{block}">Line {line} of the page</p>\n'
+                     for line in range(hypertext_lines))
+        parts.append(f'  <ul>\n    <pyhp>\n'
+                     f'    for item in range(3):\n'
+                     f'        print(f"<li>{{item * {block}}}</li>")\n'
+                     f'    </pyhp>\n  </ul>\n')
+
+    if include:
+        parts.append(f'  <pyhp>print(pyhp.include({include!r}))</pyhp>\n')
+
+    parts.append('</body>\n</html>\n')
+
+    return ''.join(parts)
+
+
+def write_templates(base_dir: Path, shape: TemplateShape) -> Path:
+    """
+    Write the page for the shape (and the chain of files it includes) to
+    the directory, and return the path of the page.
+    """
+    include = ''
+
+    # Write the chain from the deepest include up to the page
+    for depth in range(shape.include_depth, 0, -1):
+        name = f'include_{depth}.pyhp'
+        (base_dir / name).write_text(
+            generate_template(1, shape.hypertext_lines, include),
+            encoding='utf-8')
+        include = name
+
+    page_path = base_dir / PAGE_NAME
+    page_path.write_text(
+        generate_template(shape.blocks, shape.hypertext_lines, include),
+        encoding='utf-8')
+
+    return page_path
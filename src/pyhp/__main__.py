@@ -3,16 +3,23 @@ PyHP: Python Hypertext Preprocessor
 """
 
 from argparse import ArgumentParser
+from functools import partial
 from pathlib import PurePath, Path
 
 try:
     from pyhp_interface import Pyhp
     from file_processing import SystemFileProcessor
     from pyhp_flask import create_app
+    from precompilation import compile_directory
+    from prefork_server import PreforkServer, run_benchmark, DEFAULT_WORKERS
+    from compression import precompress_directory, DEFAULT_MIN_SIZE
 except ImportError:
     from .pyhp_interface import Pyhp
     from .file_processing import SystemFileProcessor
     from .pyhp_flask import create_app
+    from .precompilation import compile_directory
+    from .prefork_server import PreforkServer, run_benchmark, DEFAULT_WORKERS
+    from .compression import precompress_directory, DEFAULT_MIN_SIZE
 
 
 if __name__ == '__main__':
@@ -30,6 +37,45 @@ if __name__ == '__main__':
     server_parser.add_argument('directory', help='Directory to serve')
     server_parser.add_argument('--port', help='Port to serve on', type=int,
                                default=5000)
+    server_parser.add_argument('--host', help='Host to serve on',
+                               default='127.0.0.1')
+    server_parser.add_argument('--workers', type=int,
+                               help='Number of worker processes to pre-fork '
+                                    '(default: run the single-process '
+                                    'development server)')
+
+    benchmark_parser = action_parser.add_parser(
+        'benchmark', help='Measure the requests per second that a '
+                          'pre-forking server handles')
+    benchmark_parser.add_argument('directory', help='Directory to serve')
+    benchmark_parser.add_argument('--path', help='Path to request',
+                                  default='/')
+    benchmark_parser.add_argument('--workers', type=int,
+                                  help='Number of worker processes',
+                                  default=DEFAULT_WORKERS)
+    benchmark_parser.add_argument('--requests', type=int,
+                                  help='Number of requests to send',
+                                  default=1000)
+    benchmark_parser.add_argument('--concurrency', type=int,
+                                  help='Number of requests to send at once',
+                                  default=8)
+
+    compile_parser = action_parser.add_parser(
+        'compile', help='Compile the PyHP files in a directory ahead of time')
+    compile_parser.add_argument('directory', help='Directory to compile')
+    compile_parser.add_argument('--output',
+                                help='Directory to write the compiled files '
+                                     'to (default: __pyhpcache__ in the '
+                                     'directory)')
+
+    compress_parser = action_parser.add_parser(
+        'compress', help='Write compressed copies of the files in a '
+                         'directory that are not PyHP files')
+    compress_parser.add_argument('directory', help='Directory to compress')
+    compress_parser.add_argument('--min-size', type=int,
+                                 help='Size in bytes below which files are '
+                                      'not compressed',
+                                 default=DEFAULT_MIN_SIZE)
 
     args = parser.parse_args()
 
@@ -38,8 +84,33 @@ if __name__ == '__main__':
         root_pyhp = Pyhp(PurePath(), SystemFileProcessor(base_dir),
                          args.debug)
         print(root_pyhp.run(PurePath(args.file).name))
+    elif args.action == 'server' and args.workers is not None:
+        server = PreforkServer(
+            partial(create_app, args.directory, {'DEBUG': args.debug}),
+            args.host, args.port, args.workers, log_requests=args.debug)
+        preloaded_paths = server.load_app()
+        print(f'Preloaded {len(preloaded_paths)} templates, serving on '
+              f'http://{args.host}:{args.port} with {args.workers} workers')
+        server.serve_forever()
     elif args.action == 'server':
         app = create_app(args.directory)
-        app.run(port=args.port, debug=args.debug)
+        app.run(host=args.host, port=args.port, debug=args.debug)
+    elif args.action == 'benchmark':
+        result = run_benchmark(
+            partial(create_app, args.directory, {'DEBUG': args.debug}),
+            args.path, args.workers, args.requests, args.concurrency)
+        print(f'{result.requests} requests ({result.errors} errors) in '
+              f'{result.seconds:.2f}s: '
+              f'{result.requests_per_second:.1f} requests/second')
+    elif args.action == 'compile':
+        compiled_paths = compile_directory(
+            Path(args.directory),
+            None if args.output is None else Path(args.output))
+        for compiled_path in compiled_paths:
+            print(f'Compiled {compiled_path}')
+    elif args.action == 'compress':
+        for compressed_path in precompress_directory(Path(args.directory),
+                                                     args.min_size):
+            print(f'Compressed {compressed_path}')
     else:
         parser.print_help()
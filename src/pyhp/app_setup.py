@@ -0,0 +1,315 @@
+"""
+Sets up the state shared by every request to a PyHP app from the app's
+config, so that the Flask and ASGI apps are configured in the same way.
+"""
+
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path, PurePath
+from typing import Any, ContextManager, Optional
+
+try:
+    from pyhp_interface import Pyhp
+    from file_processing import SystemFileProcessor, \
+        DEFAULT_PATH_CACHE_SIZE, DEFAULT_PATH_CACHE_TTL, \
+        DEFAULT_MAX_MAPPED_FILES, PYHP_FILE_EXTENSION
+    from file_watching import DEFAULT_POLL_INTERVAL
+    from template_cache import TemplateCache, DEFAULT_MAX_BYTES
+    from precompilation import load_artifact, get_compiled_dir
+    from namespaces import NamespaceFactory
+    from response_cache import ResponseCache, \
+        DEFAULT_MAX_BYTES as DEFAULT_RESPONSE_CACHE_MAX_BYTES
+    from fragment_cache import FragmentCache, \
+        DEFAULT_MAX_BYTES as DEFAULT_FRAGMENT_CACHE_MAX_BYTES
+    from cache_backends import CacheBackend, MemoryCacheBackend
+    from concurrent_rendering import IncludePool, DEFAULT_MAX_WORKERS
+    from render_context import RenderContext
+    from instrumentation import RenderProfile, instrument_request
+    from metrics import RequestMetrics
+    from process_pool import ProcessPoolRenderer
+    from render_limits import RenderLimits, RenderLimitExceeded, \
+        limit_render
+    from compression import DEFAULT_MIN_SIZE as DEFAULT_COMPRESSION_MIN_SIZE
+except ImportError:
+    from .pyhp_interface import Pyhp
+    from .file_processing import SystemFileProcessor, \
+        DEFAULT_PATH_CACHE_SIZE, DEFAULT_PATH_CACHE_TTL, \
+        DEFAULT_MAX_MAPPED_FILES, PYHP_FILE_EXTENSION
+    from .file_watching import DEFAULT_POLL_INTERVAL
+    from .template_cache import TemplateCache, DEFAULT_MAX_BYTES
+    from .precompilation import load_artifact, get_compiled_dir
+    from .namespaces import NamespaceFactory
+    from .response_cache import ResponseCache, \
+        DEFAULT_MAX_BYTES as DEFAULT_RESPONSE_CACHE_MAX_BYTES
+    from .fragment_cache import FragmentCache, \
+        DEFAULT_MAX_BYTES as DEFAULT_FRAGMENT_CACHE_MAX_BYTES
+    from .cache_backends import CacheBackend, MemoryCacheBackend
+    from .concurrent_rendering import IncludePool, DEFAULT_MAX_WORKERS
+    from .render_context import RenderContext
+    from .instrumentation import RenderProfile, instrument_request
+    from .metrics import RequestMetrics
+    from .process_pool import ProcessPoolRenderer
+    from .render_limits import RenderLimits, RenderLimitExceeded, \
+        limit_render
+    from .compression import DEFAULT_MIN_SIZE as \
+        DEFAULT_COMPRESSION_MIN_SIZE
+
+
+DEFAULT_CONFIG = {
+    'PYHP_PATH_CACHE_SIZE': DEFAULT_PATH_CACHE_SIZE,
+    # Seconds before cached paths are checked again (None to cache forever)
+    'PYHP_PATH_CACHE_TTL': DEFAULT_PATH_CACHE_TTL,
+    # Watch the base directory for changes, and cache paths and templates
+    # until they change (instead of for PYHP_PATH_CACHE_TTL seconds)
+    'PYHP_WATCH_FILES': False,
+    # Used if inotify is not available
+    'PYHP_WATCH_POLL_INTERVAL': DEFAULT_POLL_INTERVAL,
+    'PYHP_TEMPLATE_CACHE_MAX_BYTES': DEFAULT_MAX_BYTES,
+    # Directory of precompiled templates (defaults to __pyhpcache__ in the
+    # base directory)
+    'PYHP_COMPILED_DIR': None,
+    # Stream the page once this many bytes have been rendered (None to
+    # render the whole page before responding)
+    'PYHP_STREAM_BUFFER_SIZE': None,
+    # Memory-map templates instead of reading them, so that hypertext is
+    # sent straight from the page cache (files must then be replaced by
+    # renaming, rather than rewritten in place)
+    'PYHP_MEMORY_MAP_FILES': False,
+    # Files read instead of mapped once this many are mapped (each map holds
+    # a file descriptor, before Python 3.13)
+    'PYHP_MAX_MAPPED_FILES': DEFAULT_MAX_MAPPED_FILES,
+    # Modules imported when the app is created, and available to every page
+    # without importing them (for example ['json', 'numpy as np'])
+    'PYHP_PRELOAD_MODULES': [],
+    # Other names available to every page
+    'PYHP_HELPERS': {},
+    # Pages that call pyhp.cache are cached (for GET requests) up to this
+    # many bytes in total
+    'PYHP_RESPONSE_CACHE_MAX_BYTES': DEFAULT_RESPONSE_CACHE_MAX_BYTES,
+    # Code blocks such as <pyhp cache="300"> are cached up to this many
+    # bytes in total
+    'PYHP_FRAGMENT_CACHE_MAX_BYTES': DEFAULT_FRAGMENT_CACHE_MAX_BYTES,
+    # Creates the backend of each cache, given the name and size of the
+    # cache. For example, partial(SQLiteCacheBackend, 'cache.db') shares the
+    # page, fragment and template caches between the workers on a host. If
+    # None, each worker keeps its own caches in memory.
+    'PYHP_CACHE_BACKEND': None,
+    # Threads that pyhp.include_many renders includes on (each app has its
+    # own pool)
+    'PYHP_INCLUDE_MAX_WORKERS': DEFAULT_MAX_WORKERS,
+    # Add a Server-Timing header to each page (that is not streamed), with
+    # the time spent loading, parsing, compiling and running it
+    'PYHP_SERVER_TIMING': False,
+    # In debug mode, write a cProfile dump of each page to this directory
+    'PYHP_PROFILE_DIR': None,
+    # Serve metrics (request counts, latency histograms and cache stats) in
+    # the Prometheus text format at this path (None to not collect metrics).
+    # Each process keeps its own metrics.
+    'PYHP_METRICS_PATH': None,
+    # Only serve the metrics to requests with an "Authorization: Bearer
+    # <token>" header (None to serve them to every client that can reach
+    # the path)
+    'PYHP_METRICS_TOKEN': None,
+    # Render pages in this many worker processes, each with its own copy of
+    # the app's state and every template compiled (None to render pages in
+    # the server process). Pages are not streamed when this is set.
+    'PYHP_RENDER_PROCESSES': None,
+    # Limits on each render (None for no limit). Pages that exceed the
+    # timeout or CPU time (in seconds) get a 503 response, and pages that
+    # exceed the output or memory limit (in bytes) get a 500 response. The
+    # memory limit is checked with tracemalloc, which slows down every
+    # allocation in the process. The ASGI app only supports the CPU time
+    # limit with PYHP_RENDER_PROCESSES, as it renders every page on one
+    # thread.
+    'PYHP_RENDER_TIMEOUT': None,
+    'PYHP_RENDER_CPU_TIME': None,
+    'PYHP_MAX_OUTPUT_BYTES': None,
+    'PYHP_MAX_RENDER_MEMORY': None,
+    # Compress pages with gzip (or brotli, if it is installed) for clients
+    # that accept it, and send the compressed copies of other files written
+    # by `python -m pyhp compress`. Pages smaller than
+    # PYHP_COMPRESSION_MIN_SIZE bytes are sent uncompressed.
+    'PYHP_COMPRESSION': False,
+    'PYHP_COMPRESSION_MIN_SIZE': DEFAULT_COMPRESSION_MIN_SIZE,
+}
+
+
+@dataclass
+class AppState:
+    """Stores the objects shared by every request to an app."""
+    # pylint: disable=too-many-instance-attributes
+    config: dict[str, Any]
+    file_processor: SystemFileProcessor
+    compiled_dir: Path
+    template_cache: TemplateCache
+    response_cache: ResponseCache
+    fragment_cache: FragmentCache
+    namespace_factory: NamespaceFactory
+    include_pool: IncludePool
+    metrics: Optional[RequestMetrics] = None
+    process_pool: Optional[ProcessPoolRenderer] = None
+    render_limits: Optional[RenderLimits] = None
+
+    def resolve_path(self, path: str) -> PurePath:
+        """
+        Return the path of the file to serve for the requested path.
+
+        Raises FileNotFoundError if there is no such file (or it is a
+        compiled template), and IsADirectoryError if it is a directory.
+        """
+        absolute_path = self.file_processor.get_absolute_path(PurePath(path))
+        if self.compiled_dir in (absolute_path, *absolute_path.parents):
+            raise FileNotFoundError('Compiled templates are not served.')
+
+        return self.file_processor.get_true_path(PurePath(path))
+
+    def instrument_request(self, path: str
+                           ) -> ContextManager[Optional[RenderProfile]]:
+        """
+        Record the timings of a request (if PYHP_SERVER_TIMING is set, or
+        metrics are collected), and profile it (if PYHP_PROFILE_DIR is set,
+        in debug mode).
+        """
+        profile_dir = self.config['PYHP_PROFILE_DIR']
+        if profile_dir is not None and self.config['DEBUG']:
+            profile_dir = Path(profile_dir)
+        else:
+            profile_dir = None
+
+        return instrument_request(path,
+                                  self.config['PYHP_SERVER_TIMING'] or
+                                  self.metrics is not None,
+                                  profile_dir)
+
+    def limit_render(self) -> ContextManager:
+        """Apply the app's render limits (if any) to the block."""
+        if self.render_limits is None:
+            return nullcontext()
+        return limit_render(self.render_limits)
+
+    def record_limit_exceeded(self, error: RenderLimitExceeded):
+        """Count a render that exceeded a limit (if metrics are collected)."""
+        if self.metrics is not None:
+            self.metrics.limits_exceeded.inc(error.limit)
+
+    def preload_templates(self) -> list[PurePath]:
+        """
+        Compile every PyHP file that the app serves into the template cache,
+        and return their relative paths.
+        """
+        base_dir = self.file_processor.base_dir
+        preloaded = []
+
+        for path in sorted(base_dir.rglob(f'*.{PYHP_FILE_EXTENSION}')):
+            if self.compiled_dir in path.parents:
+                continue
+
+            relative_path = PurePath(path.relative_to(base_dir))
+            self.template_cache.get_template(self.file_processor,
+                                             relative_path)
+            preloaded.append(relative_path)
+
+        return preloaded
+
+    # pylint: disable=too-many-arguments
+    def create_pyhp(self, current_dir: PurePath, debug: bool,
+                    cookies: dict[str, str], get: dict[str, str],
+                    post: dict[str, str]) -> Pyhp:
+        """Create the Pyhp object for a request."""
+        render_context = RenderContext(self.file_processor,
+                                       self.template_cache,
+                                       self.namespace_factory,
+                                       self.fragment_cache, self.include_pool)
+        return Pyhp(current_dir, self.file_processor, debug, cookies, get,
+                    post, render_context=render_context)
+
+
+def create_app_state(base_dir: Path, config: dict[str, Any]) -> AppState:
+    """
+    Create the shared state of an app from its config (which must include
+    every key in DEFAULT_CONFIG).
+    """
+    file_processor = SystemFileProcessor(base_dir,
+                                         config['PYHP_PATH_CACHE_SIZE'],
+                                         config['PYHP_PATH_CACHE_TTL'],
+                                         config['PYHP_MEMORY_MAP_FILES'],
+                                         max_mapped_files=config[
+                                             'PYHP_MAX_MAPPED_FILES'])
+
+    compiled_dir = config['PYHP_COMPILED_DIR']
+    compiled_dir = get_compiled_dir(
+        base_dir, None if compiled_dir is None else Path(compiled_dir))
+
+    def create_backend(name: str, max_bytes: int) -> Optional[CacheBackend]:
+        if config['PYHP_CACHE_BACKEND'] is None:
+            return None
+        return config['PYHP_CACHE_BACKEND'](name, max_bytes)
+
+    max_bytes = config['PYHP_TEMPLATE_CACHE_MAX_BYTES']
+    template_cache = TemplateCache(max_bytes,
+                                   partial(load_artifact, compiled_dir),
+                                   create_backend('templates', max_bytes))
+    file_processor.add_change_listener(
+        partial(template_cache.invalidate, file_processor))
+
+    max_bytes = config['PYHP_RESPONSE_CACHE_MAX_BYTES']
+    response_cache = ResponseCache(max_bytes,
+                                   create_backend('pages', max_bytes))
+    file_processor.add_change_listener(response_cache.invalidate)
+
+    max_bytes = config['PYHP_FRAGMENT_CACHE_MAX_BYTES']
+    fragment_cache = FragmentCache(max_bytes,
+                                   create_backend('fragments', max_bytes))
+    file_processor.add_change_listener(fragment_cache.invalidate)
+
+    namespace_factory = NamespaceFactory(config['PYHP_PRELOAD_MODULES'],
+                                         config['PYHP_HELPERS'],
+                                         preload=True)
+
+    metrics = None
+    if config['PYHP_METRICS_PATH'] is not None:
+        metrics = RequestMetrics()
+        metrics.add_cache('paths', lambda: file_processor.cache)
+        metrics.add_cache('templates', lambda: template_cache.cache)
+        for name, cache in (('pages', response_cache),
+                            ('fragments', fragment_cache)):
+            # Caches in other backends keep their own stats
+            if isinstance(cache.backend, MemoryCacheBackend):
+                metrics.add_cache(name,
+                                  lambda backend=cache.backend: backend.cache)
+
+    render_limits = RenderLimits(config['PYHP_RENDER_TIMEOUT'],
+                                 config['PYHP_RENDER_CPU_TIME'],
+                                 config['PYHP_MAX_OUTPUT_BYTES'],
+                                 config['PYHP_MAX_RENDER_MEMORY'])
+    if render_limits == RenderLimits():
+        render_limits = None
+
+    # Started before any watcher thread, since the workers are forked
+    process_pool = None
+    if config['PYHP_RENDER_PROCESSES'] is not None:
+        process_pool = ProcessPoolRenderer(
+            partial(create_app_state, base_dir, get_worker_config(config)),
+            config['PYHP_RENDER_PROCESSES'])
+
+    if config['PYHP_WATCH_FILES']:
+        file_processor.start_watching(config['PYHP_WATCH_POLL_INTERVAL'])
+
+    return AppState(config, file_processor, compiled_dir, template_cache,
+                    response_cache, fragment_cache, namespace_factory,
+                    IncludePool(config['PYHP_INCLUDE_MAX_WORKERS']),
+                    metrics, process_pool, render_limits)
+
+
+def get_worker_config(config: dict[str, Any]) -> dict[str, Any]:
+    """
+    Return the config of the app state in each render process, which renders
+    pages itself and does not collect metrics (since the server does).
+    """
+    worker_config = {key: config[key] for key in DEFAULT_CONFIG}
+    worker_config['DEBUG'] = config.get('DEBUG', False)
+    worker_config['PYHP_RENDER_PROCESSES'] = None
+    worker_config['PYHP_METRICS_PATH'] = None
+
+    return worker_config
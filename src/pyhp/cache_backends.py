@@ -0,0 +1,251 @@
+"""
+Sets up the backends that the page, fragment and template caches store
+their entries in.
+
+MemoryCacheBackend keeps entries in the memory of the current process, and
+SQLiteCacheBackend keeps them in a file that every worker on the host can
+share. Other backends (for example one for a cache server) only need to
+implement the CacheBackend interface.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import os
+import sqlite3
+from pathlib import Path
+from threading import local
+from time import time
+from typing import Callable, Optional, Union
+
+try:
+    from caching import LRUCache
+except ImportError:
+    from .caching import LRUCache
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# How out of date the time an SQLite entry was last used may be
+ACCESS_TIME_RESOLUTION = 1.0
+
+
+class CacheBackend:
+    """
+    Abstract class for storing bytes values under string keys, each of which
+    may expire ttl seconds after it is stored.
+    """
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+# Creates the backend for a cache, given the name of the cache and its size
+CacheBackendFactory = Callable[[str, int], CacheBackend]
+
+
+class MemoryCacheBackend(CacheBackend):
+    """A backend that stores entries in an LRU cache in this process."""
+    def __init__(self, namespace: str = 'default',
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self._namespace = namespace
+        self._cache = LRUCache(max_bytes)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._cache.get(key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        self._cache.set(key, value, len(value), ttl)
+
+    def delete(self, key: str):
+        self._cache.delete(key)
+
+    def clear(self):
+        self._cache.clear()
+
+    @property
+    def cache(self) -> LRUCache:
+        """Return the underlying LRU cache."""
+        return self._cache
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    A backend that stores entries in an SQLite database, so that they are
+    shared by every process on the host that uses the same file.
+
+    Each cache stores its entries under its own namespace, so several caches
+    can share a file. Once a namespace is larger than max_bytes, its least
+    recently used entries are removed. The size of each namespace is kept up
+    to date by triggers, so storing an entry does not have to add up every
+    entry, and the time an entry was last used is only written once it is
+    ACCESS_TIME_RESOLUTION seconds out of date, so most lookups only read.
+    """
+    def __init__(self, path: Union[str, Path], namespace: str = 'default',
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self._path = str(path)
+        self._namespace = namespace
+        self._max_bytes = max_bytes
+        self._local = local()
+        self._pid = os.getpid()
+
+        with self._connect() as connection:
+            self._create_tables(connection)
+            connection.execute(
+                'INSERT OR IGNORE INTO pyhp_cache_sizes VALUES (?, 0)',
+                (self._namespace,),
+            )
+
+    @staticmethod
+    def _create_tables(connection: sqlite3.Connection):
+        columns = [row[1] for row in
+                   connection.execute('PRAGMA table_info(pyhp_cache)')]
+        # The entries of older versions have no size or access time, and are
+        # simply dropped
+        if columns and 'accessed_at' not in columns:
+            connection.execute('DROP TABLE IF EXISTS pyhp_cache')
+
+        connection.executescript('''
+            CREATE TABLE IF NOT EXISTS pyhp_cache (
+                namespace TEXT NOT NULL, key TEXT NOT NULL,
+                value BLOB NOT NULL, size INTEGER NOT NULL, expires_at REAL,
+                accessed_at REAL NOT NULL, PRIMARY KEY (namespace, key));
+            CREATE INDEX IF NOT EXISTS pyhp_cache_accessed_at
+                ON pyhp_cache (namespace, accessed_at);
+            CREATE TABLE IF NOT EXISTS pyhp_cache_sizes (
+                namespace TEXT PRIMARY KEY, size INTEGER NOT NULL);
+
+            CREATE TRIGGER IF NOT EXISTS pyhp_cache_insert
+            AFTER INSERT ON pyhp_cache BEGIN
+                UPDATE pyhp_cache_sizes SET size = size + NEW.size
+                WHERE namespace = NEW.namespace;
+            END;
+            CREATE TRIGGER IF NOT EXISTS pyhp_cache_update
+            AFTER UPDATE OF size ON pyhp_cache BEGIN
+                UPDATE pyhp_cache_sizes SET size = size + NEW.size - OLD.size
+                WHERE namespace = NEW.namespace;
+            END;
+            CREATE TRIGGER IF NOT EXISTS pyhp_cache_delete
+            AFTER DELETE ON pyhp_cache BEGIN
+                UPDATE pyhp_cache_sizes SET size = size - OLD.size
+                WHERE namespace = OLD.namespace;
+            END;
+        ''')
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections cannot be shared between threads, or with the processes
+        # forked from this one
+        if self._pid != os.getpid():
+            self._local = local()
+            self._pid = os.getpid()
+
+        connection = getattr(self._local, 'connection', None)
+
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+
+        return connection
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time()
+        connection = self._connect()
+        row = connection.execute(
+            'SELECT value, accessed_at FROM pyhp_cache '
+            'WHERE namespace = ? AND key = ? '
+            'AND (expires_at IS NULL OR expires_at > ?)',
+            (self._namespace, key, now),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        if row[1] <= now - ACCESS_TIME_RESOLUTION:
+            with connection:
+                connection.execute(
+                    'UPDATE pyhp_cache SET accessed_at = ? '
+                    'WHERE namespace = ? AND key = ?',
+                    (now, self._namespace, key),
+                )
+
+        return bytes(row[0])
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        if len(value) > self._max_bytes:
+            self.delete(key)
+            return
+
+        now = time()
+        expires_at = None if ttl is None else now + ttl
+
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT INTO pyhp_cache VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (namespace, key) DO UPDATE SET '
+                'value = excluded.value, size = excluded.size, '
+                'expires_at = excluded.expires_at, '
+                'accessed_at = excluded.accessed_at',
+                (self._namespace, key, value, len(value), expires_at, now),
+            )
+
+            if self._get_size(connection) > self._max_bytes:
+                self._evict(connection, now)
+
+    def _get_size(self, connection: sqlite3.Connection) -> int:
+        row = connection.execute(
+            'SELECT size FROM pyhp_cache_sizes WHERE namespace = ?',
+            (self._namespace,),
+        ).fetchone()
+        return 0 if row is None else row[0]
+
+    def _evict(self, connection: sqlite3.Connection, now: float):
+        connection.execute(
+            'DELETE FROM pyhp_cache WHERE namespace = ? AND expires_at <= ?',
+            (self._namespace, now),
+        )
+        total_size = self._get_size(connection)
+
+        # Remove the least recently used entries until the namespace fits
+        rows = connection.execute(
+            'SELECT key, size FROM pyhp_cache WHERE namespace = ? '
+            'ORDER BY accessed_at',
+            (self._namespace,),
+        )
+        evicted_keys = []
+
+        for key, size in rows:
+            if total_size <= self._max_bytes:
+                break
+            evicted_keys.append((self._namespace, key))
+            total_size -= size
+        rows.close()
+
+        connection.executemany(
+            'DELETE FROM pyhp_cache WHERE namespace = ? AND key = ?',
+            evicted_keys,
+        )
+
+    def delete(self, key: str):
+        with self._connect() as connection:
+            connection.execute(
+                'DELETE FROM pyhp_cache WHERE namespace = ? AND key = ?',
+                (self._namespace, key),
+            )
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM pyhp_cache WHERE namespace = ?',
+                               (self._namespace,))
+
+    @property
+    def path(self) -> str:
+        """Return the path of the database."""
+        return self._path
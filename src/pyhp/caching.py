@@ -0,0 +1,105 @@
+"""
+Sets up a small thread-safe LRU cache used by the PyHP caches.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """
+    A thread-safe least-recently-used cache.
+
+    Each entry has a size (1 by default), and the least recently used entries
+    are evicted once the total size exceeds max_size. If a ttl is given,
+    entries also expire that many seconds after they are stored.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[Any, int, float]] = \
+            OrderedDict()
+        self._total_size = 0
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """Return the value for the key, or the default if it is missing."""
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[2] <= monotonic():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, size: int = 1,
+            ttl: Optional[float] = None):
+        """
+        Store a value, evicting old entries if the cache is too large.
+
+        The ttl overrides the cache's ttl for this entry.
+        """
+        if size > self._max_size:
+            self.delete(key)
+            return
+
+        if ttl is None:
+            ttl = self._ttl
+        expires_at = float('inf') if ttl is None else monotonic() + ttl
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self._total_size += size
+
+            while self._total_size > self._max_size:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._total_size -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        """Remove the key from the cache if it is present."""
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self._total_size = 0
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_size -= entry[1]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[2] > monotonic()
+
+    @property
+    def max_size(self) -> int:
+        """Return the maximum total size of the cache."""
+        return self._max_size
+
+    @property
+    def total_size(self) -> int:
+        """Return the total size of the entries in the cache."""
+        return self._total_size
@@ -4,63 +4,351 @@ Sets up functions for executing PyHP code blocks and code text.
 
 # pylint: disable=missing-function-docstring
 
+import sys
 from io import StringIO
-from contextlib import redirect_stdout
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
 from traceback import format_exc
-from typing import TYPE_CHECKING, Any
+from ast import PyCF_ALLOW_TOP_LEVEL_AWAIT
+from inspect import CO_COROUTINE  # pylint: disable=no-name-in-module
+from types import CodeType
+from typing import TYPE_CHECKING, Any, AsyncIterator, Union, Optional, \
+    TextIO, Iterator
 
 try:
     from text_processing import prepare_code_text
     from hypertext_processing import UglySoup, Section
+    from import_resolution import import_from
+    from fragment_cache import FragmentOptions, get_fragment_options
+    from instrumentation import record_section
+    from render_limits import get_current_budget, interruptible, \
+        await_interruptibly
+    from output_writer import OutputWriter
 except ImportError:
     from .text_processing import prepare_code_text
     from .hypertext_processing import UglySoup, Section
+    from .import_resolution import import_from
+    from .fragment_cache import FragmentOptions, get_fragment_options
+    from .instrumentation import record_section
+    from .render_limits import get_current_budget, interruptible, \
+        await_interruptibly
+    from .output_writer import OutputWriter
 
 if TYPE_CHECKING:
     from .pyhp_interface import Pyhp
+    from .template_cache import CompiledTemplate
 
 
-def run_parsed_code(dom: UglySoup, pyhp_class: 'Pyhp') -> str:
-    output_text = []
+_current_output: ContextVar[Optional[TextIO]] = ContextVar(
+    'pyhp_output', default=None)
+_install_lock = Lock()
+
+
+class OutputProxy:
+    """
+    A stand-in for sys.stdout that writes to the output buffer of the render
+    running in the current thread (or context), and to the original stream
+    otherwise.
+
+    This allows pages to be rendered concurrently, unlike redirect_stdout,
+    which replaces the process-wide sys.stdout.
+    """
+    def __init__(self, stream: Optional[TextIO]):
+        self._stream = stream
+
+    def write(self, text: str) -> int:
+        target = _current_output.get()
+
+        if target is None:
+            target = self._stream
+
+        if target is None:
+            return len(text)
+
+        return target.write(text)
+
+    def flush(self):
+        target = _current_output.get()
+
+        if target is None:
+            target = self._stream
+
+        if target is not None:
+            target.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+def install_output_proxy():
+    """Replace sys.stdout with an OutputProxy, if it is not one already."""
+    with _install_lock:
+        if not isinstance(sys.stdout, OutputProxy):
+            sys.stdout = OutputProxy(sys.stdout)
+
+
+@contextmanager
+def capture_output(buffer: TextIO) -> Iterator[TextIO]:
+    """Send everything printed in the current context to the buffer."""
+    if not isinstance(sys.stdout, OutputProxy):
+        install_output_proxy()
+
+    token = _current_output.set(buffer)
+
+    try:
+        yield buffer
+    finally:
+        _current_output.reset(token)
+
+
+def get_output_writer() -> Optional[OutputWriter]:
+    """
+    Return the buffer that the current code block prints to, if the page is
+    being rendered as bytes.
+    """
+    target = _current_output.get()
+    return target if isinstance(target, OutputWriter) else None
+
+
+def run_parsed_code(dom: Union[UglySoup, 'CompiledTemplate'],
+                    pyhp_class: 'Pyhp') -> str:
+    # Included pages are run, and their output is counted by the page
+    # that prints it
+    return ''.join(iter_parsed_code(dom, pyhp_class, count_output=False))
+
+
+async def run_parsed_code_async(dom: Union[UglySoup, 'CompiledTemplate'],
+                                pyhp_class: 'Pyhp') -> str:
+    return ''.join([output async for output in
+                    iter_parsed_code_async(dom, pyhp_class,
+                                           count_output=False)])
+
+
+def iter_parsed_code(dom: Union[UglySoup, 'CompiledTemplate'],
+                     pyhp_class: 'Pyhp', encoded: bool = False,
+                     count_output: bool = True
+                     ) -> Iterator[Union[str, bytes, memoryview]]:
+    """
+    Run the sections one at a time, yielding the output of each.
+
+    If encoded is True, the output is yielded as UTF-8 encoded bytes (in
+    chunks of bounded size for code blocks), and hypertext parsed from
+    bytes is yielded without being copied. If the
+    render has limits, they are checked after each section (counting the
+    output towards the limit if count_output is True).
+    """
+    budget = get_current_budget()
 
     for section in dom.sections:
-        success, output = run_section(section, pyhp_class)
+        success, output = run_section(section, pyhp_class, encoded)
 
-        output_text.append(output)
+        if budget is not None:
+            budget.check(get_size(output) if count_output else 0)
+
+        if isinstance(output, list):
+            yield from output
+        elif output:
+            yield output
 
         if not success:
             break
 
-    return ''.join(output_text)
 
+async def iter_parsed_code_async(dom: Union[UglySoup, 'CompiledTemplate'],
+                                 pyhp_class: 'Pyhp', encoded: bool = False,
+                                 count_output: bool = True
+                                 ) -> AsyncIterator[Union[str, bytes,
+                                                          memoryview]]:
+    """
+    Run the sections one at a time, yielding the output of each, and
+    awaiting code blocks that use await.
+    """
+    budget = get_current_budget()
 
-def run_section(section: Section,
-                pyhp_class: 'Pyhp') -> (bool, str):
-    if section.is_pyhp_code:
-        success, output = run_code_text(prepare_code_text(section.text),
-                                        pyhp_class.globals, pyhp_class.locals)
+    for section in dom.sections:
+        success, output = await run_section_async(section, pyhp_class,
+                                                  encoded)
 
-        if not success and not pyhp_class.debug:
-            raise RuntimeError(output)
+        if budget is not None:
+            budget.check(get_size(output) if count_output else 0)
 
-        return success, output
+        if isinstance(output, list):
+            for chunk in output:
+                yield chunk
+        elif output:
+            yield output
 
-    return True, section.text
+        if not success:
+            break
 
 
-def run_code_text(code_text: str,
-                  globals_: dict[str, Any],
-                  locals_: dict[str, Any]) -> (bool, str):
-    output_text = StringIO()
+def run_section(section: Section, pyhp_class: 'Pyhp',
+                encoded: bool = False
+                ) -> (bool, Union[str, list[bytes], bytes, memoryview]):
+    if not section.is_pyhp_code:
+        return True, get_hypertext(section, encoded)
 
-    try:
-        with redirect_stdout(output_text):
-            exec(code_text, globals_, locals_)  # pylint: disable=exec-used
-    except Exception:  # pylint: disable=broad-except
-        success = False
-        output = f'{output_text.getvalue()}<pre>{format_exc()}</pre>'
+    options, output = get_cached_output(section, pyhp_class)
+
+    if output is not None:
+        success = True
     else:
+        with import_from(pyhp_class.absolute_dir), record_section(section):
+            success, output = run_code_text(get_code(section),
+                                            pyhp_class.globals,
+                                            pyhp_class.locals, encoded)
+
+        if success and options is not None:
+            pyhp_class.render_context.fragment_cache.set(
+                options, pyhp_class, decode_output(output))
+
+    return check_output(success, output, pyhp_class, encoded)
+
+
+async def run_section_async(section: Section, pyhp_class: 'Pyhp',
+                            encoded: bool = False
+                            ) -> (bool, Union[str, list[bytes], bytes,
+                                              memoryview]):
+    if not section.is_pyhp_code:
+        return True, get_hypertext(section, encoded)
+
+    options, output = get_cached_output(section, pyhp_class)
+
+    if output is not None:
         success = True
-        output = output_text.getvalue()
+    else:
+        with import_from(pyhp_class.absolute_dir), record_section(section):
+            success, output = await run_code_text_async(get_code(section),
+                                                        pyhp_class.globals,
+                                                        pyhp_class.locals,
+                                                        encoded)
+
+        if success and options is not None:
+            pyhp_class.render_context.fragment_cache.set(
+                options, pyhp_class, decode_output(output))
+
+    return check_output(success, output, pyhp_class, encoded)
+
+
+def get_hypertext(section: Section,
+                  encoded: bool = False) -> Union[str, bytes, memoryview]:
+    if encoded:
+        return section.data
+
+    return section.text
+
+
+def get_code(section: Section) -> Union[str, CodeType]:
+    if section.code is None:
+        return prepare_code_text(section.text)
+
+    return section.code
+
+
+def get_cached_output(section: Section, pyhp_class: 'Pyhp'
+                      ) -> (Optional[FragmentOptions], Optional[str]):
+    """
+    Return the cache options of the section, and its cached output (or None
+    if the section is not cached, or its output has not been cached yet).
+    """
+    options = get_fragment_options(section)
+
+    if options is None:
+        return None, None
+
+    return options, pyhp_class.render_context.fragment_cache.get(options,
+                                                                 pyhp_class)
+
+
+def check_output(success: bool, output: Union[str, list[bytes]],
+                 pyhp_class: 'Pyhp', encoded: bool = False
+                 ) -> (bool, Union[str, list[bytes]]):
+    if not success and not pyhp_class.debug:
+        raise RuntimeError(output)
+
+    # Errors and cached output are strings, even when the page is encoded
+    if encoded and isinstance(output, str):
+        output = [output.encode('utf-8')] if output else []
 
     return success, output
+
+
+def get_size(output: Union[str, list[bytes], bytes, memoryview]) -> int:
+    if isinstance(output, list):
+        return sum(map(len, output))
+    return len(output)
+
+
+def decode_output(output: Union[str, list[bytes]]) -> str:
+    if isinstance(output, list):
+        return b''.join(output).decode('utf-8')
+    return output
+
+
+def is_async_code(code_text: Union[str, CodeType]) -> bool:
+    """Return whether the code uses await, and so must be awaited."""
+    return isinstance(code_text, CodeType) and \
+        bool(code_text.co_flags & CO_COROUTINE)
+
+
+def run_code_text(code_text: Union[str, CodeType],
+                  globals_: dict[str, Any],
+                  locals_: dict[str, Any],
+                  encoded: bool = False) -> (bool, Union[str, list[bytes]]):
+    """
+    Run the code, and return whether it succeeded, and its output (or the
+    error, as a string). If encoded is True, the output is returned as a
+    list of UTF-8 encoded chunks.
+    """
+    output_text = OutputWriter() if encoded else StringIO()
+
+    try:
+        with capture_output(output_text):
+            if is_async_code(code_text):
+                raise RuntimeError('Code blocks that use await can only be '
+                                   'run asynchronously (for example, by the '
+                                   'ASGI app).')
+
+            with interruptible():
+                exec(code_text, globals_, locals_)  # pylint: disable=exec-used
+    except Exception:  # pylint: disable=broad-except
+        return False, format_error(output_text)
+
+    return True, get_output(output_text)
+
+
+async def run_code_text_async(code_text: Union[str, CodeType],
+                              globals_: dict[str, Any],
+                              locals_: dict[str, Any],
+                              encoded: bool = False
+                              ) -> (bool, Union[str, list[bytes]]):
+    output_text = OutputWriter() if encoded else StringIO()
+
+    try:
+        if isinstance(code_text, str):
+            code_text = compile(code_text, '<string>', 'exec',
+                                flags=PyCF_ALLOW_TOP_LEVEL_AWAIT)
+
+        with capture_output(output_text):
+            # Code that uses await returns a coroutine when it is evaluated
+            # (without running any of it), which is run by awaiting it
+            with interruptible():
+                result = eval(code_text, globals_, locals_)  # pylint: disable=eval-used
+            if result is not None:
+                await await_interruptibly(result)
+    except Exception:  # pylint: disable=broad-except
+        return False, format_error(output_text)
+
+    return True, get_output(output_text)
+
+
+def get_output(output_text: Union[StringIO, OutputWriter]
+               ) -> Union[str, list[bytes]]:
+    if isinstance(output_text, OutputWriter):
+        return output_text.get_chunks()
+    return output_text.getvalue()
+
+
+def format_error(output_text: Union[StringIO, OutputWriter]) -> str:
+    return f'{output_text.getvalue()}<pre>{format_exc()}</pre>'
@@ -0,0 +1,249 @@
+"""
+Sets up the compression of responses with gzip, and with brotli if the
+brotli package is installed.
+
+Pages are compressed as they are sent (flushing the compressor after each
+chunk of a streamed page, so the client receives it as it renders), while
+other files are compressed ahead of time by precompress_directory, which
+writes a .gz and .br file alongside each of them.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import os
+import zlib
+from pathlib import Path, PurePath
+from typing import Iterable, Iterator, Optional, Protocol
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from werkzeug.datastructures import Accept
+
+try:
+    from file_processing import SystemFileProcessor, PYHP_FILE_EXTENSION, \
+        write_file_atomically
+    from precompilation import COMPILED_DIR_NAME
+    from static_files import StaticFile, get_content_type
+except ImportError:
+    from .file_processing import SystemFileProcessor, PYHP_FILE_EXTENSION, \
+        write_file_atomically
+    from .precompilation import COMPILED_DIR_NAME
+    from .static_files import StaticFile, get_content_type
+
+
+# In order of preference, when the client accepts them equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+# Levels for compressing pages as they are sent, and files ahead of time
+DEFAULT_LEVELS = {'br': 4, 'gzip': 6}
+PRECOMPRESS_LEVELS = {'br': 11, 'gzip': 9}
+
+# Bodies smaller than this are sent uncompressed
+DEFAULT_MIN_SIZE = 1024
+
+COMPRESSIBLE_TYPES = ('application/javascript', 'application/json',
+                      'application/manifest+json', 'application/wasm',
+                      'application/xml', 'image/svg+xml')
+
+
+class Compressor(Protocol):
+    """Compresses a body in one or more chunks."""
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress a chunk, returning the output that is ready."""
+
+    def flush(self) -> bytes:
+        """Return the output of the chunks so far (without ending it)."""
+
+    def finish(self) -> bytes:
+        """Return the rest of the output."""
+
+
+class GzipCompressor:
+    """Compresses a body in the gzip format."""
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                            16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+    """Compresses a body in the brotli format."""
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def create_compressor(encoding: str,
+                      level: Optional[int] = None) -> Compressor:
+    """Create a compressor for the encoding (one of ENCODINGS)."""
+    if level is None:
+        level = DEFAULT_LEVELS[encoding]
+    if encoding == 'br':
+        return BrotliCompressor(level)
+    return GzipCompressor(level)
+
+
+def get_accepted_encodings(accept_encodings: Accept) -> list[str]:
+    """
+    Return the encodings that the client accepts (from its Accept-Encoding
+    header), best first.
+    """
+    encodings = [encoding for encoding in ENCODINGS
+                 if accept_encodings.quality(encoding) > 0]
+    # Stable, so encodings of equal quality stay in order of preference
+    encodings.sort(key=accept_encodings.quality, reverse=True)
+    return encodings
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    """Return whether a body of the content type is worth compressing."""
+    if content_type is None:
+        return False
+
+    mimetype = content_type.partition(';')[0].strip().lower()
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """Compress a whole body."""
+    compressor = create_compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_chunks(chunks: Iterable[bytes], encoding: str,
+                    level: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Compress a streamed body, flushing the compressor after each chunk so
+    that the client can decompress everything sent so far.
+
+    The chunks are closed (stopping the render) when this is closed.
+    """
+    compressor = create_compressor(encoding, level)
+
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush()
+            if data:
+                yield data
+
+        yield compressor.finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def get_precompressed_path(path: PurePath, encoding: str) -> PurePath:
+    """Return the path of the file precompressed with the encoding."""
+    return path.with_name(f'{path.name}{ENCODING_SUFFIXES[encoding]}')
+
+
+def get_precompressed_file(file_processor: SystemFileProcessor,
+                           relative_path: PurePath, static_file: StaticFile,
+                           encodings: Iterable[str]) -> Optional[StaticFile]:
+    """
+    Return the first of the file's precompressed copies (in the given
+    encodings) that is up to date, from their cached stat results, or None
+    if there is none.
+    """
+    stat_result = file_processor.get_stat(relative_path)
+
+    for encoding in encodings:
+        compressed_path = get_precompressed_path(relative_path, encoding)
+        compressed_stat = file_processor.get_stat(compressed_path)
+
+        if compressed_stat is not None and stat_result is not None and \
+                compressed_stat.st_mtime_ns == stat_result.st_mtime_ns:
+            return StaticFile.from_stat(
+                file_processor.get_absolute_path(compressed_path),
+                compressed_stat, static_file.content_type, encoding)
+
+    return None
+
+
+def precompress_directory(base_dir: Path,
+                          min_size: int = DEFAULT_MIN_SIZE) -> list[PurePath]:
+    """
+    Compress every compressible file (other than PyHP files) in the
+    directory with each of ENCODINGS, and return the relative paths of the
+    compressed files that were written.
+
+    A compressed file is only kept if it is smaller than the file, and is
+    given the same modification time as the file, so the server only sends
+    it until the file changes (and it is only compressed again once the
+    file has changed).
+    """
+    base_dir = base_dir.resolve()
+    suffixes = tuple(ENCODING_SUFFIXES.values())
+    written = []
+
+    for path in sorted(base_dir.rglob('*')):
+        relative_path = PurePath(path.relative_to(base_dir))
+
+        if COMPILED_DIR_NAME in relative_path.parts or \
+                path.suffix in suffixes or \
+                path.suffix == f'.{PYHP_FILE_EXTENSION}' or \
+                not path.is_file() or \
+                not is_compressible(get_content_type(path.name)):
+            continue
+
+        stat_result = path.stat()
+        if stat_result.st_size < min_size:
+            continue
+
+        for encoding in ENCODINGS:
+            if write_precompressed(base_dir, relative_path, stat_result,
+                                   encoding):
+                written.append(get_precompressed_path(relative_path,
+                                                      encoding))
+
+    return written
+
+
+def write_precompressed(base_dir: Path, relative_path: PurePath,
+                        stat_result: os.stat_result, encoding: str) -> bool:
+    """
+    Write the file compressed with the encoding (if it is out of date), and
+    return whether it was written.
+    """
+    compressed_path = base_dir / get_precompressed_path(relative_path,
+                                                        encoding)
+
+    try:
+        if compressed_path.stat().st_mtime_ns == stat_result.st_mtime_ns:
+            return False
+    except FileNotFoundError:
+        pass
+
+    data = compress((base_dir / relative_path).read_bytes(), encoding,
+                    PRECOMPRESS_LEVELS[encoding])
+    if len(data) >= stat_result.st_size:
+        compressed_path.unlink(missing_ok=True)
+        return False
+
+    write_file_atomically(compressed_path, data, (stat_result.st_atime_ns,
+                                                  stat_result.st_mtime_ns))
+    return True
@@ -0,0 +1,94 @@
+"""
+Sets up the thread pools that independent includes are rendered on
+concurrently.
+"""
+
+# pylint: disable=missing-function-docstring
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextvars import ContextVar, copy_context
+from threading import Lock
+from typing import Callable, Iterable, Optional, TypeVar
+
+
+DEFAULT_MAX_WORKERS = 32
+
+T = TypeVar('T')
+
+_in_worker: ContextVar[bool] = ContextVar('pyhp_in_worker', default=False)
+
+
+class IncludePool:
+    """
+    A thread pool that independent includes are rendered on. Each app has
+    its own pool, which is only started once an include needs it.
+    """
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS):
+        self._max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = Lock()
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        """Return the thread pool, creating it if needed."""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        self._max_workers, thread_name_prefix='pyhp')
+
+        return self._executor
+
+    def run_concurrently(self, functions: Iterable[Callable[[], T]]
+                         ) -> list[T]:
+        """
+        Call the functions concurrently, and return their results in order.
+
+        Each function is called in a copy of the current context (so output
+        is captured as usual), on the thread pool. The first function is
+        called in the current thread, which would otherwise be waiting, and
+        functions called from the pool are all called in the current
+        thread, so nested calls cannot wait on a pool that they have used
+        up.
+        """
+        functions = list(functions)
+
+        if _in_worker.get() or len(functions) <= 1:
+            return [function() for function in functions]
+
+        executor = self.get_executor()
+        futures = [executor.submit(copy_context().run, _run_in_worker,
+                                   function)
+                   for function in functions[1:]]
+
+        try:
+            first_result = functions[0]()
+        finally:
+            # Every function has finished before any error is raised
+            wait(futures)
+
+        return [first_result, *(future.result() for future in futures)]
+
+    def shutdown(self):
+        """
+        Stop the thread pool once the work already given to it has
+        finished (it is started again if another include needs it).
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    @property
+    def max_workers(self) -> int:
+        """Return the number of threads in the pool."""
+        return self._max_workers
+
+
+def _run_in_worker(function: Callable[[], T]) -> T:
+    _in_worker.set(True)
+    return function()
+
+
+# Used by pages that are not rendered by an app
+DEFAULT_INCLUDE_POOL = IncludePool()
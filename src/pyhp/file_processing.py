@@ -4,25 +4,90 @@ Sets up functions for loading and parsing PyHP files.
 
 # pylint: disable=missing-function-docstring
 
+import logging
+import os
+import stat
+import sys
+from mmap import mmap, ACCESS_READ
+from typing import Callable, Hashable, Optional, Union
 from pathlib import PurePath, Path
+from weakref import WeakSet
 
+try:
+    from caching import LRUCache
+    from hypertext_processing import Source
+    from file_watching import FileWatcher, create_watcher, \
+        DEFAULT_POLL_INTERVAL
+except ImportError:
+    from .caching import LRUCache
+    from .hypertext_processing import Source
+    from .file_watching import FileWatcher, create_watcher, \
+        DEFAULT_POLL_INTERVAL
+
+
+logger = logging.getLogger(__name__)
 
 PYHP_FILE_EXTENSION = 'pyhp'
+DEFAULT_PATH_CACHE_SIZE = 4096
+DEFAULT_PATH_CACHE_TTL = 1.0
+
+# Files smaller than this are read rather than mapped, as they gain little
+# from it
+MIN_MAPPED_FILE_SIZE = 64 * 1024
+DEFAULT_MAX_MAPPED_FILES = 256
+# Before Python 3.13, each map keeps a duplicate of the file's descriptor
+# open for as long as the map exists
+MAP_OPTIONS = {'trackfd': False} if sys.version_info >= (3, 13) else {}
 
 
 class FileProcessor:
     """
     Abstract class for interacting with the file system.
+
+    Listeners added with add_change_listener are called with the path of
+    each file that changes (or None if anything may have changed), whenever
+    notify_change is called. A listener that raises an exception is logged,
+    and does not stop the other listeners from being called.
     """
+    def __init__(self):
+        self._change_listeners: list[Callable[[Optional[PurePath]], None]] = []
+
+    def add_change_listener(self,
+                            listener: Callable[[Optional[PurePath]], None]):
+        self._change_listeners.append(listener)
+
+    def notify_change(self, path: Optional[PurePath] = None):
+        for listener in self._change_listeners:
+            try:
+                listener(path)
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception('Change listener %r failed (for %s).',
+                                 listener, path)
+
     def get_file_contents(self, path: PurePath) -> str:
         raise NotImplementedError
 
+    def get_file_buffer(self, path: PurePath) -> Source:
+        """
+        Return the contents of the file for parsing, either as text or as
+        UTF-8 encoded bytes.
+        """
+        return self.get_file_contents(path)
+
     def is_dir(self, path: PurePath) -> bool:
         raise NotImplementedError
 
     def is_file(self, path: PurePath) -> bool:
         raise NotImplementedError
 
+    def get_file_stamp(self, path: PurePath) -> Optional[Hashable]:
+        """
+        Return a value that changes whenever the file changes, or None if
+        the file should not be cached.
+        """
+        # pylint: disable=unused-argument
+        return None
+
     def is_pyhp_file(self, path: PurePath) -> bool:
         return path.suffix == f'.{PYHP_FILE_EXTENSION}'
 
@@ -48,26 +113,186 @@ class SystemFileProcessor(FileProcessor):
     """
     Implementation of the FileProcessor interface, for normal interation with
     system files and directories.
+
+    Resolved paths and stat results are cached for cache_ttl seconds (or
+    until invalidate is called, if cache_ttl is None), so a long-lived file
+    processor does not touch the file system for every lookup. Once
+    start_watching is called, they are cached until the watcher reports a
+    change instead.
+
+    A lookup that races with invalidate (storing what it read from the file
+    system just after the cache was cleared) is dropped from the cache, as
+    invalidate increments a generation that each lookup checks once it has
+    stored its result.
+
+    If memory_map_files is True, files of at least MIN_MAPPED_FILE_SIZE
+    bytes are memory-mapped for parsing rather than read into memory. Files
+    must then be replaced (for example by renaming a new file over them)
+    rather than truncated and rewritten while they are mapped. A map is
+    closed once nothing (such as the template cache) refers to it, and
+    where each map holds a file descriptor, at most max_mapped_files are
+    open at once (any further files are read instead).
     """
-    def __init__(self, base_dir: Path):
+    # pylint: disable=too-many-arguments
+    def __init__(self, base_dir: Path,
+                 cache_size: int = DEFAULT_PATH_CACHE_SIZE,
+                 cache_ttl: Optional[float] = DEFAULT_PATH_CACHE_TTL,
+                 memory_map_files: bool = False, *,
+                 max_mapped_files: int = DEFAULT_MAX_MAPPED_FILES):
+        super().__init__()
+
         if not base_dir.is_dir():
             raise FileNotFoundError('The base directory does not exist.')
-        self._base_dir = base_dir
+        self._base_dir = base_dir.resolve()
+        self._cache = LRUCache(cache_size, cache_ttl)
+        self._generation = 0
+        self._watcher: Optional[FileWatcher] = None
+        self._memory_map_files = memory_map_files
+        self._max_mapped_files = max_mapped_files
+        self._mapped_files: WeakSet[mmap] = WeakSet()
 
     def get_file_contents(self, path: PurePath) -> str:
         with open(self.get_absolute_path(path), 'r', encoding='utf-8') as file:
             return file.read()
 
+    def get_file_buffer(self, path: PurePath) -> Source:
+        if not self._memory_map_files:
+            return self.get_file_contents(path)
+
+        with open(self.get_absolute_path(path), 'rb') as file:
+            if os.fstat(file.fileno()).st_size < MIN_MAPPED_FILE_SIZE or \
+                    (not MAP_OPTIONS and
+                     len(self._mapped_files) >= self._max_mapped_files):
+                return file.read()
+
+            # The map stays valid after the file is closed
+            buffer = mmap(file.fileno(), 0, access=ACCESS_READ, **MAP_OPTIONS)
+
+        self._mapped_files.add(buffer)
+        return buffer
+
+    def get_file_stamp(self, path: PurePath) -> Optional[Hashable]:
+        stat_result = self.get_stat(path)
+        if stat_result is None:
+            raise FileNotFoundError(f'Unable to find file ({path}).')
+        return stat_result.st_mtime_ns, stat_result.st_size
+
     def is_dir(self, path: PurePath) -> bool:
-        return self.get_absolute_path(path).is_dir()
+        stat_result = self.get_stat(path)
+        return stat_result is not None and stat.S_ISDIR(stat_result.st_mode)
 
     def is_file(self, path: PurePath) -> bool:
-        return self.get_absolute_path(path).is_file()
+        stat_result = self.get_stat(path)
+        return stat_result is not None and stat.S_ISREG(stat_result.st_mode)
+
+    def get_true_path(self, path: PurePath) -> PurePath:
+        key = ('true_path', path)
+        true_path: Union[PurePath, type, None] = self._cache.get(key)
+
+        if true_path is None:
+            generation = self._generation
+            try:
+                true_path = super().get_true_path(path)
+            except (FileNotFoundError, IsADirectoryError) as error:
+                self._store(key, type(error), generation)
+                raise
+
+            self._store(key, true_path, generation)
+
+        if isinstance(true_path, type):
+            raise true_path('Unable to find file.')
+
+        return true_path
+
+    def get_stat(self, path: PurePath) -> Optional[os.stat_result]:
+        """Return the (cached) stat result of the path, or None if missing."""
+        key = ('stat', path)
+        stat_result = self._cache.get(key)
+
+        if stat_result is None:
+            generation = self._generation
+            try:
+                stat_result = os.stat(self.get_absolute_path(path))
+            except (FileNotFoundError, NotADirectoryError):
+                stat_result = False
+
+            self._store(key, stat_result, generation)
+
+        return stat_result or None
 
     def get_absolute_path(self, path: PurePath) -> Path:
-        absolute_path = (self._base_dir / path).resolve()
-        if self._base_dir not in absolute_path.parents and \
-                self._base_dir != absolute_path:
-            raise RuntimeError(f'Path ({absolute_path}) is outside of base '
-                               f'directory ({self._base_dir}).')
+        key = ('absolute_path', path)
+        absolute_path = self._cache.get(key)
+
+        if absolute_path is None:
+            generation = self._generation
+            absolute_path = (self._base_dir / path).resolve()
+            if self._base_dir not in absolute_path.parents and \
+                    self._base_dir != absolute_path:
+                raise RuntimeError(f'Path ({absolute_path}) is outside of '
+                                   f'base directory ({self._base_dir}).')
+
+            self._store(key, absolute_path, generation)
+
         return absolute_path
+
+    def _store(self, key: Hashable, value: object, generation: int):
+        self._cache.set(key, value)
+
+        # invalidate increments the generation before clearing the cache, so
+        # a value stored after the clear is caught here instead
+        if self._generation != generation:
+            self._cache.delete(key)
+
+    def invalidate(self):
+        """Forget every cached path and stat result."""
+        self._generation += 1
+        self._cache.clear()
+
+    def notify_change(self, path: Optional[PurePath] = None):
+        self.invalidate()
+        super().notify_change(path)
+
+    def start_watching(self, poll_interval: float = DEFAULT_POLL_INTERVAL
+                       ) -> FileWatcher:
+        """
+        Watch the base directory for changes (using inotify if available, or
+        by polling otherwise), and cache paths until they change.
+        """
+        if self._watcher is None:
+            self._cache = LRUCache(self._cache.max_size)
+            self._watcher = create_watcher(self._base_dir, self.notify_change,
+                                           poll_interval)
+            self._watcher.start()
+
+        return self._watcher
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    @property
+    def cache(self) -> LRUCache:
+        """Return the cache of paths and stat results."""
+        return self._cache
+
+    @property
+    def base_dir(self) -> Path:
+        """Return the base directory that paths are relative to."""
+        return self._base_dir
+
+
+def write_file_atomically(path: Path, data: bytes,
+                          times_ns: Optional[tuple[int, int]] = None):
+    """
+    Write the file (with the given access and modification times, if any).
+
+    The data is written to a temporary file first, which then replaces the
+    file, so that a running server never sees a partially written file.
+    """
+    temporary_path = path.with_name(f'{path.name}.tmp')
+    temporary_path.write_bytes(data)
+    if times_ns is not None:
+        os.utime(temporary_path, ns=times_ns)
+    os.replace(temporary_path, path)
@@ -0,0 +1,266 @@
+"""
+Sets up watchers that report changes to the files in a directory, so that
+caches can be invalidated as soon as files are deployed.
+
+InotifyWatcher is used on Linux, and PollingWatcher (which compares the
+modification times of every file) everywhere else.
+"""
+
+# pylint: disable=missing-function-docstring, too-few-public-methods
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+from pathlib import Path, PurePath
+from threading import Thread, Event
+from typing import Callable, Optional
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 1.0
+
+# The callback is given the path (relative to the base directory) that
+# changed, or None if anything may have changed
+ChangeCallback = Callable[[Optional[PurePath]], None]
+
+
+class FileWatcher:
+    """
+    Abstract class for watching a directory in a background thread.
+
+    Exceptions raised by the callback are logged, so that the thread keeps
+    watching.
+    """
+    def __init__(self, base_dir: Path, callback: ChangeCallback):
+        self._base_dir = base_dir
+        self._callback = callback
+        self._thread: Optional[Thread] = None
+        self._stopped = Event()
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, name=type(self).__name__,
+                              daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        raise NotImplementedError
+
+    def _notify(self, path: Optional[PurePath]):
+        try:
+            self._callback(path)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception('Change callback failed (for %s).', path)
+
+    @property
+    def base_dir(self) -> Path:
+        """Return the directory being watched."""
+        return self._base_dir
+
+
+class PollingWatcher(FileWatcher):
+    """
+    Watches a directory by comparing the modification time and size of every
+    file in it at a regular interval.
+    """
+    def __init__(self, base_dir: Path, callback: ChangeCallback,
+                 interval: float = DEFAULT_POLL_INTERVAL):
+        super().__init__(base_dir, callback)
+        self._interval = interval
+        self._stamps = self._scan()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self.poll()
+
+    def poll(self):
+        """Compare the directory with the last scan, and report changes."""
+        stamps = self._scan()
+        old_stamps = self._stamps
+        self._stamps = stamps
+
+        for path in old_stamps.keys() | stamps.keys():
+            if old_stamps.get(path) != stamps.get(path):
+                self._notify(path)
+
+    def _scan(self) -> dict[PurePath, tuple[int, int]]:
+        stamps = {}
+        directories = [self._base_dir]
+
+        while directories:
+            directory = directories.pop()
+
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        directories.append(Path(entry.path))
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+
+                path = PurePath(os.path.relpath(entry.path, self._base_dir))
+                stamps[path] = (stat.st_mtime_ns, stat.st_size)
+
+        return stamps
+
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x800
+IN_CLOEXEC = 0x80000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+    IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+
+def load_libc() -> Optional[ctypes.CDLL]:
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError:
+        return None
+
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+
+    return libc
+
+
+class InotifyWatcher(FileWatcher):
+    """
+    Watches a directory using Linux's inotify, so that changes are reported
+    as soon as they happen without scanning the directory.
+    """
+    def __init__(self, base_dir: Path, callback: ChangeCallback):
+        super().__init__(base_dir, callback)
+
+        self._libc = load_libc()
+        if self._libc is None:
+            raise OSError('inotify is not available.')
+
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'Unable to start inotify.')
+
+        self._stop_read, self._stop_write = os.pipe()
+        self._directories: dict[int, PurePath] = {}
+        self._add_watches(PurePath())
+
+    def stop(self):
+        os.write(self._stop_write, b'\0')
+        super().stop()
+
+        os.close(self._fd)
+        os.close(self._stop_read)
+        os.close(self._stop_write)
+
+    def _add_watches(self, directory: PurePath):
+        directories = [directory]
+
+        while directories:
+            directory = directories.pop()
+            path = os.fsencode(self._base_dir / directory)
+
+            descriptor = self._libc.inotify_add_watch(self._fd, path,
+                                                      WATCH_MASK)
+            if descriptor < 0:
+                continue
+            self._directories[descriptor] = directory
+
+            try:
+                directories.extend(directory / os.fsdecode(entry.name)
+                                   for entry in os.scandir(path)
+                                   if entry.is_dir())
+            except OSError:
+                continue
+
+    def _run(self):
+        while not self._stopped.is_set():
+            readable, _, _ = select.select([self._fd, self._stop_read], [],
+                                           [])
+            if self._stop_read in readable:
+                break
+
+            try:
+                data = os.read(self._fd, READ_SIZE)
+            except BlockingIOError:
+                continue
+
+            self._handle_events(data)
+
+    def _handle_events(self, data: bytes):
+        offset = 0
+
+        while offset < len(data):
+            descriptor, mask, _, name_length = \
+                EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b'\0'))
+            offset += name_length
+
+            self._handle_event(descriptor, mask, name)
+
+    def _handle_event(self, descriptor: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            self._notify(None)
+            return
+
+        if mask & IN_IGNORED:
+            self._directories.pop(descriptor, None)
+            return
+
+        directory = self._directories.get(descriptor)
+        if directory is None:
+            return
+
+        if mask & IN_ISDIR or mask & IN_DELETE_SELF:
+            # Whole directories were added, moved or removed
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_watches(directory / name)
+            self._notify(None)
+            return
+
+        self._notify(directory / name)
+
+
+def create_watcher(base_dir: Path, callback: ChangeCallback,
+                   poll_interval: float = DEFAULT_POLL_INTERVAL
+                   ) -> FileWatcher:
+    """Return the best available watcher for the directory."""
+    if load_libc() is not None:
+        try:
+            return InotifyWatcher(base_dir, callback)
+        except OSError:
+            pass
+
+    return PollingWatcher(base_dir, callback, poll_interval)
@@ -0,0 +1,110 @@
+"""
+Sets up a cache of the output of code blocks that are marked as cacheable,
+such as <pyhp cache="300" key="sidebar" vary_on="get:page">.
+
+The output of a cached block is replayed on later renders without running
+it, so names assigned in the block are not set when it is replayed.
+"""
+
+# pylint: disable=missing-function-docstring, too-few-public-methods
+
+from dataclasses import dataclass
+from pathlib import PurePath
+from typing import TYPE_CHECKING, Hashable, Optional
+
+try:
+    from cache_backends import CacheBackend, MemoryCacheBackend
+    from hypertext_processing import Section
+    from response_cache import parse_vary_on, get_vary_key
+except ImportError:
+    from .cache_backends import CacheBackend, MemoryCacheBackend
+    from .hypertext_processing import Section
+    from .response_cache import parse_vary_on, get_vary_key
+
+if TYPE_CHECKING:
+    from .pyhp_interface import Pyhp
+
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+
+@dataclass
+class FragmentOptions:
+    """Stores how long a block can be cached for, and what it varies on."""
+    ttl: float
+    key: Hashable
+    vary_on: tuple[str, ...] = ()
+
+
+def get_fragment_options(section: Section) -> Optional[FragmentOptions]:
+    """
+    Return the cache options of the section, or None if it is not cached.
+
+    The key defaults to the file and line of the block.
+    """
+    attributes = section.attributes
+    if not attributes or 'cache' not in attributes:
+        return None
+
+    try:
+        ttl = float(attributes['cache'])
+    except ValueError:
+        raise ValueError(f'Invalid cache time ({attributes["cache"]!r}) on '
+                         f'line {section.line}.') from None
+
+    key = attributes.get('key')
+    if key is None:
+        if section.code is not None:
+            key = (section.code.co_filename, section.line)
+        else:
+            key = section.text
+
+    # Several items are separated by spaces or commas
+    vary_on = attributes.get('vary_on', '').replace(',', ' ').split()
+
+    return FragmentOptions(ttl, key, parse_vary_on(vary_on))
+
+
+class FragmentCache:
+    """
+    A cache of the output of code blocks, keyed on the key of the block and
+    the request data it varies on, and stored in a backend (an in-process
+    LRU cache by default).
+    """
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES,
+                 backend: Optional[CacheBackend] = None):
+        if backend is None:
+            backend = MemoryCacheBackend('fragments', max_bytes)
+        self._backend = backend
+
+    def get(self, options: FragmentOptions,
+            pyhp_class: 'Pyhp') -> Optional[str]:
+        """Return the cached output of the block, if there is any."""
+        data = self._backend.get(self._get_key(options, pyhp_class))
+        return None if data is None else str(data, 'utf-8')
+
+    def set(self, options: FragmentOptions, pyhp_class: 'Pyhp', output: str):
+        """Store the output of the block."""
+        self._backend.set(self._get_key(options, pyhp_class),
+                          output.encode('utf-8'), options.ttl)
+
+    def invalidate(self, path: Optional[PurePath] = None):
+        """
+        Forget the output of every block, since the blocks of the file that
+        changed may have moved.
+        """
+        # pylint: disable=unused-argument
+        self._backend.clear()
+
+    @staticmethod
+    def _get_key(options: FragmentOptions, pyhp_class: 'Pyhp') -> str:
+        return repr((options.key, options.vary_on,
+                     get_vary_key(options.vary_on, pyhp_class)))
+
+    @property
+    def backend(self) -> CacheBackend:
+        """Return the backend the output is stored in."""
+        return self._backend
+
+
+DEFAULT_FRAGMENT_CACHE = FragmentCache()
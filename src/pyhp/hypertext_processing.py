@@ -4,44 +4,423 @@ Sets up functions for processing DOMs and hypertext.
 
 # pylint: disable=missing-function-docstring, too-few-public-methods
 
-from dataclasses import dataclass
-import re
+from types import CodeType
+from typing import IO, Iterator, Optional, Union
 
 
 PYHP_TAG = 'pyhp'
-REGEX = re.compile(rf'<{PYHP_TAG}>([\S\s]*?)</{PYHP_TAG}>')
+
+# Anything that can be parsed: text, or UTF-8 encoded bytes (including
+# memoryviews and memory-mapped files)
+Source = Union[str, bytes, bytearray, memoryview]
+
+
+class _Tokens:
+    """The tokens that the scanner looks for, as either text or bytes."""
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, encode):
+        self.open_tag = encode(f'<{PYHP_TAG}')
+        self.close_tag = encode(f'</{PYHP_TAG}>')
+        self.single_quote = encode("'")
+        self.double_quote = encode('"')
+        self.triple_single_quote = encode("'''")
+        self.triple_double_quote = encode('"""')
+        self.comment = encode('#')
+        self.newline = encode('\n')
+        self.backslash = encode('\\')
+        self.tag_start = encode('<')
+        self.tag_end = encode('>')
+        self.name_chars = encode('_-')
+        self.value_start = encode('="')
+
+
+_TEXT_TOKENS = _Tokens(lambda text: text)
+_BYTES_TOKENS = _Tokens(lambda text: text.encode('utf-8'))
 
 
-@dataclass
 class Section:
-    """Represents a section of either hypertext or PyHP code."""
-    is_pyhp_code: bool
-    text: str
+    """
+    Represents a section of either hypertext or PyHP code.
 
+    The section refers to a range of the source it was parsed from, and its
+    text is only copied out of the source when it is first needed.
 
-class UglySoup:
+    Code blocks may have attributes given in their opening tag (for example
+    <pyhp cache="300">), which are stored as a dictionary.
     """
-    A regex-based parser for PyHP code blocks.
+    # pylint: disable=too-many-instance-attributes, too-many-arguments
+    __slots__ = ('is_pyhp_code', 'code', 'line', 'attributes', '_source',
+                 '_start', '_end', '_text')
 
-    Does NOT support nested PyHP code blocks
-    (or printing </pyhp> tags within PyHP code blocks).
+    def __init__(self, is_pyhp_code: bool, text: Optional[str] = None,
+                 code: Optional[CodeType] = None, *,
+                 source: Optional[Source] = None, start: int = 0,
+                 end: Optional[int] = None, line: int = 1,
+                 attributes: Optional[dict[str, str]] = None):
+        self.is_pyhp_code = is_pyhp_code
+        self.code = code
+        self.line = line
+        self.attributes = attributes
+
+        if text is not None:
+            source = text
+
+        self._source = source
+        self._start = start
+        self._end = len(source) if end is None else end
+        self._text = text
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            text = self._source[self._start:self._end]
+            if not isinstance(text, str):
+                text = str(text, 'utf-8')
+            self._text = text
+
+        return self._text
+
+    @property
+    def data(self) -> Union[bytes, memoryview]:
+        """
+        Return the section as UTF-8 encoded bytes, without copying it if the
+        source is already bytes.
+        """
+        if isinstance(self._source, str):
+            return self.text.encode('utf-8')
+
+        return memoryview(self._source)[self._start:self._end]
+
+    @property
+    def start(self) -> int:
+        """Return the offset of the section in its source."""
+        return self._start
+
+    @property
+    def end(self) -> int:
+        """Return the offset of the end of the section in its source."""
+        return self._end
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Section):
+            return NotImplemented
+        return (self.is_pyhp_code, self.text, self.attributes) == \
+            (other.is_pyhp_code, other.text, other.attributes)
+
+    def __repr__(self) -> str:
+        attributes = '' if self.attributes is None else \
+            f', attributes={self.attributes!r}'
+        return f'Section(is_pyhp_code={self.is_pyhp_code!r}, ' \
+               f'text={self.text!r}{attributes})'
+
+
+class UglySoup:
     """
-    def __init__(self, html: str):
-        self._sections: list[Section] = []
+    A single-pass tokenizer for PyHP code blocks.
 
-        prev_end = 0
+    The source is scanned once (with str.find and bytes.find, rather than
+    character by character), and each section records its offsets in the
+    source rather than a copy of its text. Python strings inside code blocks
+    may contain </pyhp>, but a </pyhp> in a comment ends the block.
+    Unterminated strings are scanned as plain quotes, and left for Python to
+    report.
 
-        for match in REGEX.finditer(html):
-            self._add_section(False, html[prev_end:match.start()])
-            self._add_section(True, match.group(1))
-            prev_end = match.end()
+    The source may also be a text or binary stream, which is read into one
+    buffer first (as the sections refer to offsets in it).
 
-        self._add_section(False, html[prev_end:])
+    Does NOT support nested PyHP code blocks.
+    """
+    def __init__(self, html: Union[Source, IO]):
+        if hasattr(html, 'read'):
+            html = html.read()
 
-    def _add_section(self, is_pyhp_code: bool, text: str):
-        if text:
-            self._sections.append(Section(is_pyhp_code, text))
+        self._source = html
+        self._sections = list(iter_sections(html))
 
     @property
     def sections(self) -> list[Section]:
         return self._sections
+
+    @property
+    def source(self) -> Source:
+        """Return the source the sections refer to."""
+        return self._source
+
+
+def iter_sections(source: Source) -> Iterator[Section]:
+    """
+    Scan the source, yielding each section as soon as it has been scanned.
+
+    A block that is never closed is scanned as hypertext.
+    """
+    tokens = _TEXT_TOKENS if isinstance(source, str) else _BYTES_TOKENS
+    # Memoryviews cannot be searched, so a copy is scanned instead (but the
+    # sections still refer to the memoryview)
+    buffer = bytes(source) if isinstance(source, memoryview) else source
+    find = buffer.find
+    count = _get_newline_counter(buffer)
+
+    position = search = 0
+    line = 1
+
+    while True:
+        start = find(tokens.open_tag, search)
+        if start == -1:
+            break
+
+        tag = _scan_opening_tag(buffer, start + len(tokens.open_tag), tokens)
+        code_end = None if tag is None else \
+            _scan_code(buffer, tag[0], tokens)
+
+        if code_end is None:
+            search = start + 1
+            continue
+
+        code_start, attributes = tag
+
+        if position < start:
+            yield Section(False, source=source, start=position, end=start,
+                          line=line)
+        # The opening tag only has newlines between its attributes
+        line += count(tokens.newline, position, code_start)
+
+        if code_start < code_end:
+            yield Section(True, source=source, start=code_start,
+                          end=code_end, line=line, attributes=attributes)
+
+        position = search = code_end + len(tokens.close_tag)
+        line += count(tokens.newline, code_start, code_end)
+
+    if position < len(buffer):
+        yield Section(False, source=source, start=position, end=len(buffer),
+                      line=line)
+
+
+def _scan_opening_tag(source: Source, position: int, tokens: _Tokens
+                      ) -> Optional[tuple[int, Optional[dict[str, str]]]]:
+    """
+    Scan the attributes of an opening tag (such as cache="300"), from just
+    after its name. Return the offset after the tag and its attributes, or
+    None if it is not an opening tag.
+    """
+    if source[position:position + 1] == tokens.tag_end:
+        return position + 1, None
+
+    attributes = {}
+
+    while True:
+        whitespace_start = position
+        while source[position:position + 1].isspace():
+            position += 1
+
+        if source[position:position + 1] == tokens.tag_end:
+            return position + 1, _decode_attributes(attributes)
+
+        # Each attribute must follow whitespace
+        if position == whitespace_start:
+            return None
+
+        name_start = position
+        while _is_name_char(source[position:position + 1], tokens):
+            position += 1
+
+        if position == name_start or \
+                source[position:position + 2] != tokens.value_start:
+            return None
+
+        value_start = position + 2
+        value_end = source.find(tokens.double_quote, value_start)
+        if value_end == -1:
+            return None
+
+        value = source[value_start:value_end]
+        if tokens.tag_start in value or tokens.tag_end in value:
+            return None
+
+        attributes[source[name_start:position]] = value
+        position = value_end + 1
+
+
+def _scan_code(source: Source, position: int,
+               tokens: _Tokens) -> Optional[int]:
+    """
+    Return the offset of the closing tag of the code block starting at
+    position, or None if it is never closed.
+    """
+    close = source.find(tokens.close_tag, position)
+    if close == -1:
+        return None
+
+    position = _find_scan_start(source, position, close, tokens)
+    if position is None:
+        return close
+
+    return _scan_tokens(source, position, close, tokens)
+
+
+def _scan_tokens(source: Source, position: int, close: int,
+                 tokens: _Tokens) -> Optional[int]:
+    """
+    Scan the strings and comments of a code block from position, and return
+    the offset of the first closing tag that is not in a string (starting
+    with the one at close), or None if there is none.
+
+    Tokens are only searched for up to the closing tag, and the next of each
+    is only searched for again once the scan has passed it.
+    """
+    find = source.find
+    # The next of each token, or close if there are none before it (as
+    # -1 % (close + 1) is close)
+    single_quote = double_quote = comment = -1
+
+    while True:
+        if single_quote < position:
+            single_quote = find(tokens.single_quote, position, close) % \
+                (close + 1)
+        if double_quote < position:
+            double_quote = find(tokens.double_quote, position, close) % \
+                (close + 1)
+        if comment < position:
+            comment = find(tokens.comment, position, close) % (close + 1)
+
+        first = min(single_quote, double_quote, comment)
+
+        if first == close:
+            return close
+
+        if first == comment:
+            position = _scan_comment(source, comment, close, tokens)
+        else:
+            position = _scan_string(source, first, tokens)
+
+        if position > close:
+            # The string contained the closing tag
+            close = find(tokens.close_tag, position)
+            if close == -1:
+                return None
+            single_quote = double_quote = comment = -1
+
+
+def _find_scan_start(source: Source, position: int, close: int,
+                     tokens: _Tokens) -> Optional[int]:
+    """
+    Return the offset that the code block starting at position must be
+    scanned from, to tell whether the closing tag at close is in a string
+    (or None if it cannot be).
+
+    Only triple-quoted strings, and strings continued onto the next line
+    with a backslash, can contain a newline. If there are neither, only the
+    line of the tag is scanned, and only if it has a quote on it (so most
+    blocks, which have no strings or end with the tag on a line of its own,
+    are not scanned).
+    """
+    find = source.find
+    if find(tokens.single_quote, position, close) == -1 and \
+            find(tokens.double_quote, position, close) == -1:
+        return None
+
+    line_start = source.rfind(tokens.newline, position, close) + 1
+
+    # The block is one line with strings on it, or strings may run onto the
+    # line of the tag
+    if line_start == 0 or \
+            source[line_start - 2:line_start - 1] == tokens.backslash or \
+            find(tokens.triple_single_quote, position, close) != -1 or \
+            find(tokens.triple_double_quote, position, close) != -1:
+        return position
+
+    if find(tokens.single_quote, line_start, close) == -1 and \
+            find(tokens.double_quote, line_start, close) == -1:
+        return None
+    return line_start
+
+
+def _scan_comment(source: Source, start: int, close: int,
+                  tokens: _Tokens) -> int:
+    """
+    Return the offset after the comment starting at start, which ends at the
+    end of the line, or the closing tag at close.
+    """
+    newline = source.find(tokens.newline, start, close)
+    return close if newline == -1 else newline + 1
+
+
+def _scan_string(source: Source, start: int, tokens: _Tokens) -> int:
+    """
+    Return the offset after the string starting at start (or after its
+    opening quote, if it is unterminated).
+    """
+    quote = source[start:start + 1]
+    find = source.find
+
+    if source[start + 1:start + 3] != quote * 2:
+        # Most strings are on one line, without escaped quotes
+        end = find(quote, start + 1)
+        if end != -1 and find(tokens.newline, start + 1, end) == -1 and \
+                source[end - 1:end] != tokens.backslash:
+            return end + 1
+    else:
+        triple_quote = quote * 3
+        end = _find_unescaped(source, triple_quote, start + 3, tokens)
+        if end != -1:
+            return end + 3
+
+    # Strings in single quotes end at the end of the line
+    end = _find_unescaped(source, quote, start + 1, tokens)
+    limit = len(source) if end == -1 else end
+    newline = _find_unescaped(source, tokens.newline, start + 1, tokens, limit)
+
+    if end == -1 or newline != -1:
+        return start + 1
+    return end + 1
+
+
+def _find_unescaped(source: Source, token: Union[str, bytes], start: int,
+                    tokens: _Tokens, end: Optional[int] = None) -> int:
+    """
+    Return the offset of the first token in the string contents starting at
+    start that is not escaped with a backslash, or -1 if there is none.
+    """
+    if end is None:
+        end = len(source)
+
+    position = start
+    while True:
+        index = source.find(token, position, end)
+        if index == -1:
+            return -1
+
+        backslashes = 0
+        while index - backslashes > start and \
+                source[index - backslashes - 1:index - backslashes] == \
+                tokens.backslash:
+            backslashes += 1
+
+        if backslashes % 2 == 0:
+            return index
+        position = index + 1
+
+
+def _is_name_char(char: Union[str, bytes], tokens: _Tokens) -> bool:
+    return bool(char) and (char.isalnum() or char in tokens.name_chars)
+
+
+def _decode_attributes(attributes: dict[Union[str, bytes], Union[str, bytes]]
+                       ) -> Optional[dict[str, str]]:
+    if not attributes:
+        return None
+
+    return {name if isinstance(name, str) else str(name, 'utf-8'):
+            value if isinstance(value, str) else str(value, 'utf-8')
+            for name, value in attributes.items()}
+
+
+def _get_newline_counter(source: Source):
+    if isinstance(source, (str, bytes, bytearray)):
+        return source.count
+
+    # Memory-mapped files cannot be counted in place
+    def count(newline: bytes, start: int, end: int) -> int:
+        return bytes(source[start:end]).count(newline)
+
+    return count
@@ -0,0 +1,66 @@
+"""
+Sets up an import finder that lets pages import the modules next to them,
+without adding their directories to sys.path.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import sys
+from contextlib import contextmanager
+from contextvars import ContextVar
+from importlib.abc import MetaPathFinder
+from importlib.machinery import ModuleSpec, PathFinder
+from threading import Lock
+from types import ModuleType
+from typing import Iterator, Optional, Sequence
+
+
+_current_dir: ContextVar[Optional[str]] = ContextVar('pyhp_import_dir',
+                                                     default=None)
+_install_lock = Lock()
+
+
+class PageImportFinder(MetaPathFinder):
+    """
+    Finds top-level modules in the directory of the page running in the
+    current thread (or context).
+
+    The finder is placed at the end of sys.meta_path, so (as when page
+    directories were appended to sys.path) installed modules take priority
+    over modules next to pages. The path finder caches the listing of each
+    directory, and refreshes it when the directory changes.
+    """
+    def find_spec(self, fullname: str, path: Optional[Sequence[str]],
+                  target: Optional[ModuleType] = None
+                  ) -> Optional[ModuleSpec]:
+        directory = _current_dir.get()
+
+        # Submodules are found through the __path__ of their package
+        if directory is None or path is not None:
+            return None
+
+        return PathFinder.find_spec(fullname, [directory], target)
+
+
+_FINDER = PageImportFinder()
+
+
+def install_import_finder():
+    """Add the page import finder to sys.meta_path, if it is not there."""
+    with _install_lock:
+        if _FINDER not in sys.meta_path:
+            sys.meta_path.append(_FINDER)
+
+
+@contextmanager
+def import_from(directory: str) -> Iterator[str]:
+    """Let code run in the current context import modules in the directory."""
+    if _FINDER not in sys.meta_path:
+        install_import_finder()
+
+    token = _current_dir.set(directory)
+
+    try:
+        yield directory
+    finally:
+        _current_dir.reset(token)
@@ -0,0 +1,230 @@
+"""
+Sets up the timing of each stage of a render (loading, parsing and
+compiling templates, running code blocks, and including other files).
+
+Timings are only recorded while a render is being profiled (with
+profile_render), or while a timing hook is registered (with
+add_timing_hook). Otherwise, recording a stage costs a single check.
+"""
+
+# pylint: disable=missing-function-docstring, too-few-public-methods
+
+import cProfile
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+from time import perf_counter, time_ns
+from typing import Callable, ContextManager, Iterator, Optional
+
+try:
+    from hypertext_processing import Section
+except ImportError:
+    from .hypertext_processing import Section
+
+
+# In the order that a page passes through them
+STAGES = ('template', 'load', 'parse', 'compile', 'exec', 'include')
+
+
+@dataclass
+class Timing:
+    """
+    Stores how long a stage of a render took.
+
+    depth is the number of includes that the stage is nested in, and section
+    is the code block that was run (for exec timings).
+    """
+    stage: str
+    filename: Optional[str]
+    start: float
+    duration: float
+    depth: int = 0
+    section: Optional[Section] = field(default=None, repr=False)
+
+    @property
+    def lines(self) -> Optional[tuple[int, int]]:
+        """Return the first and last lines of the code block, if any."""
+        if self.section is None:
+            return None
+
+        # Counted when needed, since the text of the block may be decoded
+        return self.section.line, \
+            self.section.line + self.section.text.count('\n')
+
+
+TimingHook = Callable[[Timing], None]
+
+
+@dataclass
+class RenderProfile:
+    """Stores the timings of every stage of a render."""
+    timings: list[Timing] = field(default_factory=list)
+    start: float = field(default_factory=perf_counter)
+    end: Optional[float] = None
+
+    def get_totals(self) -> dict[str, float]:
+        """
+        Return the total time spent in each stage of the page itself (not
+        counting the stages of the files it includes, which are already
+        counted in the exec and include stages).
+        """
+        totals = defaultdict(float)
+
+        for timing in self.timings:
+            if timing.depth == 0:
+                totals[timing.stage] += timing.duration
+
+        return {stage: totals[stage] for stage in STAGES if stage in totals}
+
+    def get_server_timing(self) -> str:
+        """Return the totals as the value of a Server-Timing header."""
+        metrics = [f'{stage};dur={seconds * 1000:.3f}'
+                   for stage, seconds in self.get_totals().items()]
+
+        end = perf_counter() if self.end is None else self.end
+        metrics.append(f'total;dur={(end - self.start) * 1000:.3f}')
+
+        return ', '.join(metrics)
+
+
+_current_profile: ContextVar[Optional[RenderProfile]] = ContextVar(
+    'pyhp_profile', default=None)
+_current_depth: ContextVar[int] = ContextVar('pyhp_include_depth', default=0)
+# Replaced rather than changed, so that it can be read without a lock
+_hooks: tuple[TimingHook, ...] = ()
+_hooks_lock = Lock()
+_not_recording = nullcontext()
+
+_profiler_lock = Lock()
+
+
+def add_timing_hook(hook: TimingHook):
+    """Call the hook with every timing that is recorded, in any render."""
+    global _hooks  # pylint: disable=global-statement
+    with _hooks_lock:
+        _hooks = (*_hooks, hook)
+
+
+def remove_timing_hook(hook: TimingHook):
+    global _hooks  # pylint: disable=global-statement
+    with _hooks_lock:
+        _hooks = tuple(existing for existing in _hooks if existing != hook)
+
+
+def is_recording() -> bool:
+    return bool(_hooks) or _current_profile.get() is not None
+
+
+@contextmanager
+def profile_render() -> Iterator[RenderProfile]:
+    """Record the timings of the render run within the block."""
+    profile = RenderProfile()
+    token = _current_profile.set(profile)
+
+    try:
+        yield profile
+    finally:
+        profile.end = perf_counter()
+        _current_profile.reset(token)
+
+
+class _Recorder:
+    """Times a stage, and records the timing when it finishes."""
+    __slots__ = ('_stage', '_filename', '_section', '_nested', '_depth',
+                 '_token', '_start')
+
+    def __init__(self, stage: str, filename: Optional[str],
+                 section: Optional[Section], nested: bool):
+        self._stage = stage
+        self._filename = filename
+        self._section = section
+        self._nested = nested
+        self._depth = 0
+        self._token = None
+        self._start = 0.0
+
+    def __enter__(self):
+        self._depth = _current_depth.get()
+        if self._nested:
+            self._token = _current_depth.set(self._depth + 1)
+        self._start = perf_counter()
+
+    def __exit__(self, *exc_info):
+        duration = perf_counter() - self._start
+        if self._token is not None:
+            _current_depth.reset(self._token)
+
+        timing = Timing(self._stage, self._filename, self._start, duration,
+                        self._depth, self._section)
+
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.timings.append(timing)
+        for hook in _hooks:
+            hook(timing)
+
+
+def record(stage: str, filename: Optional[str] = None) -> ContextManager:
+    """Time the block as the given stage, if timings are being recorded."""
+    if not is_recording():
+        return _not_recording
+    return _Recorder(stage, filename, None, stage == 'include')
+
+
+def record_section(section: Section) -> ContextManager:
+    """Time running the code block, if timings are being recorded."""
+    if not is_recording():
+        return _not_recording
+
+    filename = None if section.code is None else section.code.co_filename
+    return _Recorder('exec', filename, section, False)
+
+
+@contextmanager
+def profile_to_file(directory: Path, name: str) -> Iterator[None]:
+    """
+    Profile the block with cProfile, and write the stats to a file in the
+    directory (which can be read with pstats or snakeviz).
+
+    Only one block is profiled at a time, so blocks run while another is
+    being profiled are not profiled.
+    """
+    if not _profiler_lock.acquire(blocking=False):  # pylint: disable=consider-using-with
+        yield
+        return
+
+    profiler = cProfile.Profile()
+
+    try:
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+
+        directory.mkdir(parents=True, exist_ok=True)
+        safe_name = ''.join(character if character.isalnum() else '_'
+                            for character in name)
+        profiler.dump_stats(directory / f'{time_ns()}-{safe_name}.prof')
+    finally:
+        _profiler_lock.release()
+
+
+@contextmanager
+def instrument_request(path: str, server_timing: bool = False,
+                       profile_dir: Optional[Path] = None
+                       ) -> Iterator[Optional[RenderProfile]]:
+    """
+    Record the timings of the request if server_timing is True (yielding
+    the profile, or None otherwise), and profile it with cProfile if a
+    profile directory is given.
+    """
+    with profile_render() if server_timing else nullcontext() as profile:
+        if profile_dir is None:
+            yield profile
+        else:
+            with profile_to_file(profile_dir, path):
+                yield profile
@@ -0,0 +1,354 @@
+"""
+Sets up a registry of counters and histograms, which can be rendered in
+the Prometheus text format.
+
+Each thread updates its own copy of a metric's values, so recording a value
+never waits on a lock, and the copies are added together when the metrics
+are collected.
+
+Metrics are kept in the memory of the current process, so a server with
+several worker processes has separate metrics in each of them.
+"""
+
+# pylint: disable=missing-function-docstring
+
+from bisect import bisect_left
+from functools import partial
+from threading import Lock, Thread, current_thread, local
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional
+
+if TYPE_CHECKING:
+    from .caching import LRUCache
+    from .instrumentation import RenderProfile
+
+
+Labels = tuple[str, ...]
+
+# In seconds, from 0.5ms to 10s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    """
+    Abstract class for a metric, which has a value for each combination of
+    the values of its labels.
+    """
+    type_name = 'untyped'
+
+    def __init__(self, name: str, description: str,
+                 label_names: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+
+    def collect(self) -> Iterator[str]:
+        """Yield the lines of the metric's samples."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {_escape_help(self.description)}',
+                 f'# TYPE {self.name} {self.type_name}',
+                 *self.collect()]
+        return '\n'.join(lines)
+
+    def _format_labels(self, labels: Labels,
+                       extra: Optional[tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.label_names, labels))
+        if extra is not None:
+            pairs.append(extra)
+
+        if not pairs:
+            return ''
+
+        return '{' + ','.join(f'{name}="{_escape_label(value)}"'
+                              for name, value in pairs) + '}'
+
+
+class _ShardedMetric(Metric):
+    """
+    A metric that stores a copy of its values for each thread. The copies of
+    threads that have finished are merged into a single copy whenever
+    another thread starts recording (so a server that starts a thread for
+    each request keeps one copy per live thread) and when the metric is
+    collected.
+    """
+    def __init__(self, name: str, description: str,
+                 label_names: Iterable[str] = ()):
+        super().__init__(name, description, label_names)
+        self._local = local()
+        self._shards: list[tuple[Thread, dict]] = []
+        self._finished_shard: dict = {}
+        self._shards_lock = Lock()
+
+    def _get_shard(self) -> dict:
+        shard = getattr(self._local, 'shard', None)
+
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._shards_lock:
+                self._merge_finished_shards()
+                self._shards.append((current_thread(), shard))
+
+        return shard
+
+    def _merge_finished_shards(self):
+        live_shards = []
+
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live_shards.append((thread, shard))
+            else:
+                self._merge(self._finished_shard, shard)
+
+        self._shards = live_shards
+
+    def _get_totals(self) -> dict:
+        with self._shards_lock:
+            self._merge_finished_shards()
+
+            totals = {}
+            self._merge(totals, self._finished_shard)
+            for _, shard in self._shards:
+                self._merge(totals, shard)
+
+        return totals
+
+    def _merge(self, totals: dict, shard: dict):
+        raise NotImplementedError
+
+
+class Counter(_ShardedMetric):
+    """A value that only increases, such as a number of requests."""
+    type_name = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1):
+        shard = self._get_shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self._get_totals().get(labels, 0)
+
+    def _merge(self, totals: dict, shard: dict):
+        for labels, value in list(shard.items()):
+            totals[labels] = totals.get(labels, 0) + value
+
+    def collect(self) -> Iterator[str]:
+        for labels, value in sorted(self._get_totals().items()):
+            yield f'{self.name}{self._format_labels(labels)} ' \
+                  f'{_format_value(value)}'
+
+
+class Histogram(_ShardedMetric):
+    """Counts observed values (such as durations) in buckets."""
+    type_name = 'histogram'
+
+    def __init__(self, name: str, description: str,
+                 label_names: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str):
+        shard = self._get_shard()
+        entry = shard.get(labels)
+
+        if entry is None:
+            entry = self._create_entry()
+            shard[labels] = entry
+
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def _create_entry(self) -> list:
+        # The count in each bucket (and above the last), and the sum
+        return [[0] * (len(self.buckets) + 1), 0.0]
+
+    def get_count(self, *labels: str) -> int:
+        entry = self._get_totals().get(labels)
+        return 0 if entry is None else sum(entry[0])
+
+    def _merge(self, totals: dict, shard: dict):
+        for labels, (counts, value_sum) in list(shard.items()):
+            total = totals.get(labels)
+            if total is None:
+                total = totals[labels] = self._create_entry()
+
+            total[0] = [a + b for a, b in zip(total[0], counts)]
+            total[1] += value_sum
+
+    def collect(self) -> Iterator[str]:
+        for labels, (counts, value_sum) in sorted(self._get_totals().items()):
+            cumulative = 0
+            for bucket, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                bound = '+Inf' if bucket == float('inf') else repr(bucket)
+                yield f'{self.name}_bucket' \
+                      f'{self._format_labels(labels, ("le", bound))} ' \
+                      f'{cumulative}'
+
+            yield f'{self.name}_sum{self._format_labels(labels)} ' \
+                  f'{_format_value(value_sum)}'
+            yield f'{self.name}_count{self._format_labels(labels)} ' \
+                  f'{cumulative}'
+
+
+class CallbackMetric(Metric):
+    """A metric whose values are read from a function when collected."""
+    def __init__(self, name: str, description: str,
+                 function: Callable[[], dict[Labels, float]],
+                 label_names: Iterable[str] = (),
+                 type_name: str = 'gauge'):
+        super().__init__(name, description, label_names)
+        self.type_name = type_name
+        self._function = function
+
+    def collect(self) -> Iterator[str]:
+        for labels, value in sorted(self._function().items()):
+            yield f'{self.name}{self._format_labels(labels)} ' \
+                  f'{_format_value(value)}'
+
+
+class MetricsRegistry:
+    """Stores metrics, and renders them in the Prometheus text format."""
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._lock = Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'A metric called {metric.name} is already '
+                                 f'registered.')
+            self._metrics[metric.name] = metric
+
+        return metric
+
+    def counter(self, name: str, description: str,
+                label_names: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, description, label_names))
+
+    def histogram(self, name: str, description: str,
+                  label_names: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, description, label_names,
+                                       buckets))
+
+    def callback(self, name: str, description: str,
+                 function: Callable[[], dict[Labels, float]],
+                 label_names: Iterable[str] = (),
+                 type_name: str = 'gauge') -> CallbackMetric:
+        return self.register(CallbackMetric(name, description, function,
+                                            label_names, type_name))
+
+    def get(self, name: str) -> Metric:
+        return self._metrics[name]
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        return ''.join(f'{metric.render()}\n' for metric in metrics)
+
+
+def _escape_help(text: str) -> str:
+    return text.replace('\\', r'\\').replace('\n', r'\n')
+
+
+def _escape_label(value: str) -> str:
+    return _escape_help(value).replace('"', r'\"')
+
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class RequestMetrics:
+    """
+    The metrics of a PyHP app: requests by path and status, the duration of
+    requests and of each stage of rendering, includes, bytes sent, renders
+    that exceeded a limit, and the hits and misses of the app's caches.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        if registry is None:
+            registry = MetricsRegistry()
+        self.registry = registry
+        self._caches: dict[str, Callable[[], Optional['LRUCache']]] = {}
+
+        self.requests = registry.counter(
+            'pyhp_requests_total', 'Requests handled, by file and status.',
+            ('path', 'status'))
+        self.request_duration = registry.histogram(
+            'pyhp_request_duration_seconds',
+            'Time taken to handle each request.')
+        self.stage_duration = registry.histogram(
+            'pyhp_stage_duration_seconds',
+            'Time taken by each stage of rendering (for each template, code '
+            'block or include).', ('stage',))
+        self.includes = registry.counter('pyhp_includes_total',
+                                         'Files included by pages.')
+        self.response_bytes = registry.counter('pyhp_response_bytes_total',
+                                               'Bytes of response bodies '
+                                               'sent.')
+        self.limits_exceeded = registry.counter(
+            'pyhp_render_limits_exceeded_total',
+            'Renders stopped for exceeding a limit, by limit.', ('limit',))
+
+        for suffix, attribute, description in (
+                ('hits', 'hits', 'Lookups that found an entry'),
+                ('misses', 'misses', 'Lookups that did not find an entry'),
+                ('evictions', 'evictions', 'Entries removed to make space')):
+            registry.callback(
+                f'pyhp_cache_{suffix}_total', f'{description}, by cache.',
+                partial(self._read_caches, attribute), ('cache',),
+                'counter')
+        registry.callback('pyhp_cache_size', 'Size of the entries in each '
+                                             'cache (in bytes, or entries '
+                                             'for the path cache).',
+                          partial(self._read_caches, 'total_size'),
+                          ('cache',))
+
+    def add_cache(self, name: str,
+                  get_cache: Callable[[], Optional['LRUCache']]):
+        """
+        Report the stats of a cache, which is looked up each time the
+        metrics are collected (in case it is replaced).
+        """
+        self._caches[name] = get_cache
+
+    def _read_caches(self, attribute: str) -> dict[Labels, float]:
+        values = {}
+
+        for name, get_cache in self._caches.items():
+            cache = get_cache()
+            if cache is not None:
+                values[(name,)] = getattr(cache, attribute)
+
+        return values
+
+    def observe_request(self, path: str, status_code: int, duration: float,
+                        profile: Optional['RenderProfile'] = None):
+        self.requests.inc(path, str(status_code))
+        self.request_duration.observe(duration)
+
+        if profile is not None:
+            for timing in profile.timings:
+                self.stage_duration.observe(timing.duration, timing.stage)
+                if timing.stage == 'include':
+                    self.includes.inc()
+
+    def count_bytes(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Yield the chunks of a streamed body, counting their size."""
+        try:
+            for chunk in chunks:
+                self.response_bytes.inc(amount=len(chunk))
+                yield chunk
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
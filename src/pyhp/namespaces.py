@@ -0,0 +1,70 @@
+"""
+Sets up the namespaces that PyHP code blocks are executed in.
+"""
+
+import builtins
+import sys
+from importlib import import_module
+from threading import Lock
+from typing import Any, Iterable, Optional
+
+
+class NamespaceFactory:
+    """
+    Creates the globals for each page by copying a base namespace, which is
+    built once and holds the builtins, the preloaded modules and any helpers.
+
+    Modules are given by name ('json' or 'os.path', which binds 'os'),
+    optionally with an alias ('numpy as np'). They are imported when the
+    base namespace is first needed, or straight away if preload is True
+    (so that a worker can import them before serving any requests).
+    """
+    def __init__(self, modules: Iterable[str] = (),
+                 helpers: Optional[dict[str, Any]] = None,
+                 preload: bool = False):
+        self._modules = tuple(modules)
+        self._helpers = dict(helpers or {})
+        self._base: Optional[dict[str, Any]] = None
+        self._lock = Lock()
+
+        if preload:
+            self.preload()
+
+    def preload(self) -> dict[str, Any]:
+        """Import the modules and build the base namespace, if not yet built."""
+        if self._base is None:
+            with self._lock:
+                if self._base is None:
+                    self._base = self._build_base()
+
+        return self._base
+
+    def create(self, **names: Any) -> dict[str, Any]:
+        """Return a new namespace, with the given names added to the base."""
+        namespace = self.preload().copy()
+        namespace.update(names)
+        return namespace
+
+    def _build_base(self) -> dict[str, Any]:
+        base: dict[str, Any] = {'__builtins__': builtins}
+
+        for module in self._modules:
+            name, _, alias = (part.strip() for part in module.partition(' as '))
+            import_module(name)
+
+            if alias:
+                base[alias] = sys.modules[name]
+            else:
+                top_level_name = name.partition('.')[0]
+                base[top_level_name] = sys.modules[top_level_name]
+
+        base.update(self._helpers)
+        return base
+
+    @property
+    def modules(self) -> tuple[str, ...]:
+        """Return the names of the preloaded modules."""
+        return self._modules
+
+
+DEFAULT_NAMESPACE_FACTORY = NamespaceFactory()
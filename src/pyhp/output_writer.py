@@ -0,0 +1,66 @@
+"""
+Sets up the buffer that the output of a code block is printed to when a
+page is rendered as bytes (as it is by the servers).
+
+The output is encoded as it is written, in chunks of about 64 KiB, so a
+large page is never held as one string, nor copied into one (the chunks
+are sent as the body of the response as they are).
+"""
+
+from typing import Union
+
+
+# Writes are collected into chunks of about this many characters
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class OutputWriter:
+    """
+    A text stream that encodes everything written to it as UTF-8.
+
+    Writes are collected until they add up to chunk_size characters, then
+    encoded together as one chunk (so a chunk is only larger than that if
+    a single write was).
+    """
+    __slots__ = ('_chunk_size', '_chunks', '_pending', '_pending_size')
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self._chunk_size = chunk_size
+        self._chunks: list[bytes] = []
+        self._pending: list[str] = []
+        self._pending_size = 0
+
+    def write(self, text: str) -> int:
+        """Add output, returning the number of characters written."""
+        size = len(text)
+        self._pending.append(text)
+        self._pending_size += size
+
+        if self._pending_size >= self._chunk_size:
+            self._end_chunk()
+
+        return size
+
+    def write_bytes(self, data: Union[bytes, memoryview]):
+        """Add UTF-8 encoded output (such as the hypertext of a template)."""
+        self._end_chunk()
+        # Copies memoryviews, but not bytes
+        self._chunks.append(bytes(data))
+
+    def _end_chunk(self):
+        if self._pending:
+            self._chunks.append(''.join(self._pending).encode('utf-8'))
+            self._pending.clear()
+            self._pending_size = 0
+
+    def flush(self):
+        """Do nothing, since the output is only read once it is complete."""
+
+    def get_chunks(self) -> list[bytes]:
+        """Return the output written so far, as a list of chunks."""
+        self._end_chunk()
+        return self._chunks
+
+    def getvalue(self) -> str:
+        """Return the output written so far, as a string."""
+        return b''.join(self.get_chunks()).decode('utf-8')
@@ -0,0 +1,88 @@
+"""
+Sets up functions for compiling PyHP files ahead of time, and loading the
+compiled artifacts.
+
+Each artifact stores the file's sections, with the code blocks as marshalled
+code objects (as in a .pyc file), alongside the stamp of the source file it
+was compiled from.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import os
+from pathlib import Path, PurePath
+from typing import Hashable, Optional
+
+try:
+    from file_processing import SystemFileProcessor, PYHP_FILE_EXTENSION, \
+        write_file_atomically
+    from template_cache import CompiledTemplate, load_template, \
+        dump_template, load_dumped_template
+except ImportError:
+    from .file_processing import SystemFileProcessor, PYHP_FILE_EXTENSION, \
+        write_file_atomically
+    from .template_cache import CompiledTemplate, load_template, \
+        dump_template, load_dumped_template
+
+
+COMPILED_DIR_NAME = '__pyhpcache__'
+COMPILED_FILE_SUFFIX = '.pyhpc'
+
+
+def compile_directory(base_dir: Path,
+                      compiled_dir: Optional[Path] = None) -> list[PurePath]:
+    """
+    Compile every PyHP file in the directory, and return the relative paths
+    of the compiled files.
+    """
+    base_dir = base_dir.resolve()
+    compiled_dir = get_compiled_dir(base_dir, compiled_dir)
+    file_processor = SystemFileProcessor(base_dir)
+    compiled = []
+
+    for path in sorted(base_dir.rglob(f'*.{PYHP_FILE_EXTENSION}')):
+        if compiled_dir in path.parents:
+            continue
+
+        relative_path = PurePath(path.relative_to(base_dir))
+        write_artifact(compiled_dir, relative_path,
+                       file_processor.get_file_stamp(relative_path),
+                       load_template(file_processor, relative_path))
+        compiled.append(relative_path)
+
+    return compiled
+
+
+def get_compiled_dir(base_dir: Path,
+                     compiled_dir: Optional[Path] = None) -> Path:
+    if compiled_dir is None:
+        compiled_dir = base_dir / COMPILED_DIR_NAME
+    return compiled_dir.resolve()
+
+
+def get_artifact_path(compiled_dir: Path, relative_path: PurePath) -> Path:
+    relative_path = PurePath(os.path.normpath(relative_path))
+    return compiled_dir / relative_path.parent / \
+        f'{relative_path.name}{COMPILED_FILE_SUFFIX}'
+
+
+def write_artifact(compiled_dir: Path, relative_path: PurePath,
+                   stamp: Hashable, template: CompiledTemplate):
+    artifact_path = get_artifact_path(compiled_dir, relative_path)
+    artifact_path.parent.mkdir(parents=True, exist_ok=True)
+
+    write_file_atomically(artifact_path, dump_template(stamp, template))
+
+
+def load_artifact(compiled_dir: Path, relative_path: PurePath,
+                  stamp: Hashable) -> Optional[CompiledTemplate]:
+    """
+    Return the compiled template for the file, or None if there is no
+    artifact or it is out of date.
+    """
+    try:
+        data = get_artifact_path(compiled_dir, relative_path).read_bytes()
+    except OSError:
+        return None
+
+    return load_dumped_template(data, stamp)
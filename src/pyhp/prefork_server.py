@@ -0,0 +1,387 @@
+"""
+Sets up a pre-forking WSGI server, for running PyHP apps in production
+without any other services (on systems that support os.fork).
+
+The app is created, and every PyHP file it serves is compiled, before the
+workers are forked, so the workers share the compiled templates (copy-on-
+write) instead of compiling them on their first requests. Every worker
+accepts connections from the same listening socket, and handles one
+request at a time.
+
+Send SIGHUP to the server to restart it gracefully: the app is created and
+preloaded again, new workers are forked, and the old workers finish their
+current requests before they exit. Send SIGTERM or SIGINT to stop it.
+
+If the app renders pages in a process pool (PYHP_RENDER_PROCESSES), the
+supervisor creates the app without starting the pool, since it never
+renders pages, and each worker starts its own pool and shuts it down when
+it exits.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import gc
+import os
+import signal
+import socket
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from http.client import HTTPConnection
+from pathlib import PurePath
+from threading import Thread
+from time import perf_counter, sleep
+from typing import Callable, NoReturn, Optional
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, \
+    ServerHandler
+
+from flask import Flask
+
+try:
+    from process_pool import defer_start
+except ImportError:
+    from .process_pool import defer_start
+
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+# Seconds between checks for workers that have exited
+SUPERVISE_INTERVAL = 0.1
+
+
+class SendfileServerHandler(ServerHandler):
+    """
+    Sends files that the app returns through wsgi.file_wrapper with
+    os.sendfile, so they are copied from the page cache to the socket
+    without passing through Python.
+    """
+    def sendfile(self) -> bool:
+        if not hasattr(os, 'sendfile'):
+            return False
+
+        try:
+            in_fd = self.result.filelike.fileno()
+            out_fd = self.stdout.fileno()
+            offset = self.result.filelike.tell()
+        except (AttributeError, OSError):
+            return False
+
+        remaining = os.fstat(in_fd).st_size - offset
+        content_length = self.headers.get('Content-Length')
+        if content_length is not None:
+            remaining = min(remaining, int(content_length))
+
+        if not self.headers_sent:
+            self.send_headers()
+        self.stdout.flush()
+
+        while remaining > 0:
+            sent = os.sendfile(out_fd, in_fd, offset, remaining)
+            if sent == 0:
+                break
+            offset += sent
+            remaining -= sent
+            self.bytes_sent += sent
+
+        return True
+
+
+class SendfileRequestHandler(WSGIRequestHandler):
+    """Handles requests with a SendfileServerHandler."""
+    def handle(self):
+        # As WSGIRequestHandler.handle, with a different server handler
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+
+        if not self.parse_request():
+            return
+
+        handler = SendfileServerHandler(
+            self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+            multithread=False)
+        handler.request_handler = self  # pylint: disable=attribute-defined-outside-init
+        handler.run(self.server.get_app())
+
+
+class QuietRequestHandler(SendfileRequestHandler):
+    """Handles requests without logging each of them."""
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class SharedWSGIServer(WSGIServer):
+    """A WSGI server whose socket is shared by several workers."""
+    # Connections wait for a free worker instead of being refused
+    request_queue_size = socket.SOMAXCONN
+
+
+class PreforkServer:
+    """
+    A server that forks a fixed number of workers from a preloaded app, and
+    replaces any worker that exits.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, app_factory: Callable[[], Flask],
+                 host: str = '127.0.0.1', port: int = 5000,
+                 workers: int = DEFAULT_WORKERS, log_requests: bool = False):
+        if not hasattr(os, 'fork'):
+            raise OSError('The pre-forking server requires os.fork.')
+        if workers < 1:
+            raise ValueError('At least one worker is required.')
+
+        self._app_factory = app_factory
+        self._worker_count = workers
+        self._server = SharedWSGIServer(
+            (host, port),
+            SendfileRequestHandler if log_requests else QuietRequestHandler)
+        self._app: Optional[Flask] = None
+        self._workers: set[int] = set()
+        # Workers from before a restart, that are finishing their requests
+        self._retiring_workers: set[int] = set()
+        self._restart_requested = False
+        self._stop_requested = False
+
+    def load_app(self) -> list[PurePath]:
+        """
+        Create the app and compile every PyHP file it serves, and return
+        the relative paths of the files.
+        """
+        # Let the previous app be collected
+        gc.unfreeze()
+
+        # Each worker starts its own process pool
+        with defer_start():
+            app = self._app_factory()
+        state = app.extensions['pyhp']
+        # Threads do not survive forking, so each worker starts its own
+        state.file_processor.stop_watching()
+        preloaded = state.preload_templates()
+
+        self._app = app
+        self._server.set_app(app)
+
+        # Keep the garbage collector from writing to (and so copying) the
+        # objects that the workers share
+        gc.collect()
+        gc.freeze()
+
+        return preloaded
+
+    def serve_forever(self):
+        """Fork the workers, and supervise them until the server is stopped."""
+        if self._app is None:
+            self.load_app()
+
+        signal.signal(signal.SIGHUP, self._request_restart)
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        try:
+            self._spawn_workers()
+
+            while not self._stop_requested:
+                if self._restart_requested:
+                    self._restart_requested = False
+                    self._restart()
+
+                self._reap_workers()
+                sleep(SUPERVISE_INTERVAL)
+        finally:
+            self._stop_workers(self._workers | self._retiring_workers)
+            self.close()
+
+    def close(self):
+        """Close the listening socket (in this process)."""
+        self._server.server_close()
+
+    def _request_restart(self, *_):
+        self._restart_requested = True
+
+    def _request_stop(self, *_):
+        self._stop_requested = True
+
+    def _restart(self):
+        old_workers = self._workers
+        self._workers = set()
+
+        self.load_app()
+        self._spawn_workers()
+
+        # The old workers exit once they have finished their current
+        # requests, and are then reaped without being replaced
+        self._retiring_workers |= old_workers
+        for pid in old_workers:
+            _kill(pid, signal.SIGTERM)
+
+    def _spawn_workers(self):
+        while len(self._workers) < self._worker_count:
+            self._workers.add(self._spawn_worker())
+
+    def _spawn_worker(self) -> int:
+        return fork(self._run_worker)
+
+    def _run_worker(self):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        # The supervisor stops the workers when it is interrupted
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, self._shut_down_worker)
+
+        state = self._app.extensions['pyhp']
+        # Started before any watcher thread, since its processes are forked
+        if state.process_pool is not None:
+            state.process_pool.start()
+        if state.config['PYHP_WATCH_FILES']:
+            state.file_processor.start_watching(
+                state.config['PYHP_WATCH_POLL_INTERVAL'])
+
+        try:
+            self._server.serve_forever()
+        finally:
+            # The worker exits without running atexit handlers, which would
+            # otherwise stop the pool
+            if state.process_pool is not None:
+                state.process_pool.shutdown()
+
+    def _shut_down_worker(self, *_):
+        # shutdown waits for serve_forever to return, so it cannot be called
+        # from the thread that is serving
+        Thread(target=self._server.shutdown, daemon=True).start()
+
+    def _reap_workers(self):
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+
+            if pid == 0:
+                return
+
+            self._retiring_workers.discard(pid)
+            if pid in self._workers:
+                self._workers.discard(pid)
+                if not self._stop_requested:
+                    self._workers.add(self._spawn_worker())
+
+    @staticmethod
+    def _stop_workers(workers: set[int]):
+        for pid in workers:
+            _kill(pid, signal.SIGTERM)
+
+        for pid in workers:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+
+    @property
+    def server_address(self) -> tuple[str, int]:
+        """Return the host and port that the server is listening on."""
+        host, port = self._server.server_address[:2]
+        return host, port
+
+    @property
+    def workers(self) -> set[int]:
+        """Return the process IDs of the current workers."""
+        return set(self._workers)
+
+
+def fork(function: Callable[[], None]) -> int:
+    """
+    Call the function in a forked process, which exits once the function
+    returns (instead of returning into the caller), and return its ID.
+    """
+    pid = os.fork()
+    if pid == 0:
+        _run_and_exit(function)
+
+    return pid
+
+
+def _run_and_exit(function: Callable[[], None]) -> NoReturn:
+    exit_code = 0
+    try:
+        function()
+    except BaseException:  # pylint: disable=broad-except
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        os._exit(exit_code)  # pylint: disable=protected-access
+
+
+def _kill(pid: int, signal_number: int):
+    try:
+        os.kill(pid, signal_number)
+    except ProcessLookupError:
+        pass
+
+
+@dataclass
+class BenchmarkResult:
+    """Stores the outcome of a benchmark."""
+    requests: int
+    errors: int
+    seconds: float
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.requests / self.seconds if self.seconds else 0.0
+
+
+def benchmark(host: str, port: int, path: str = '/', requests: int = 1000,
+              concurrency: int = 8) -> BenchmarkResult:
+    """
+    Send GET requests for the path to a running server, from concurrency
+    clients at once, and return how long they took.
+
+    Requests that fail, or get a response with a status of 500 or above,
+    are counted as errors.
+    """
+    def send_request(_) -> bool:
+        connection = HTTPConnection(host, port, timeout=30)
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            return response.status < 500
+        except OSError:
+            return False
+        finally:
+            connection.close()
+
+    start = perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        succeeded = sum(executor.map(send_request, range(requests)))
+    seconds = perf_counter() - start
+
+    return BenchmarkResult(requests, requests - succeeded, seconds)
+
+
+def run_benchmark(app_factory: Callable[[], Flask], path: str = '/',
+                  workers: int = DEFAULT_WORKERS, requests: int = 1000,
+                  concurrency: int = 8) -> BenchmarkResult:
+    """
+    Start a pre-forking server for the app on a free local port, benchmark
+    it, and stop it.
+    """
+    # pylint: disable=too-many-arguments
+    server = PreforkServer(app_factory, '127.0.0.1', 0, workers)
+    server.load_app()
+    host, port = server.server_address
+
+    pid = fork(server.serve_forever)
+    server.close()
+
+    try:
+        # The socket was listening before the fork, so the first requests
+        # wait for the workers instead of failing
+        return benchmark(host, port, path, requests, concurrency)
+    finally:
+        _kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+        # Loading the app froze the objects in this process too
+        gc.unfreeze()
@@ -0,0 +1,295 @@
+"""
+Sets up a pool of worker processes that pages can be rendered in, so that
+CPU-bound pages run in parallel (rather than holding the GIL of the server
+process), and a page that crashes its process does not take the server
+down with it.
+
+Each worker sets up its own copy of the app's state (loading the preloaded
+modules and compiling every template) when it starts, and the pool is
+started and warmed up when it is created (each worker checks in at a
+barrier, so that none of them can take the place of another). A pool that
+replaces a broken one is warmed up in the background. The request data is
+sent to a worker, and the rendered page (with its status, cookies, redirect
+and cache options) is sent back, pickled.
+
+The first pool is forked (where fork is available), so its workers start
+with the server's modules already imported. A pool started later, once the
+server may be running other threads, uses the spawn start method instead,
+as forking a process with threads can copy locks that are held (and a
+forkserver cannot be shared with the processes forked from the one that
+started it). A pool belongs to the process that started it, so a process
+forked from the server (such as a worker of the pre-forking server) starts
+its own. Pools created within defer_start are not started until start is
+called, so a process that only forks the ones that render pages (such as
+the supervisor of the pre-forking server) does not start one itself.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import asyncio
+import multiprocessing
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import Future, ProcessPoolExecutor, wait, \
+    TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import PurePath
+from threading import Barrier, BrokenBarrierError, Lock, Thread
+from typing import TYPE_CHECKING, Callable, Iterator, Optional
+
+try:
+    from response_cache import RenderedPage, CacheOptions
+    from render_limits import RenderTimeout, get_current_budget
+except ImportError:
+    from .response_cache import RenderedPage, CacheOptions
+    from .render_limits import RenderTimeout, get_current_budget
+
+if TYPE_CHECKING:
+    from .app_setup import AppState
+    from .pyhp_interface import Pyhp
+
+
+# The start methods of the first pool, and of the pools started after it
+START_METHOD = 'fork' if 'fork' in multiprocessing.get_all_start_methods() \
+    else 'spawn'
+RESTART_METHOD = 'spawn'
+# Seconds past the render timeout that a worker is given to report its own
+# timeout, before it is treated as stuck (for example in a call into C)
+TIMEOUT_GRACE_PERIOD = 0.5
+# Seconds that a worker waits for the others to check in while the pool is
+# warmed up (in case one of them never starts)
+WARM_UP_TIMEOUT = 60
+
+# Set up in each worker process by its initializer
+_worker_state: Optional['AppState'] = None  # pylint: disable=invalid-name
+_warm_up_barrier: Optional[Barrier] = None  # pylint: disable=invalid-name
+
+_start_deferred: ContextVar[bool] = ContextVar('_start_deferred',
+                                               default=False)
+
+
+@dataclass
+class RenderRequest:
+    """Stores the request data that a page is rendered with."""
+    path: str
+    debug: bool
+    cookies: dict[str, str]
+    get: dict[str, str]
+    post: dict[str, str]
+
+
+@dataclass
+class RenderResult:
+    """Stores a page rendered by a worker, and its cache options."""
+    page: RenderedPage
+    cache_options: Optional[CacheOptions]
+
+
+class ProcessPoolRenderer:
+    """
+    Renders pages in a pool of worker processes.
+
+    The state factory is called in each worker to create the app's state,
+    so it must be picklable (such as a partial of a module-level function),
+    as the pool is restarted without forking.
+    """
+    def __init__(self, state_factory: Callable[[], 'AppState'],
+                 processes: int):
+        self._state_factory = state_factory
+        self._processes = processes
+        self._lock = Lock()
+        self._pid: Optional[int] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+        if not _start_deferred.get():
+            self.start()
+
+    def _create(self, start_method: str) -> ProcessPoolExecutor:
+        # The processes are only started once calls are submitted
+        context = multiprocessing.get_context(start_method)
+        barrier = context.Barrier(self._processes)
+
+        return ProcessPoolExecutor(self._processes, context, _start_worker,
+                                   (self._state_factory, barrier))
+
+    def _warm_up(self, executor: ProcessPoolExecutor):
+        # Start every process now (rather than on the first requests), and
+        # wait until they have set up. Each call blocks until every process
+        # has taken one, so that no process takes two.
+        wait([executor.submit(_check_in) for _ in range(self._processes)])
+
+    def _submit(self, path: PurePath, pyhp_class: 'Pyhp'
+                ) -> tuple[ProcessPoolExecutor, Future]:
+        request = RenderRequest(path.as_posix(), pyhp_class.debug,
+                                dict(pyhp_class.cookies),
+                                dict(pyhp_class.get), dict(pyhp_class.post))
+
+        executor = self._get_executor()
+
+        try:
+            return executor, executor.submit(_render, request)
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            # The pool's processes (and the threads that talk to them) are
+            # the parent's, so a forked process starts its own pool
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = self._create(
+                    START_METHOD if self._executor is None
+                    else RESTART_METHOD)
+
+            return self._executor
+
+    def start(self):
+        """
+        Start the pool in this process (if it has not been started, or was
+        started by the process this one was forked from), and wait until it
+        has warmed up, so that the first page rendered here does not wait
+        for it.
+        """
+        self._warm_up(self._get_executor())
+
+    def render(self, path: PurePath, pyhp_class: 'Pyhp') -> RenderedPage:
+        """
+        Render the page at the path (relative to the base directory) in a
+        worker, with the request data of the Pyhp object, and copy the
+        page's cache options onto the Pyhp object.
+
+        Raises RuntimeError if the worker exits while rendering the page
+        (and replaces the pool), or any error that the page raised. If the
+        render has a timeout, and the worker has not finished the page soon
+        after the time left, raises RenderTimeout and replaces the pool
+        (stopping its processes, and the other pages they are rendering).
+        """
+        executor, future = self._submit(path, pyhp_class)
+        return self._get_page(executor, future, pyhp_class,
+                              get_time_left())
+
+    async def render_async(self, path: PurePath,
+                           pyhp_class: 'Pyhp') -> RenderedPage:
+        """Render the page in a worker, without blocking the event loop."""
+        executor, future = self._submit(path, pyhp_class)
+        await asyncio.wait([asyncio.wrap_future(future)],
+                           timeout=get_time_left())
+        return self._get_page(executor, future, pyhp_class, 0)
+
+    def _get_page(self, executor: ProcessPoolExecutor, future: Future,
+                  pyhp_class: 'Pyhp',
+                  timeout: Optional[float] = None) -> RenderedPage:
+        try:
+            result: RenderResult = future.result(timeout)
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise RuntimeError('The process rendering the page '
+                               'exited.') from None
+        except FutureTimeoutError:
+            self._restart(executor, terminate=True)
+            raise RenderTimeout() from None
+
+        if result.cache_options is not None:
+            pyhp_class.cache(result.cache_options.ttl,
+                             result.cache_options.vary_on)
+
+        return result.page
+
+    def _restart(self, broken: ProcessPoolExecutor, terminate: bool = False):
+        with self._lock:
+            # Another request may already have replaced the pool
+            if broken is not self._executor:
+                return
+            self._executor = executor = self._create(RESTART_METHOD)
+
+        # Stopped before the new pool starts, so that a stuck worker does
+        # not keep running while it warms up
+        processes = []
+        if terminate:
+            # The executor cannot stop a process that is running a call
+            # pylint: disable=protected-access
+            processes = list((broken._processes or {}).values())
+
+        for process in processes:
+            process.terminate()
+        broken.shutdown(wait=False, cancel_futures=terminate)
+
+        # In the background, so that the request that found the pool broken
+        # does not wait for it (pages rendered in the meantime start the
+        # processes they need)
+        Thread(target=self._warm_up, args=(executor,), daemon=True).start()
+
+    def shutdown(self):
+        """
+        Stop the pool's processes, once they have finished the pages they
+        are rendering (if it was started by this process).
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                self._executor.shutdown()
+
+    @property
+    def processes(self) -> int:
+        """Return the number of worker processes."""
+        return self._processes
+
+
+@contextmanager
+def defer_start() -> Iterator[None]:
+    """
+    Create the pools of the apps set up within the block without starting
+    them, until start is called (in each process that renders pages).
+    """
+    token = _start_deferred.set(True)
+    try:
+        yield
+    finally:
+        _start_deferred.reset(token)
+
+
+def get_time_left() -> Optional[float]:
+    """
+    Return the seconds that the current render has left before its timeout
+    (plus the grace period), or None if it has no timeout.
+    """
+    budget = get_current_budget()
+    if budget is None or budget.limits.timeout is None:
+        return None
+
+    time_left = budget.limits.timeout - budget.get_elapsed()
+    return max(time_left, 0) + TIMEOUT_GRACE_PERIOD
+
+
+def _start_worker(state_factory: Callable[[], 'AppState'],
+                  warm_up_barrier: Barrier):
+    global _worker_state, _warm_up_barrier  # pylint: disable=global-statement
+
+    _warm_up_barrier = warm_up_barrier
+    _worker_state = state_factory()
+    _worker_state.preload_templates()
+
+
+def _check_in():
+    # A barrier that is broken (if a worker never started) is not waited on
+    # again
+    try:
+        _warm_up_barrier.wait(WARM_UP_TIMEOUT)
+    except BrokenBarrierError:
+        pass
+
+
+def _render(request: RenderRequest) -> RenderResult:
+    path = PurePath(request.path)
+    pyhp_class = _worker_state.create_pyhp(path.parent, request.debug,
+                                           request.cookies, request.get,
+                                           request.post)
+
+    # Errors (such as exceeding a render limit) are raised in the server
+    with _worker_state.limit_render():
+        body = b''.join(pyhp_class.stream(path.name, encoded=True))
+
+    return RenderResult(RenderedPage.from_pyhp(body, pyhp_class),
+                        pyhp_class.get_cache_options())
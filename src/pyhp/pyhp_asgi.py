@@ -0,0 +1,330 @@
+"""
+PyHP: Python Hypertext Preprocessor
+
+This is an ASGI app that can be used to run PyHP files. Pages are rendered
+on the event loop, and code blocks may use await at the top level (for
+example `<pyhp>rows = await database.fetch(query)</pyhp>`), so a page that
+is waiting on I/O does not hold up other requests. Blocking code in a page
+still blocks the event loop.
+
+Serve the examples by passing `create_asgi_app('./examples')` to any ASGI
+server, such as uvicorn.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field, replace
+from pathlib import Path, PurePath
+from traceback import format_exc
+from typing import Any, Awaitable, Callable, Optional
+from urllib.parse import parse_qsl
+
+from werkzeug.http import dump_cookie, parse_cookie, quote_etag, http_date
+from werkzeug.sansio.http import is_resource_modified
+
+try:
+    from pyhp_interface import Pyhp
+    from response_cache import RenderedPage
+    from app_setup import AppState, create_app_state, DEFAULT_CONFIG
+    from render_limits import RenderLimits, RenderLimitExceeded, \
+        RenderTimeout
+    from static_files import StaticFile, get_static_file, open_static_file
+except ImportError:
+    from .pyhp_interface import Pyhp
+    from .response_cache import RenderedPage
+    from .app_setup import AppState, create_app_state, DEFAULT_CONFIG
+    from .render_limits import RenderLimits, RenderLimitExceeded, \
+        RenderTimeout
+    from .static_files import StaticFile, get_static_file, open_static_file
+
+
+Scope = dict[str, Any]
+Receive = Callable[[], Awaitable[dict[str, Any]]]
+Send = Callable[[dict[str, Any]], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ASGIResponse:
+    """Stores a response before it is sent."""
+    status_code: int
+    body: bytes = b''
+    headers: list[tuple[str, str]] = field(default_factory=list)
+
+
+def create_asgi_app(base_dir: str,
+                    config: Optional[dict[str, Any]] = None) -> ASGIApp:
+    """
+    Create a PyHP ASGI app and return it.
+
+    The config is applied on top of DEFAULT_CONFIG (and DEBUG, which is
+    False by default) before the app is set up. PYHP_STREAM_BUFFER_SIZE is
+    ignored, since every page is rendered before it is sent.
+
+    PYHP_RENDER_CPU_TIME requires PYHP_RENDER_PROCESSES, and is only
+    applied in the worker processes, since the CPU time of a page rendered
+    on the event loop cannot be told apart from that of the other requests
+    on it.
+    """
+    base_dir = Path(base_dir).absolute()
+
+    app_config = dict(DEFAULT_CONFIG, DEBUG=False)
+    app_config.update(config or {})
+
+    if app_config['PYHP_RENDER_CPU_TIME'] is not None and \
+            app_config['PYHP_RENDER_PROCESSES'] is None:
+        raise ValueError('The ASGI app can only limit the CPU time of pages '
+                         'rendered in worker processes '
+                         '(PYHP_RENDER_PROCESSES).')
+
+    state = create_app_state(base_dir, app_config)
+    if state.render_limits is not None:
+        render_limits = replace(state.render_limits, cpu_time=None)
+        state.render_limits = render_limits \
+            if render_limits != RenderLimits() else None
+
+    async def app(scope: Scope, receive: Receive, send: Send):
+        if scope['type'] == 'lifespan':
+            await handle_lifespan(receive, send)
+            return
+
+        if scope['type'] != 'http':
+            raise ValueError(f'Unsupported ASGI scope ({scope["type"]}).')
+
+        try:
+            response = await handle_request(state, scope, receive)
+        except Exception:  # pylint: disable=broad-except
+            # Such as a page that cannot be loaded (errors in code blocks
+            # are part of the page)
+            logger.exception('Error handling a request for %s',
+                             scope['path'])
+            response = ASGIResponse(
+                500, format_exc().encode() if state.config['DEBUG'] else b'')
+
+        await send_response(send, response, scope['method'] == 'HEAD')
+
+    return app
+
+
+async def handle_lifespan(receive: Receive, send: Send):
+    """Acknowledge the startup and shutdown of the server."""
+    while True:
+        message = await receive()
+
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def handle_request(state: AppState, scope: Scope,
+                         receive: Receive) -> ASGIResponse:
+    """Handle a request in the same way as the Flask app."""
+    # pylint: disable=too-many-return-statements
+    method = scope['method']
+    if method not in ('GET', 'HEAD', 'POST'):
+        return ASGIResponse(405)
+
+    path = scope['path'].lstrip('/') or 'index'
+    if path.endswith('/'):
+        return create_redirect('index')
+
+    debug = state.config['DEBUG']
+
+    try:
+        relative_path = state.resolve_path(path)
+    except FileNotFoundError:
+        if debug:
+            return ASGIResponse(404, f'File not found: {path}'.encode())
+        return ASGIResponse(404)
+    except IsADirectoryError:
+        return create_redirect(f'/{path}/')
+
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+               for name, value in scope['headers']}
+
+    if not state.file_processor.is_pyhp_file(relative_path):
+        return await read_static_file(state, relative_path, headers)
+
+    pyhp_class = state.create_pyhp(
+        relative_path.parent, debug,
+        dict(parse_cookie(headers.get('cookie', ''))),
+        dict(parse_qsl(scope['query_string'].decode('latin-1'),
+                       keep_blank_values=True)),
+        await read_form(headers, receive) if method == 'POST' else {},
+    )
+
+    with state.instrument_request(path) as profile:
+        response = await render_with_limits(state, relative_path, pyhp_class,
+                                            method in ('GET', 'HEAD'))
+
+    if profile is not None:
+        response.headers.append(('server-timing',
+                                 profile.get_server_timing()))
+
+    return response
+
+
+async def render_with_limits(state: AppState, relative_path: PurePath,
+                             pyhp_class: Pyhp,
+                             cacheable: bool) -> ASGIResponse:
+    """
+    Render the page within the app's render limits, responding with the
+    error (and counting it) if the render exceeds one.
+    """
+    try:
+        with state.limit_render():
+            return await render_page_with_timeout(state, relative_path,
+                                                  pyhp_class, cacheable)
+    except RenderLimitExceeded as error:
+        state.record_limit_exceeded(error)
+        return ASGIResponse(error.status_code,
+                            str(error).encode() if state.config['DEBUG']
+                            else b'')
+
+
+async def render_page_with_timeout(state: AppState,
+                                   relative_path: PurePath, pyhp_class: Pyhp,
+                                   cacheable: bool) -> ASGIResponse:
+    """
+    Render the page, cancelling it at its next await if it takes longer
+    than PYHP_RENDER_TIMEOUT.
+
+    Pages rendered in the process pool are not cancelled, as the pool
+    applies the timeout itself (and stops a worker that overruns it).
+    """
+    render = render_page(state, relative_path, pyhp_class, cacheable)
+
+    if state.render_limits is None or state.render_limits.timeout is None \
+            or state.process_pool is not None:
+        return await render
+
+    try:
+        return await asyncio.wait_for(render, state.render_limits.timeout)
+    except asyncio.TimeoutError:
+        raise RenderTimeout() from None
+
+
+async def render_page(state: AppState, relative_path: PurePath,
+                      pyhp_class: Pyhp, cacheable: bool) -> ASGIResponse:
+    """
+    Render the page (or serve it from the response cache), in the process
+    pool if the app has one.
+    """
+    response_cache = state.response_cache if cacheable else None
+
+    if response_cache is not None:
+        page = response_cache.get(relative_path, pyhp_class)
+        if page is not None:
+            return create_page_response(page)
+
+    if state.process_pool is not None:
+        page = await state.process_pool.render_async(relative_path,
+                                                     pyhp_class)
+    else:
+        chunks = [chunk async for chunk in
+                  pyhp_class.stream_async(relative_path.name, encoded=True)]
+        page = RenderedPage.from_pyhp(b''.join(chunks), pyhp_class)
+
+    if response_cache is not None:
+        response_cache.set(relative_path, pyhp_class, page)
+
+    return create_page_response(page)
+
+
+async def read_form(headers: dict[str, str],
+                    receive: Receive) -> dict[str, str]:
+    """
+    Read the body of the request, and return the form data it contains.
+
+    Only URL-encoded forms are parsed.
+    """
+    chunks = []
+
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+
+    content_type = headers.get('content-type', '').partition(';')[0].strip()
+    if content_type != FORM_CONTENT_TYPE:
+        return {}
+
+    return dict(parse_qsl(b''.join(chunks).decode('latin-1'),
+                          keep_blank_values=True))
+
+
+async def read_static_file(state: AppState, relative_path: PurePath,
+                           headers: dict[str, str]) -> ASGIResponse:
+    """
+    Read a file that is not a PyHP file, without blocking the loop, or
+    answer a conditional request for it from its cached stat result.
+    """
+    static_file = get_static_file(state.file_processor, relative_path)
+
+    if not is_resource_modified(
+            http_if_modified_since=headers.get('if-modified-since'),
+            http_if_none_match=headers.get('if-none-match'),
+            etag=static_file.etag, last_modified=static_file.last_modified):
+        return ASGIResponse(304, b'', get_validators(static_file))
+
+    body, static_file = await asyncio.to_thread(read_file, static_file)
+
+    return ASGIResponse(200, body, [('content-type', static_file.content_type),
+                                    *get_validators(static_file)])
+
+
+def read_file(static_file: StaticFile) -> (bytes, StaticFile):
+    """Return the contents of the file, with its current validators."""
+    file, static_file = open_static_file(static_file)
+    with file:
+        return file.read(), static_file
+
+
+def get_validators(static_file: StaticFile) -> list[tuple[str, str]]:
+    """Return the ETag, Last-Modified and caching headers of a file."""
+    return [('etag', quote_etag(static_file.etag)),
+            ('last-modified', http_date(static_file.last_modified)),
+            ('cache-control', 'no-cache')]
+
+
+def create_redirect(url: str, status_code: int = 302) -> ASGIResponse:
+    """Create a redirect response."""
+    return ASGIResponse(status_code, b'', [('location', url)])
+
+
+def create_page_response(page: RenderedPage) -> ASGIResponse:
+    """Create the response for a rendered (or cached) page."""
+    if page.redirect_information is not None:
+        return create_redirect(*page.redirect_information)
+
+    headers = [('content-type', 'text/html; charset=utf-8')]
+
+    for cookie in page.new_cookies.values():
+        headers.append(('set-cookie', dump_cookie(**cookie.__dict__)))
+
+    for cookie in page.delete_cookies.values():
+        headers.append(('set-cookie', dump_cookie(expires=0, max_age=0,
+                                                  **cookie.__dict__)))
+
+    return ASGIResponse(page.status_code, page.body, headers)
+
+
+async def send_response(send: Send, response: ASGIResponse,
+                        head: bool = False):
+    """Send the response (without its body, for HEAD requests)."""
+    headers = [(name.encode('latin-1'), value.encode('latin-1'))
+               for name, value in response.headers]
+    headers.append((b'content-length', str(len(response.body)).encode()))
+
+    await send({'type': 'http.response.start',
+                'status': response.status_code,
+                'headers': headers})
+    await send({'type': 'http.response.body',
+                'body': b'' if head else response.body})
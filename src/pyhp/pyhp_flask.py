@@ -7,77 +7,408 @@ Run the examples with `set FLASK_APP=pyhp_flask:create_app('./examples')` and
 `flask run`.
 """
 
-from typing import Optional
+from hmac import compare_digest
+from itertools import chain
+from time import perf_counter
+from typing import Optional, Any, Union
 from pathlib import Path, PurePath
 
-from flask import Flask, request, make_response, Response, redirect, \
-    send_from_directory
+from flask import Flask, request, make_response, Response, redirect, g, \
+    current_app
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
 
 try:
     from pyhp_interface import Pyhp
     from file_processing import SystemFileProcessor
     from cookies import NewCookie, DeleteCookie
+    from response_cache import ResponseCache, RenderedPage
+    from app_setup import AppState, create_app_state, DEFAULT_CONFIG
+    from metrics import RequestMetrics
+    from process_pool import ProcessPoolRenderer
+    from render_limits import RenderLimitExceeded, limit_stream
+    from static_files import StaticFile, get_static_file, open_static_file
+    from compression import get_accepted_encodings, is_compressible, \
+        compress, compress_chunks, get_precompressed_file
 except ImportError:
     from .pyhp_interface import Pyhp
     from .file_processing import SystemFileProcessor
     from .cookies import NewCookie, DeleteCookie
+    from .response_cache import ResponseCache, RenderedPage
+    from .app_setup import AppState, create_app_state, DEFAULT_CONFIG
+    from .metrics import RequestMetrics
+    from .process_pool import ProcessPoolRenderer
+    from .render_limits import RenderLimitExceeded, limit_stream
+    from .static_files import StaticFile, get_static_file, open_static_file
+    from .compression import get_accepted_encodings, is_compressible, \
+        compress, compress_chunks, get_precompressed_file
 
 
-def create_app(base_dir: str) -> Flask:
-    """Create a PyHP Flask app and return it."""
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def create_app(base_dir: str,
+               config: Optional[dict[str, Any]] = None) -> Flask:
+    """
+    Create a PyHP Flask app and return it.
+
+    The config is applied on top of DEFAULT_CONFIG before the app is set up,
+    and the app's shared state is stored in app.extensions['pyhp'].
+    """
     base_dir = Path(base_dir).absolute()
 
     app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+
+    state = create_app_state(base_dir, app.config)
+    app.extensions['pyhp'] = state
+
+    if state.metrics is not None:
+        add_metrics(app, state.metrics)
+
+    # After metrics, so that it runs first (and the compressed size is
+    # counted)
+    if app.config['PYHP_COMPRESSION']:
+        add_compression(app, app.config['PYHP_COMPRESSION_MIN_SIZE'])
 
     @app.route('/', defaults={'path': 'index'}, methods=['GET', 'POST'])
     @app.route('/<path:path>', methods=['GET', 'POST'])
     def catch_all(path: str) -> Response:
-        if path.endswith('/'):
-            return redirect('index')
+        return handle_request(state, path)
+
+    return app
+
 
-        file_processor = SystemFileProcessor(base_dir)
+def handle_request(state: AppState, path: str) -> Response:
+    """Handle a request for the path in the current Flask app."""
+    if path.endswith('/'):
+        return redirect('index')
+
+    try:
+        relative_path = state.resolve_path(path)
+    except FileNotFoundError:
+        if current_app.config['DEBUG']:
+            return make_response(f'File not found: {path}', 404)
+        return make_response('', 404)
+    except IsADirectoryError:
+        return redirect(f'{path}/')
+
+    g.pyhp_path = relative_path.as_posix()
+
+    # Sent before a Pyhp object (and its namespace) is set up
+    if not state.file_processor.is_pyhp_file(relative_path):
+        return send_static_file(state.file_processor, relative_path)
+
+    pyhp_class = state.create_pyhp(relative_path.parent,
+                                   current_app.config['DEBUG'],
+                                   dict(request.cookies),
+                                   dict(request.args),
+                                   dict(request.form))
+
+    with state.instrument_request(path) as profile:
+        g.pyhp_profile = profile
+        response = render_with_limits(state, relative_path, pyhp_class)
+
+    # Streamed pages are still rendering once the headers are sent
+    if profile is not None and not response.is_streamed:
+        response.headers['Server-Timing'] = profile.get_server_timing()
+
+    return response
 
-        try:
-            relative_path = file_processor.get_true_path(PurePath(path))
-        except FileNotFoundError:
-            if app.config['DEBUG']:
-                return make_response(f'File not found: {path}', 404)
+
+def render_with_limits(state: AppState, relative_path: PurePath,
+                       pyhp_class: Pyhp) -> Response:
+    """
+    Process the request for a page with the app's render limits, which stay
+    applied while the rest of a streamed page is sent (ending the stream if
+    it exceeds one).
+    """
+    try:
+        with state.limit_render() as budget:
+            response = process_request(
+                state.file_processor, PurePath(relative_path.name),
+                pyhp_class, current_app.config['PYHP_STREAM_BUFFER_SIZE'],
+                response_cache=state.response_cache
+                if request.method == 'GET' else None,
+                process_pool=state.process_pool)
+    except RenderLimitExceeded as error:
+        state.record_limit_exceeded(error)
+        return create_response(
+            str(error) if current_app.config['DEBUG'] else '',
+            error.status_code, {}, {})
+
+    if budget is not None and response.is_streamed:
+        response.response = limit_stream(response.response, budget,
+                                         state.record_limit_exceeded)
+
+    return response
+
+
+def add_metrics(app: Flask, metrics: RequestMetrics):
+    """
+    Record the metrics of every request to the app, and serve them at
+    PYHP_METRICS_PATH (only to requests with the bearer token in
+    PYHP_METRICS_TOKEN, if it is set).
+    """
+    token = app.config['PYHP_METRICS_TOKEN']
+
+    @app.route(app.config['PYHP_METRICS_PATH'])
+    def pyhp_metrics() -> Response:
+        if token is not None and not compare_digest(
+                request.headers.get('Authorization', '').encode(),
+                f'Bearer {token}'.encode()):
             return make_response('', 404)
-        except IsADirectoryError:
-            return redirect(f'{path}/')
+        return Response(metrics.registry.render(),
+                        content_type=PROMETHEUS_CONTENT_TYPE)
 
-        current_dir = relative_path.parent
+    @app.before_request
+    def start_timer():
+        g.pyhp_start = perf_counter()
 
-        pyhp_class = Pyhp(current_dir, file_processor, app.config['DEBUG'],
-                          dict(request.cookies), dict(request.args),
-                          dict(request.form))
+    @app.after_request
+    def record_metrics(response: Response) -> Response:
+        if request.endpoint == 'pyhp_metrics':
+            return response
 
-        return process_request(file_processor,
-                               PurePath(relative_path.name),
-                               pyhp_class)
+        metrics.observe_request(g.get('pyhp_path', ''),
+                                response.status_code,
+                                perf_counter() - g.pyhp_start,
+                                g.get('pyhp_profile'))
 
-    return app
+        # Static files are streamed, but their length is known
+        if response.content_length is not None:
+            metrics.response_bytes.inc(amount=response.content_length)
+        elif response.is_streamed:
+            response.response = metrics.count_bytes(response.response)
+        else:
+            metrics.response_bytes.inc(
+                amount=response.calculate_content_length() or 0)
+
+        return response
+
+
+def add_compression(app: Flask, min_size: int):
+    """
+    Compress the pages sent by the app, for clients that accept it (other
+    files are only sent compressed if they have been precompressed).
+    """
+    @app.after_request
+    def compress_page(response: Response) -> Response:
+        return compress_response(response, min_size)
+
+
+def compress_response(response: Response, min_size: int) -> Response:
+    """
+    Compress the body of a response with the client's preferred encoding.
+
+    Streamed bodies are compressed chunk by chunk as they are sent, and other
+    bodies are compressed at once, if they are at least min_size bytes.
+    """
+    if response.direct_passthrough or \
+            response.status_code in (204, 206, 304) or \
+            'Content-Encoding' in response.headers or \
+            not is_compressible(response.content_type):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encodings = get_accepted_encodings(request.accept_encodings)
+    if not encodings:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, encodings[0])
+    else:
+        if (response.calculate_content_length() or 0) < min_size:
+            return response
+        response.set_data(compress(response.get_data(), encodings[0]))
+
+    response.content_encoding = encodings[0]
+    return response
 
 
 def process_request(file_processor: SystemFileProcessor,
-                    relative_path: PurePath, pyhp_class: Pyhp) -> Response:
-    """Process a request."""
+                    relative_path: PurePath, pyhp_class: Pyhp,
+                    stream_buffer_size: Optional[int] = None, *,
+                    response_cache: Optional[ResponseCache] = None,
+                    process_pool: Optional[ProcessPoolRenderer] = None
+                    ) -> Response:
+    """
+    Process a request.
+
+    If a response cache is given, cached pages are served from it, and
+    pages that call pyhp.cache are stored in it. If a process pool is given,
+    pages are rendered in it (and are never streamed).
+    """
+    # pylint: disable=too-many-arguments
 
     if file_processor.is_pyhp_file(relative_path):
-        page_text = pyhp_class.run(str(relative_path))
+        if response_cache is not None:
+            page = response_cache.get(pyhp_class.current_dir / relative_path,
+                                      pyhp_class)
+            if page is not None:
+                return create_page_response(page)
+
+        if process_pool is not None:
+            page = process_pool.render(
+                pyhp_class.current_dir / relative_path, pyhp_class)
+            if response_cache is not None:
+                response_cache.set(pyhp_class.current_dir / relative_path,
+                                   pyhp_class, page)
+            return create_page_response(page)
+
+        if stream_buffer_size is not None:
+            return stream_or_create_response(relative_path, pyhp_class,
+                                             stream_buffer_size,
+                                             response_cache)
+
+        # WSGI servers require bytes, rather than memoryviews of the template
+        page_chunks = list(map(bytes, pyhp_class.stream(str(relative_path),
+                                                        encoded=True)))
+
+        return cache_and_create_response(page_chunks, relative_path,
+                                         pyhp_class, response_cache)
+    return send_static_file(file_processor,
+                            pyhp_class.current_dir / relative_path)
+
+
+def send_static_file(file_processor: SystemFileProcessor,
+                     relative_path: PurePath) -> Response:
+    """
+    Send a file that is not a PyHP file, with support for conditional and
+    range requests.
+
+    Conditional requests for unchanged files are answered from the cached
+    stat result of the file, without opening it. Otherwise, the file is
+    sent with the WSGI server's wsgi.file_wrapper (which may send it with
+    sendfile), if it has one. If PYHP_COMPRESSION is set, the file's
+    precompressed copy is sent instead, if it has one the client accepts.
+    """
+    static_file = get_static_file(file_processor, relative_path)
+    environ = request.environ
+    compression = current_app.config.get('PYHP_COMPRESSION', False) and \
+        is_compressible(static_file.content_type)
+
+    if compression:
+        static_file = get_precompressed_file(
+            file_processor, relative_path, static_file,
+            get_accepted_encodings(request.accept_encodings)) or static_file
+
+    if not is_resource_modified(environ, static_file.etag,
+                                last_modified=static_file.last_modified):
+        response = Response(status=304)
+        set_validators(response, static_file, compression)
+        return response
+
+    file, static_file = open_static_file(static_file)
+    response = Response(wrap_file(environ, file),
+                        content_type=static_file.content_type,
+                        direct_passthrough=True)
+    response.content_length = static_file.size
+    set_validators(response, static_file, compression)
+
+    try:
+        return response.make_conditional(environ, accept_ranges=True,
+                                         complete_length=static_file.size)
+    except RequestedRangeNotSatisfiable:
+        file.close()
+        raise
+
+
+def set_validators(response: Response, static_file: StaticFile,
+                   vary_encoding: bool = False):
+    """
+    Set the ETag, Last-Modified and caching headers of a static file (in
+    the same way as Flask's send_file), and its Content-Encoding.
+    """
+    if vary_encoding:
+        response.vary.add('Accept-Encoding')
+    if static_file.content_encoding is not None:
+        response.content_encoding = static_file.content_encoding
+
+    response.set_etag(static_file.etag)
+    response.last_modified = static_file.last_modified
+    response.cache_control.no_cache = True
+
+    max_age = current_app.get_send_file_max_age(static_file.path.name)
+    if max_age is not None:
+        if max_age > 0:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+        response.cache_control.max_age = max_age
+
+
+def stream_or_create_response(relative_path: PurePath, pyhp_class: Pyhp,
+                              buffer_size: int,
+                              response_cache: Optional[ResponseCache] = None
+                              ) -> Response:
+    """
+    Render the page until buffer_size bytes have been produced, then stream
+    the rest of the page.
+
+    If the page has finished, or has set cookies or a redirect by then, the
+    whole page is rendered before responding instead. Cookies and redirects
+    set after the page has started streaming are ignored, and streamed pages
+    are never cached.
+    """
+    chunks = pyhp_class.stream(str(relative_path), encoded=True)
+    buffered_chunks = []
+    buffered_size = 0
+
+    for chunk in chunks:
+        buffered_chunks.append(chunk)
+        buffered_size += len(chunk)
+
+        if buffered_size >= buffer_size:
+            break
+
+    if buffered_size < buffer_size or pyhp_class.get_new_cookies() or \
+            pyhp_class.get_delete_cookies() or \
+            pyhp_class.get_redirect_information() is not None:
+        buffered_chunks.extend(chunks)
+
+        return cache_and_create_response(list(map(bytes, buffered_chunks)),
+                                         relative_path, pyhp_class,
+                                         response_cache)
+
+    # WSGI servers require bytes, rather than memoryviews of the template
+    return Response(map(bytes, chain(buffered_chunks, chunks)),
+                    pyhp_class.status_code)
+
+
+def cache_and_create_response(page_chunks: list[bytes],
+                              relative_path: PurePath, pyhp_class: Pyhp,
+                              response_cache: Optional[ResponseCache] = None
+                              ) -> Response:
+    """
+    Create the response for a rendered page, caching it if allowed.
+
+    The chunks are sent as the body as they are, unless the page is cached
+    (which joins them).
+    """
+    if response_cache is not None and \
+            pyhp_class.get_cache_options() is not None:
+        page = RenderedPage.from_pyhp(b''.join(page_chunks), pyhp_class)
+    else:
+        page = RenderedPage.from_pyhp(page_chunks, pyhp_class)
+
+    if response_cache is not None:
+        response_cache.set(pyhp_class.current_dir / relative_path, pyhp_class,
+                           page)
+
+    return create_page_response(page)
+
 
-        return redirect_or_create_response(
-            page_text, pyhp_class.status_code,
-            pyhp_class.get_new_cookies(),
-            pyhp_class.get_delete_cookies(),
-            pyhp_class.get_redirect_information())
-    return send_from_directory(
-        file_processor.get_absolute_path(pyhp_class.current_dir),
-        relative_path
-    )
+def create_page_response(page: RenderedPage) -> Response:
+    """Create the response for a rendered (or cached) page."""
+    return redirect_or_create_response(page.body, page.status_code,
+                                       page.new_cookies, page.delete_cookies,
+                                       page.redirect_information)
 
 
-def redirect_or_create_response(page_text: str, status_code: int,
+def redirect_or_create_response(page_text: Union[str, bytes, list[bytes]],
+                                status_code: int,
                                 new_cookies: dict[str, NewCookie],
                                 delete_cookies: dict[str, DeleteCookie],
                                 redirect_information: Optional[
@@ -90,11 +421,12 @@ def redirect_or_create_response(page_text: str, status_code: int,
     return create_response(page_text, status_code, new_cookies, delete_cookies)
 
 
-def create_response(page_text: str, status_code: int,
-                    new_cookies: dict[str, NewCookie],
+def create_response(page_text: Union[str, bytes, list[bytes]],
+                    status_code: int, new_cookies: dict[str, NewCookie],
                     delete_cookies: dict[str, DeleteCookie]) -> Response:
-    """Create a new response."""
-    response = make_response(page_text, status_code)
+    """Create a new response (with a body of one or more chunks)."""
+    # Unlike make_response, which would send a list as JSON
+    response = Response(page_text, status_code)
 
     for cookie in new_cookies.values():
         response.set_cookie(**cookie.__dict__)
@@ -2,21 +2,34 @@
 Interface for the PyHP programs.
 """
 
-import sys
-from typing import Optional, Any
+import asyncio
+from functools import partial
+from typing import Optional, Any, AsyncIterator, Iterable, Iterator, Union
 from pathlib import PurePath
 import markupsafe
 
 try:
     from file_processing import FileProcessor
-    from code_execution import run_parsed_code
+    from code_execution import run_parsed_code, iter_parsed_code, \
+        run_parsed_code_async, iter_parsed_code_async, get_output_writer
     from cookies import NewCookie, DeleteCookie
-    from hypertext_processing import UglySoup
+    from template_cache import TemplateCache, CompiledTemplate
+    from render_context import RenderContext
+    from namespaces import NamespaceFactory
+    from response_cache import CacheOptions, parse_vary_on
+    from fragment_cache import FragmentCache
+    from instrumentation import record
 except ImportError:
     from .file_processing import FileProcessor
-    from .code_execution import run_parsed_code
+    from .code_execution import run_parsed_code, iter_parsed_code, \
+        run_parsed_code_async, iter_parsed_code_async, get_output_writer
     from .cookies import NewCookie, DeleteCookie
-    from .hypertext_processing import UglySoup
+    from .template_cache import TemplateCache, CompiledTemplate
+    from .render_context import RenderContext
+    from .namespaces import NamespaceFactory
+    from .response_cache import CacheOptions, parse_vary_on
+    from .fragment_cache import FragmentCache
+    from .instrumentation import record
 
 __all__ = ['Pyhp']
 
@@ -28,17 +41,27 @@ class Pyhp:
     """
 
     # pylint: disable=too-many-instance-attributes, too-many-arguments
+    # pylint: disable=too-many-public-methods, too-many-positional-arguments
 
     def __init__(self, current_dir: PurePath,
                  file_processor: FileProcessor,
                  debug: bool = False,
                  cookies: Optional[dict[str, str]] = None,
                  get: Optional[dict[str, str]] = None,
-                 post: Optional[dict[str, str]] = None):
+                 post: Optional[dict[str, str]] = None, *,
+                 template_cache: Optional[TemplateCache] = None,
+                 render_context: Optional[RenderContext] = None,
+                 namespace_factory: Optional[NamespaceFactory] = None,
+                 fragment_cache: Optional[FragmentCache] = None):
         self._current_dir = current_dir
         self._debug = debug
         self._file_processor = file_processor
 
+        if render_context is None:
+            render_context = RenderContext(file_processor, template_cache,
+                                           namespace_factory, fragment_cache)
+        self._render_context = render_context
+
         self._cookies: dict[str, str] = cookies or {}
         self._get: dict[str, str] = get or {}
         self._post: dict[str, str] = post or {}
@@ -50,11 +73,29 @@ class Pyhp:
 
         self._status_code = 200
 
+        self._cache_options: Optional[CacheOptions] = None
+
+        self._absolute_dir = render_context.prepare_dir(current_dir)
         self.globals, self.locals = self._prepare_context()
 
     def display(self, relative_path: str):
         """Include another pyhp file and print it."""
-        print(self.include(relative_path), end='')
+        writer = get_output_writer()
+
+        if writer is None:
+            print(self.include(relative_path), end='')
+            return
+
+        # Add the output of the included file to this page's encoded output
+        # as it is produced, instead of returning it as a string first
+        new_current_dir = (self._current_dir / PurePath(relative_path)).parent
+
+        with record('include', relative_path):
+            for output in iter_parsed_code(
+                    self._load_template(PurePath(relative_path)),
+                    self._create_child(new_current_dir),
+                    encoded=True, count_output=False):
+                writer.write_bytes(output)
 
     def include(self, relative_path: str) -> str:
         """
@@ -63,10 +104,19 @@ class Pyhp:
         """
         new_current_dir = (self._current_dir / PurePath(relative_path)).parent
 
-        new_pyhp_class = Pyhp(new_current_dir, self._file_processor,
-                              self._debug, self._cookies, self._get, self._post)
+        with record('include', relative_path):
+            return self._create_child(new_current_dir).run(
+                PurePath(relative_path).name)
 
-        return new_pyhp_class.run(PurePath(relative_path).name)
+    def include_many(self, relative_paths: Iterable[str]) -> list[str]:
+        """
+        Include several independent pyhp files into the current one,
+        rendering them concurrently on the app's thread pool, and return
+        their output HTML in order.
+        """
+        return self._render_context.include_pool.run_concurrently(
+            partial(self.include, relative_path)
+            for relative_path in relative_paths)
 
     def run(self, relative_path: str) -> str:
         """
@@ -74,29 +124,83 @@ class Pyhp:
         and return the output HTML.
         """
         return run_parsed_code(
-            self._parse_file(PurePath(relative_path)),
+            self._load_template(PurePath(relative_path)),
             self,
         )
 
-    def _prepare_context(self) -> (dict[str, Any], dict[str, Any]):
-        context_globals = {'pyhp': self}
-        context_locals = {}
+    def stream(self, relative_path: str, encoded: bool = False
+               ) -> Iterator[Union[str, bytes, memoryview]]:
+        """
+        Runs another pyhp file in the context of the current one,
+        yielding the output HTML of each section as soon as it is produced
+        (as UTF-8 encoded bytes if encoded is True).
+        """
+        return iter_parsed_code(
+            self._load_template(PurePath(relative_path)),
+            self,
+            encoded,
+        )
 
-        # TODO: This is potentially a security flaw
-        current_dir = str(
-            self._file_processor.get_absolute_path(self.current_dir))
+    async def include_async(self, relative_path: str) -> str:
+        """
+        Include another pyhp file into the current one, awaiting any code
+        blocks that use await, and return the output HTML.
+        """
+        new_current_dir = (self._current_dir / PurePath(relative_path)).parent
 
-        if current_dir not in sys.path:
-            sys.path.append(current_dir)
+        with record('include', relative_path):
+            return await self._create_child(new_current_dir).run_async(
+                PurePath(relative_path).name)
 
-        return context_globals, context_locals
+    async def run_async(self, relative_path: str) -> str:
+        """
+        Runs another pyhp file in the context of the current one, awaiting
+        any code blocks that use await, and return the output HTML.
+        """
+        return await run_parsed_code_async(
+            self._load_template(PurePath(relative_path)),
+            self,
+        )
 
-    def _parse_file(self, relative_path: PurePath) -> UglySoup:
-        return UglySoup(self._load_file(relative_path))
+    def stream_async(self, relative_path: str, encoded: bool = False
+                     ) -> AsyncIterator[Union[str, bytes, memoryview]]:
+        """
+        Runs another pyhp file in the context of the current one, awaiting
+        any code blocks that use await, and yielding the output HTML of each
+        section as soon as it is produced.
+        """
+        return iter_parsed_code_async(
+            self._load_template(PurePath(relative_path)),
+            self,
+            encoded,
+        )
+
+    async def include_many_async(self,
+                                 relative_paths: Iterable[str]) -> list[str]:
+        """
+        Include several independent pyhp files into the current one,
+        rendering them concurrently as tasks on the event loop, and return
+        their output HTML in order.
+        """
+        return list(await asyncio.gather(
+            *(self.include_async(relative_path)
+              for relative_path in relative_paths)))
+
+    def _create_child(self, current_dir: PurePath) -> 'Pyhp':
+        return Pyhp(current_dir, self._file_processor, self._debug,
+                    self._cookies, self._get, self._post,
+                    render_context=self._render_context)
+
+    def _prepare_context(self) -> (dict[str, Any], dict[str, Any]):
+        context_globals = self._render_context.namespace_factory.create(
+            pyhp=self)
+        context_locals = {}
 
-    def _load_file(self, relative_path: PurePath) -> str:
-        path = self._current_dir / relative_path
-        return self._file_processor.get_file_contents(path)
+        return context_globals, context_locals
+
+    def _load_template(self, relative_path: PurePath) -> CompiledTemplate:
+        return self._render_context.get_template(
+            self._current_dir / relative_path)
 
     def redirect(self, url: str, status_code: int = 302):
         """Redirect to another url."""
@@ -107,6 +211,20 @@ class Pyhp:
         """Return the redirect information if present."""
         return self._redirect_info
 
+    def cache(self, ttl: float, vary_on: Iterable[str] = ()):
+        """
+        Allow the rendered page to be cached for ttl seconds.
+
+        The page is cached separately for each combination of the request
+        data in vary_on, given as 'get:name', 'post:name' or 'cookie:name'.
+        The page's status code, cookies and redirect are cached with it.
+        """
+        self._cache_options = CacheOptions(ttl, parse_vary_on(vary_on))
+
+    def get_cache_options(self) -> Optional[CacheOptions]:
+        """Return the cache options, if the page can be cached."""
+        return self._cache_options
+
     def set_cookie(self, key: str, **kwargs):
         """Set a cookie."""
         self._new_cookies[key] = NewCookie(key, **kwargs)
@@ -133,6 +251,16 @@ class Pyhp:
         """Return the directory of the currently executing file."""
         return self._current_dir
 
+    @property
+    def render_context(self) -> RenderContext:
+        """Return the state shared with the other pages in this render."""
+        return self._render_context
+
+    @property
+    def absolute_dir(self) -> str:
+        """Return the absolute path of the directory of the current file."""
+        return self._absolute_dir
+
     @property
     def debug(self) -> bool:
         """Return whether the app is in debug mode."""
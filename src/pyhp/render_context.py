@@ -0,0 +1,104 @@
+"""
+Sets up the context shared by a page and every page it includes.
+"""
+
+from pathlib import PurePath
+from typing import Optional
+
+try:
+    from file_processing import FileProcessor
+    from template_cache import TemplateCache, CompiledTemplate, \
+        DEFAULT_TEMPLATE_CACHE
+    from namespaces import NamespaceFactory, DEFAULT_NAMESPACE_FACTORY
+    from fragment_cache import FragmentCache, DEFAULT_FRAGMENT_CACHE
+    from concurrent_rendering import IncludePool, DEFAULT_INCLUDE_POOL
+    from instrumentation import record
+except ImportError:
+    from .file_processing import FileProcessor
+    from .template_cache import TemplateCache, CompiledTemplate, \
+        DEFAULT_TEMPLATE_CACHE
+    from .namespaces import NamespaceFactory, DEFAULT_NAMESPACE_FACTORY
+    from .fragment_cache import FragmentCache, DEFAULT_FRAGMENT_CACHE
+    from .concurrent_rendering import IncludePool, DEFAULT_INCLUDE_POOL
+    from .instrumentation import record
+
+
+class RenderContext:
+    """
+    Stores the state shared by a single render of a page and the pages it
+    includes, so that a file included many times is only loaded and
+    resolved once per render.
+    """
+    def __init__(self, file_processor: FileProcessor,
+                 template_cache: Optional[TemplateCache] = None,
+                 namespace_factory: Optional[NamespaceFactory] = None,
+                 fragment_cache: Optional[FragmentCache] = None,
+                 include_pool: Optional[IncludePool] = None):
+        if template_cache is None:
+            template_cache = DEFAULT_TEMPLATE_CACHE
+        if namespace_factory is None:
+            namespace_factory = DEFAULT_NAMESPACE_FACTORY
+        if fragment_cache is None:
+            fragment_cache = DEFAULT_FRAGMENT_CACHE
+        if include_pool is None:
+            include_pool = DEFAULT_INCLUDE_POOL
+
+        self._file_processor = file_processor
+        self._template_cache = template_cache
+        self._namespace_factory = namespace_factory
+        self._fragment_cache = fragment_cache
+        self._include_pool = include_pool
+
+        self._templates: dict[PurePath, CompiledTemplate] = {}
+        self._absolute_dirs: dict[PurePath, str] = {}
+
+    def get_template(self, path: PurePath) -> CompiledTemplate:
+        """Return the compiled template for the file at the given path."""
+        template = self._templates.get(path)
+
+        if template is None:
+            with record('template', path.as_posix()):
+                template = self._template_cache.get_template(
+                    self._file_processor, path)
+            self._templates[path] = template
+
+        return template
+
+    def prepare_dir(self, current_dir: PurePath) -> str:
+        """
+        Return the absolute path of the directory, which pages in the
+        directory can import modules from.
+        """
+        absolute_dir = self._absolute_dirs.get(current_dir)
+
+        if absolute_dir is None:
+            absolute_dir = str(
+                self._file_processor.get_absolute_path(current_dir))
+            self._absolute_dirs[current_dir] = absolute_dir
+
+        return absolute_dir
+
+    @property
+    def file_processor(self) -> FileProcessor:
+        """Return the file processor used to load files."""
+        return self._file_processor
+
+    @property
+    def template_cache(self) -> TemplateCache:
+        """Return the cache of compiled templates."""
+        return self._template_cache
+
+    @property
+    def namespace_factory(self) -> NamespaceFactory:
+        """Return the factory that creates the globals of each page."""
+        return self._namespace_factory
+
+    @property
+    def fragment_cache(self) -> FragmentCache:
+        """Return the cache of the output of cacheable code blocks."""
+        return self._fragment_cache
+
+    @property
+    def include_pool(self) -> IncludePool:
+        """Return the thread pool that includes are rendered on."""
+        return self._include_pool
@@ -0,0 +1,391 @@
+"""
+Sets up limits on the wall-clock time, CPU time, output size and memory
+that a render can use, so that a runaway page fails on its own instead of
+holding up the rest of the server.
+
+The limits are checked between sections. A code block that runs past the
+time, CPU time or memory limit is also interrupted by a watchdog thread,
+which raises the error in the thread running the block (once Python code
+runs again, so a long call into C, such as time.sleep, finishes first).
+A block that uses await is only interruptible while it runs, rather than
+while the event loop runs other tasks, so await_interruptibly steps it
+through the watchdog one step at a time.
+
+The rest of a streamed page is rendered as the server sends it, after
+limit_render has exited, so limit_stream applies the render's limits again
+while each chunk is produced.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import ctypes
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass
+from threading import Condition, Lock, Thread, get_ident
+from types import coroutine
+from typing import Any, Callable, ContextManager, Coroutine, Generator, \
+    Iterable, Iterator, Optional, TypeVar
+
+
+# Seconds between the watchdog's checks of running renders
+WATCHDOG_INTERVAL = 0.01
+
+T = TypeVar('T')
+
+
+class RenderLimitExceeded(BaseException):
+    """
+    Raised when a render exceeds one of its limits.
+
+    Like KeyboardInterrupt, it is not an Exception, so that pages do not
+    catch it with `except Exception`. Each subclass is raised without
+    arguments by the watchdog, so has its own default message, and the
+    status code of the response to send.
+    """
+    limit = 'unknown'
+    status_code = 500
+    message = 'The page exceeded a render limit.'
+
+    def __init__(self, message: Optional[str] = None):
+        super().__init__(self.message if message is None else message)
+
+
+class RenderTimeout(RenderLimitExceeded):
+    """Raised when a render takes longer than its timeout."""
+    limit = 'timeout'
+    status_code = 503
+    message = 'The page took too long to render.'
+
+
+class CPUTimeExceeded(RenderLimitExceeded):
+    """Raised when a render uses more CPU time than it is allowed."""
+    limit = 'cpu_time'
+    status_code = 503
+    message = 'The page used too much CPU time.'
+
+
+class OutputLimitExceeded(RenderLimitExceeded):
+    """Raised when a page produces more output than it is allowed."""
+    limit = 'output'
+    message = 'The page produced too much output.'
+
+
+class MemoryLimitExceeded(RenderLimitExceeded):
+    """Raised when a render allocates more memory than it is allowed."""
+    limit = 'memory'
+    message = 'The page allocated too much memory.'
+
+
+@dataclass
+class RenderLimits:
+    """
+    Stores the limits of each render (None for no limit).
+
+    timeout and cpu_time are in seconds, and max_output_bytes and
+    max_memory are in bytes. max_memory is checked with tracemalloc (which
+    slows down every allocation), against the memory allocated by the
+    whole process since the render started, so concurrent renders count
+    towards each other's limits.
+    """
+    timeout: Optional[float] = None
+    cpu_time: Optional[float] = None
+    max_output_bytes: Optional[int] = None
+    max_memory: Optional[int] = None
+
+    @property
+    def needs_watchdog(self) -> bool:
+        return self.timeout is not None or self.cpu_time is not None or \
+            self.max_memory is not None
+
+
+class RenderBudget:
+    """
+    Tracks how much of its limits a render has used.
+
+    The CPU time is that of the thread that started the render.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, limits: RenderLimits):
+        self.limits = limits
+        self.output_size = 0
+
+        self._thread_id = get_ident()
+        self._start = time.monotonic()
+
+        self._clock_id = None
+        if limits.cpu_time is not None and \
+                hasattr(time, 'pthread_getcpuclockid'):
+            self._clock_id = time.pthread_getcpuclockid(self._thread_id)
+        self._cpu_start = self._get_thread_time()
+
+        self._memory_start = 0
+        if limits.max_memory is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self._memory_start = tracemalloc.get_traced_memory()[0]
+
+        # The threads running code blocks (with how deeply they are nested),
+        # and those that the error has been raised in
+        self._running: dict[int, int] = {}
+        self._interrupted: set[int] = set()
+        self._lock = Lock()
+
+    def _get_thread_time(self) -> float:
+        if self._clock_id is not None:
+            return time.clock_gettime(self._clock_id)
+        if get_ident() == self._thread_id:
+            return time.thread_time()
+        # The CPU time of other threads cannot be read on this platform
+        return self._cpu_start
+
+    def get_elapsed(self) -> float:
+        return time.monotonic() - self._start
+
+    def get_cpu_time(self) -> float:
+        return self._get_thread_time() - self._cpu_start
+
+    def get_memory(self) -> int:
+        if not tracemalloc.is_tracing():
+            return 0
+        return tracemalloc.get_traced_memory()[0] - self._memory_start
+
+    def get_exceeded(self) -> Optional[type[RenderLimitExceeded]]:
+        """Return the error for the first limit exceeded, if any."""
+        limits = self.limits
+
+        if limits.timeout is not None and self.get_elapsed() > limits.timeout:
+            return RenderTimeout
+        if limits.cpu_time is not None and \
+                self.get_cpu_time() > limits.cpu_time:
+            return CPUTimeExceeded
+        if limits.max_output_bytes is not None and \
+                self.output_size > limits.max_output_bytes:
+            return OutputLimitExceeded
+        if limits.max_memory is not None and \
+                self.get_memory() > limits.max_memory:
+            return MemoryLimitExceeded
+
+        return None
+
+    def check(self, output_size: int = 0):
+        """
+        Add to the size of the output, and raise an error if any limit has
+        been exceeded.
+        """
+        self.output_size += output_size
+
+        exceeded = self.get_exceeded()
+        if exceeded is not None:
+            raise exceeded()
+
+    @contextmanager
+    def interruptible(self) -> Iterator[None]:
+        """Allow the watchdog to interrupt the block in this thread."""
+        thread_id = get_ident()
+        with self._lock:
+            # Blocks are nested when a block includes another page
+            self._running[thread_id] = self._running.get(thread_id, 0) + 1
+
+        try:
+            yield
+        finally:
+            self._stop_running(thread_id)
+
+    def _stop_running(self, thread_id: int):
+        try:
+            with self._lock:
+                interrupted = self._leave(thread_id)
+        except RenderLimitExceeded:
+            # Raised by the watchdog before the block was left
+            self._leave(thread_id)
+            raise
+
+        if interrupted:
+            # The block may have finished before the error was raised
+            _set_async_exc(thread_id, None)
+
+    def _leave(self, thread_id: int) -> bool:
+        depth = self._running.pop(thread_id, 1) - 1
+        if depth > 0:
+            self._running[thread_id] = depth
+            return False
+
+        if thread_id in self._interrupted:
+            self._interrupted.discard(thread_id)
+            return True
+        return False
+
+    def interrupt(self):
+        """
+        Raise the error for the exceeded limit (if any) in each thread
+        running a code block. It is raised again at every check, in case
+        the page catches it.
+        """
+        exceeded = self.get_exceeded()
+        if exceeded is None:
+            return
+
+        with self._lock:
+            for thread_id in self._running:
+                self._interrupted.add(thread_id)
+                _set_async_exc(thread_id, exceeded)
+
+
+def _set_async_exc(thread_id: int,
+                   exception: Optional[type[BaseException]]):
+    # A null exception clears the error, if it has not been raised yet
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(thread_id),
+        None if exception is None else ctypes.py_object(exception))
+
+
+_current_budget: ContextVar[Optional[RenderBudget]] = ContextVar(
+    'pyhp_budget', default=None)
+_not_limited = nullcontext()
+
+_watched: set[RenderBudget] = set()
+_watchdog_condition = Condition()
+_watchdog: Optional[Thread] = None  # pylint: disable=invalid-name
+
+
+def get_current_budget() -> Optional[RenderBudget]:
+    return _current_budget.get()
+
+
+def interruptible() -> ContextManager:
+    """
+    Allow the watchdog to interrupt the block, if it is run in a render
+    with limits.
+    """
+    budget = _current_budget.get()
+    if budget is None:
+        return _not_limited
+    return budget.interruptible()
+
+
+@coroutine
+def await_interruptibly(awaitable: Coroutine[Any, Any, T]
+                        ) -> Generator[Any, Any, T]:
+    """
+    Await the coroutine, allowing the watchdog to interrupt each of its
+    steps (but not the other tasks that run while it is suspended).
+    """
+    value, error = None, None
+
+    while True:
+        try:
+            with interruptible():
+                if error is None:
+                    suspended = awaitable.send(value)
+                else:
+                    suspended = awaitable.throw(error)
+        except StopIteration as stop:
+            return stop.value
+
+        try:
+            value, error = (yield suspended), None
+        except BaseException as exception:
+            # Such as the cancellation of the task, passed on to the block
+            value, error = None, exception
+
+
+@contextmanager
+def limit_render(limits: RenderLimits) -> Iterator[RenderBudget]:
+    """Apply the limits to the render run within the block."""
+    budget = RenderBudget(limits)
+
+    with _apply_budget(budget):
+        yield budget
+
+
+def limit_stream(chunks: Iterable[T], budget: RenderBudget,
+                 on_exceeded: Optional[
+                     Callable[[RenderLimitExceeded], None]] = None
+                 ) -> Iterator[T]:
+    """
+    Yield the rest of a streamed render, applying its budget (from
+    limit_render) again while each chunk is produced.
+
+    If the render exceeds a limit, on_exceeded is called with the error and
+    the stream ends there, since the response has already started.
+    """
+    iterator = iter(chunks)
+
+    try:
+        while True:
+            try:
+                with _apply_budget(budget):
+                    chunk = next(iterator)
+            except StopIteration:
+                return
+            except RenderLimitExceeded as error:
+                if on_exceeded is not None:
+                    on_exceeded(error)
+                return
+
+            yield chunk
+    finally:
+        # Stops the render, if the stream is closed before it has finished
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+@contextmanager
+def _apply_budget(budget: RenderBudget) -> Iterator[None]:
+    token = _current_budget.set(budget)
+
+    if budget.limits.needs_watchdog:
+        _watch(budget)
+
+    try:
+        yield
+    finally:
+        if budget.limits.needs_watchdog:
+            with _watchdog_condition:
+                _watched.discard(budget)
+        _current_budget.reset(token)
+
+
+def _watch(budget: RenderBudget):
+    global _watchdog  # pylint: disable=global-statement
+
+    with _watchdog_condition:
+        _watched.add(budget)
+
+        if _watchdog is None:
+            _watchdog = Thread(target=_run_watchdog, name='pyhp-watchdog',
+                               daemon=True)
+            _watchdog.start()
+
+        _watchdog_condition.notify()
+
+
+def _run_watchdog():
+    while True:
+        with _watchdog_condition:
+            while not _watched:
+                _watchdog_condition.wait()
+            budgets = list(_watched)
+
+        for budget in budgets:
+            budget.interrupt()
+
+        time.sleep(WATCHDOG_INTERVAL)
+
+
+def _forget_watchdog():
+    global _watchdog, _watchdog_condition  # pylint: disable=global-statement
+
+    # Threads (and the locks they held) do not survive a fork, and the
+    # parent's renders are not the child's
+    _watchdog = None
+    _watchdog_condition = Condition()
+    _watched.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_watchdog)
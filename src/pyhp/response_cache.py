@@ -0,0 +1,161 @@
+"""
+Sets up a cache of rendered pages, for pages that declare themselves
+cacheable with pyhp.cache.
+"""
+
+# pylint: disable=missing-function-docstring, too-few-public-methods
+
+import marshal
+import pickle
+from dataclasses import dataclass
+from pathlib import PurePath
+from typing import TYPE_CHECKING, Iterable, Optional, Union
+
+try:
+    from cache_backends import CacheBackend, MemoryCacheBackend
+    from cookies import NewCookie, DeleteCookie
+except ImportError:
+    from .cache_backends import CacheBackend, MemoryCacheBackend
+    from .cookies import NewCookie, DeleteCookie
+
+if TYPE_CHECKING:
+    from .pyhp_interface import Pyhp
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# The request data that cached pages can vary on, and the Pyhp properties
+# that hold it
+VARY_SOURCES = {
+    'get': 'get',
+    'post': 'post',
+    'cookie': 'cookies',
+}
+
+
+@dataclass
+class CacheOptions:
+    """Stores how long a page can be cached for, and what it varies on."""
+    ttl: float
+    vary_on: tuple[str, ...] = ()
+
+
+@dataclass
+class RenderedPage:
+    """
+    Stores the result of rendering a page, as sent in the response.
+
+    The body may be a list of chunks for pages that are not cached, so that
+    they are sent without being joined.
+    """
+    body: Union[bytes, list[bytes]]
+    status_code: int
+    new_cookies: dict[str, NewCookie]
+    delete_cookies: dict[str, DeleteCookie]
+    redirect_information: Optional[tuple[str, int]]
+
+    @classmethod
+    def from_pyhp(cls, body: Union[bytes, list[bytes]],
+                  pyhp_class: 'Pyhp') -> 'RenderedPage':
+        return cls(body, pyhp_class.status_code,
+                   dict(pyhp_class.get_new_cookies()),
+                   dict(pyhp_class.get_delete_cookies()),
+                   pyhp_class.get_redirect_information())
+
+
+def parse_vary_on(vary_on: Iterable[str]) -> tuple[str, ...]:
+    """
+    Check that each item is of the form 'source:name' (for example
+    'get:page' or 'cookie:lang'), and return them as a tuple.
+    """
+    vary_on = tuple(vary_on)
+
+    for item in vary_on:
+        source, _, name = item.partition(':')
+        if source not in VARY_SOURCES or not name:
+            raise ValueError(f'Unable to vary on {item!r} (expected one of '
+                             f'{", ".join(VARY_SOURCES)}, followed by a '
+                             f'colon and a name).')
+
+    return vary_on
+
+
+def get_vary_key(vary_on: tuple[str, ...],
+                 pyhp_class: 'Pyhp') -> tuple[Optional[str], ...]:
+    """Return the values of the request data that the page varies on."""
+    values = []
+
+    for item in vary_on:
+        source, _, name = item.partition(':')
+        values.append(getattr(pyhp_class, VARY_SOURCES[source]).get(name))
+
+    return tuple(values)
+
+
+class ResponseCache:
+    """
+    A cache of rendered pages, keyed on the path of the page and the request
+    data it varies on.
+
+    A page's cache options are only known once it has been rendered, so the
+    options from the latest render of each page are stored alongside it and
+    used to look it up.
+
+    Pages are pickled into the backend (an in-process LRU cache by default),
+    so a backend shared between processes must only be writable by them.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES,
+                 backend: Optional[CacheBackend] = None):
+        if backend is None:
+            backend = MemoryCacheBackend('pages', max_bytes)
+        self._backend = backend
+
+    def get(self, path: PurePath,
+            pyhp_class: 'Pyhp') -> Optional[RenderedPage]:
+        """Return the cached page for the request, if there is one."""
+        vary_on = self._backend.get(self._get_vary_on_key(path))
+
+        if vary_on is None:
+            return None
+
+        data = self._backend.get(
+            self._get_key(path, marshal.loads(vary_on), pyhp_class))
+
+        return None if data is None else pickle.loads(data)
+
+    def set(self, path: PurePath, pyhp_class: 'Pyhp',
+            page: RenderedPage):
+        """Store the rendered page, if it declared itself cacheable."""
+        options = pyhp_class.get_cache_options()
+
+        if options is None:
+            self._backend.delete(self._get_vary_on_key(path))
+            return
+
+        self._backend.set(self._get_vary_on_key(path),
+                          marshal.dumps(options.vary_on))
+        self._backend.set(self._get_key(path, options.vary_on, pyhp_class),
+                          pickle.dumps(page), options.ttl)
+
+    def invalidate(self, path: Optional[PurePath] = None):
+        """
+        Forget every cached response, since any page may include the file
+        that changed.
+        """
+        # pylint: disable=unused-argument
+        self._backend.clear()
+
+    @staticmethod
+    def _get_vary_on_key(path: PurePath) -> str:
+        return repr(('vary_on', path.as_posix()))
+
+    @staticmethod
+    def _get_key(path: PurePath, vary_on: tuple[str, ...],
+                 pyhp_class: 'Pyhp') -> str:
+        return repr(('page', path.as_posix(), vary_on,
+                     get_vary_key(vary_on, pyhp_class)))
+
+    @property
+    def backend(self) -> CacheBackend:
+        """Return the backend the pages are stored in."""
+        return self._backend
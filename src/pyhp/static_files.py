@@ -0,0 +1,97 @@
+"""
+Sets up the lookup of files that are not PyHP files, so that the servers can
+send them without setting up a page.
+
+The validators of a file (its ETag and Last-Modified date) come from the
+file processor's cached stat result, so a conditional request for a file
+that has not changed is answered without opening it.
+"""
+
+import mimetypes
+import os
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path, PurePath
+from typing import BinaryIO, Optional
+
+try:
+    from file_processing import SystemFileProcessor
+except ImportError:
+    from .file_processing import SystemFileProcessor
+
+
+@dataclass
+class StaticFile:
+    """
+    Stores the path, size and validators of a file (which may be a
+    compressed copy of the file that is sent, if content_encoding is set).
+    """
+    path: Path
+    size: int
+    last_modified: datetime
+    etag: str
+    content_type: str
+    content_encoding: Optional[str] = None
+
+    @classmethod
+    def from_stat(cls, path: Path, stat_result: os.stat_result,
+                  content_type: Optional[str] = None,
+                  content_encoding: Optional[str] = None) -> 'StaticFile':
+        """
+        Create the file from its stat result (guessing its content type from
+        its name, if not given).
+        """
+        etag = f'{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}'
+        if content_encoding is not None:
+            etag = f'{etag}-{content_encoding}'
+
+        return cls(path, stat_result.st_size,
+                   datetime.fromtimestamp(stat_result.st_mtime,
+                                          timezone.utc),
+                   etag, content_type or get_content_type(path.name),
+                   content_encoding)
+
+
+@lru_cache(maxsize=1024)
+def get_content_type(name: str) -> str:
+    """Return the content type of a file, guessed from its name."""
+    content_type, _ = mimetypes.guess_type(name)
+
+    if content_type is None:
+        return 'application/octet-stream'
+    if content_type.startswith('text/'):
+        return f'{content_type}; charset=utf-8'
+    return content_type
+
+
+def get_static_file(file_processor: SystemFileProcessor,
+                    relative_path: PurePath) -> StaticFile:
+    """
+    Return the file at the path (relative to the base directory), from the
+    cached stat result of the file.
+    """
+    stat_result = file_processor.get_stat(relative_path)
+    if stat_result is None:
+        raise FileNotFoundError(f'Unable to find file ({relative_path}).')
+
+    return StaticFile.from_stat(file_processor.get_absolute_path(relative_path),
+                                stat_result)
+
+
+def open_static_file(static_file: StaticFile) -> (BinaryIO, StaticFile):
+    """
+    Open the file, and return it with its current size and validators
+    (which may have changed since its stat result was cached).
+    """
+    file = open(static_file.path, 'rb')  # pylint: disable=consider-using-with
+
+    try:
+        stat_result = os.fstat(file.fileno())
+    except OSError:
+        file.close()
+        raise
+
+    return file, StaticFile.from_stat(static_file.path, stat_result,
+                                      static_file.content_type,
+                                      static_file.content_encoding)
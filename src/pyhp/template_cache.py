@@ -0,0 +1,219 @@
+"""
+Sets up a process-wide cache of parsed and compiled PyHP templates.
+"""
+
+# pylint: disable=missing-function-docstring, too-few-public-methods
+
+import marshal
+from ast import PyCF_ALLOW_TOP_LEVEL_AWAIT
+from dataclasses import dataclass
+from importlib.util import MAGIC_NUMBER
+from pathlib import PurePath
+from typing import Callable, Hashable, Optional
+
+try:
+    from caching import LRUCache
+    from cache_backends import CacheBackend
+    from file_processing import FileProcessor
+    from hypertext_processing import UglySoup, Section
+    from text_processing import prepare_code_text
+    from instrumentation import record
+except ImportError:
+    from .caching import LRUCache
+    from .cache_backends import CacheBackend
+    from .file_processing import FileProcessor
+    from .hypertext_processing import UglySoup, Section
+    from .text_processing import prepare_code_text
+    from .instrumentation import record
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# Marks serialized templates, which can only be loaded by the same version
+# of Python
+TEMPLATE_HEADER = b'PYHP' + MAGIC_NUMBER
+
+
+@dataclass
+class CompiledTemplate:
+    """A parsed PyHP file, with its code blocks compiled ahead of time."""
+    sections: list[Section]
+    size: int
+
+
+ArtifactLoader = Callable[[PurePath, Hashable], Optional[CompiledTemplate]]
+
+
+class TemplateCache:
+    """
+    An LRU cache of compiled templates, keyed on the absolute path of the
+    file and invalidated when the file's stamp (modification time and size)
+    changes.
+
+    If an artifact loader is given, it is tried before compiling a template,
+    with the file's path and stamp. If a backend is given, serialized
+    templates are stored in it too, so that other processes sharing the
+    backend do not need to compile them again.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES,
+                 artifact_loader: Optional[ArtifactLoader] = None,
+                 backend: Optional[CacheBackend] = None):
+        self._cache = LRUCache(max_bytes)
+        self._artifact_loader = artifact_loader
+        self._backend = backend
+
+    def get_template(self, file_processor: FileProcessor,
+                     path: PurePath) -> CompiledTemplate:
+        """Return the compiled template for the file at the given path."""
+        stamp = file_processor.get_file_stamp(path)
+
+        if stamp is None:
+            return load_template(file_processor, path)
+
+        key = str(file_processor.get_absolute_path(path))
+        entry = self._cache.get(key)
+
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+
+        template = None
+        if self._artifact_loader is not None:
+            template = self._artifact_loader(path, stamp)
+        if template is None:
+            template = self._load_from_backend(key, stamp)
+        if template is None:
+            template = load_template(file_processor, path)
+            if self._backend is not None:
+                self._backend.set(key, dump_template(stamp, template))
+
+        self._cache.set(key, (stamp, template), template.size)
+
+        return template
+
+    def _load_from_backend(self, key: str,
+                           stamp: Hashable) -> Optional[CompiledTemplate]:
+        if self._backend is None:
+            return None
+
+        data = self._backend.get(key)
+        if data is None:
+            return None
+
+        return load_dumped_template(data, stamp)
+
+    def clear(self):
+        """Remove every template from the cache (and the backend)."""
+        self._cache.clear()
+        if self._backend is not None:
+            self._backend.clear()
+
+    def invalidate(self, file_processor: FileProcessor,
+                   path: Optional[PurePath]):
+        """
+        Remove the template for the file at the given path (or every
+        template, if the path is None).
+
+        This can be added as a change listener of the file processor.
+        """
+        if path is None:
+            self.clear()
+            return
+
+        try:
+            key = str(file_processor.get_absolute_path(path))
+        except RuntimeError:
+            self.clear()
+        else:
+            self._cache.delete(key)
+            if self._backend is not None:
+                self._backend.delete(key)
+
+    @property
+    def cache(self) -> LRUCache:
+        """Return the underlying LRU cache."""
+        return self._cache
+
+
+def dump_template(stamp: Hashable, template: CompiledTemplate) -> bytes:
+    """
+    Serialize the template, with the code blocks as marshalled code objects
+    (as in a .pyc file) and the stamp of the file it was compiled from.
+    """
+    sections = [(section.is_pyhp_code, section.text, section.code,
+                 section.line, section.attributes)
+                for section in template.sections]
+    return TEMPLATE_HEADER + marshal.dumps((stamp, template.size, sections))
+
+
+def load_dumped_template(data: bytes,
+                         stamp: Hashable) -> Optional[CompiledTemplate]:
+    """
+    Return the serialized template, or None if it is invalid or was
+    compiled from a file with a different stamp.
+    """
+    if not data.startswith(TEMPLATE_HEADER):
+        return None
+
+    try:
+        dumped_stamp, size, sections = marshal.loads(
+            data[len(TEMPLATE_HEADER):])
+
+        if dumped_stamp != stamp:
+            return None
+
+        return CompiledTemplate(
+            [Section(is_pyhp_code, text, code, line=line,
+                     attributes=attributes)
+             for is_pyhp_code, text, code, line, attributes in sections],
+            size,
+        )
+    except (EOFError, ValueError, TypeError):
+        return None
+
+
+def load_template(file_processor: FileProcessor,
+                  path: PurePath) -> CompiledTemplate:
+    filename = path.as_posix()
+
+    with record('load', filename):
+        source = file_processor.get_file_buffer(path)
+    with record('parse', filename):
+        dom = UglySoup(source)
+    with record('compile', filename):
+        return compile_template(dom,
+                                str(file_processor.get_absolute_path(path)))
+
+
+def compile_template(dom: UglySoup, filename: str) -> CompiledTemplate:
+    size = 0
+
+    for section in dom.sections:
+        if section.is_pyhp_code:
+            section.code = compile_section(section.text, filename,
+                                           section.line)
+
+        if section.code is not None:
+            size += len(marshal.dumps(section.code))
+
+        size += section.end - section.start
+
+    return CompiledTemplate(dom.sections, size)
+
+
+def compile_section(text: str, filename: str, line: int = 1):
+    # Pad the code with newlines, so that line numbers in tracebacks match
+    # the line numbers in the file
+    leading_newlines = len(text) - len(text.lstrip('\n'))
+    padding = '\n' * (line - 1 + leading_newlines)
+
+    # Blocks that fail to compile are left uncompiled, so that the error is
+    # reported when the block runs (as it would be without the cache).
+    # Blocks may use await at the top level, and can then only be run
+    # asynchronously.
+    try:
+        return compile(padding + prepare_code_text(text), filename, 'exec',
+                       flags=PyCF_ALLOW_TOP_LEVEL_AWAIT, dont_inherit=True)
+    except SyntaxError:
+        return None
+
+
+DEFAULT_TEMPLATE_CACHE = TemplateCache()
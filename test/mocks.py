@@ -2,8 +2,11 @@
 Sets up mock classes for the testing of the PyHP framework.
 """
 
+import os
 from typing import Union, Optional
 from pathlib import PurePath, Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
 
 from src.pyhp.file_processing import FileProcessor
 
@@ -16,6 +19,7 @@ class MockFileProcessor(FileProcessor):
     """
     def __init__(self, file_contents: Union[dict[PurePath, str], str] = '',
                  directories: Optional[set[PurePath]] = None):
+        super().__init__()
         self._file_contents = file_contents
         self._directories: set[PurePath] = directories or []
 
@@ -36,3 +40,23 @@ class MockFileProcessor(FileProcessor):
 
     def get_absolute_path(self, path: PurePath) -> Path:
         return Path(path)
+
+
+class TemporaryDirectoryTestCase(TestCase):
+    """
+    A TestCase which creates a temporary base directory for each test, for
+    tests which use the real file system.
+    """
+    def setUp(self):
+        self._temp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.base_dir = Path(self._temp_dir.name).resolve()
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def write(self, name: str, contents: str, mtime_ns: int = 10**9):
+        """Write a file in the base directory, with the given mtime."""
+        path = self.base_dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(contents, encoding='utf-8')
+        os.utime(path, ns=(mtime_ns, mtime_ns))
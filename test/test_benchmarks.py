@@ -0,0 +1,47 @@
+"""
+Tests the benchmarks of the render pipeline, so that they keep running.
+
+TestBenchmarks:
+    Tests that the synthetic templates render, and that every stage can be
+    timed and compared.
+"""
+
+# pylint: disable=missing-function-docstring
+
+try:
+    from mocks import TemporaryDirectoryTestCase
+except ImportError:
+    from .mocks import TemporaryDirectoryTestCase
+
+from benchmarks.templates import TemplateShape, write_templates
+from benchmarks.stages import STAGES
+from benchmarks.runner import run_benchmarks, compare_results
+
+
+class TestBenchmarks(TemporaryDirectoryTestCase):
+    """
+    Tests that the synthetic templates render, and that every stage can be
+    timed and compared.
+    """
+
+    def test_templates(self):
+        write_templates(self.base_dir, TemplateShape('test', 3, 2, 2))
+        output = STAGES['pyhp_run'](self.base_dir)()
+
+        self.assertEqual(output.count('<li>'), 5 * 3)
+        self.assertEqual(output.count('<html>'), 3)
+        self.assertNotIn('Traceback', output)
+
+    def test_run_benchmarks(self):
+        shape = TemplateShape('test', 2, 1, 1)
+        results = run_benchmarks(STAGES, [shape], repeat=2, min_time=0)
+
+        self.assertEqual([result.stage for result in results], list(STAGES))
+        for result in results:
+            self.assertEqual(result.shape, 'test')
+            self.assertGreater(result.median, 0)
+
+        comparison = compare_results(results[:1], results)
+        self.assertEqual(comparison[0], (results[0], 1.0))
+        self.assertEqual([ratio for _, ratio in comparison[1:]],
+                         [None] * (len(results) - 1))
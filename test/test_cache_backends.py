@@ -0,0 +1,136 @@
+"""
+Tests the backends that caches store their entries in.
+
+TestMemoryCacheBackend:
+    Tests that entries are stored, expired and evicted in memory.
+TestSQLiteCacheBackend:
+    Tests that entries are stored in a file, and shared between backends.
+"""
+
+# pylint: disable=missing-function-docstring
+
+from pathlib import PurePath
+from unittest import TestCase
+from unittest.mock import patch
+from time import sleep
+
+try:
+    from mocks import TemporaryDirectoryTestCase
+except ImportError:
+    from .mocks import TemporaryDirectoryTestCase
+
+from src.pyhp.cache_backends import CacheBackend, MemoryCacheBackend, \
+    SQLiteCacheBackend
+from src.pyhp.file_processing import SystemFileProcessor
+from src.pyhp.template_cache import TemplateCache
+
+
+class TestMemoryCacheBackend(TestCase):
+    """
+    Tests that entries are stored, expired and evicted in memory.
+
+    Other backends must pass the same tests.
+    """
+
+    def create_backend(self, namespace: str = 'default',
+                       max_bytes: int = 100) -> CacheBackend:
+        return MemoryCacheBackend(namespace, max_bytes)
+
+    def test_get_and_set(self):
+        backend = self.create_backend()
+        backend.set('foo', b'bar')
+
+        self.assertEqual(backend.get('foo'), b'bar')
+        self.assertIsNone(backend.get('baz'))
+
+        backend.delete('foo')
+        self.assertIsNone(backend.get('foo'))
+
+    def test_ttl(self):
+        backend = self.create_backend()
+        backend.set('foo', b'bar', 0.01)
+        backend.set('baz', b'qux', 60)
+        sleep(0.02)
+
+        self.assertIsNone(backend.get('foo'))
+        self.assertEqual(backend.get('baz'), b'qux')
+
+    def test_size_limit(self):
+        backend = self.create_backend(max_bytes=10)
+        backend.set('foo', b'a' * 6)
+        backend.set('bar', b'b' * 6)
+        backend.set('baz', b'c' * 11)
+
+        self.assertIsNone(backend.get('foo'))
+        self.assertEqual(backend.get('bar'), b'b' * 6)
+        self.assertIsNone(backend.get('baz'))
+
+    def test_clear(self):
+        backend = self.create_backend()
+        backend.set('foo', b'bar')
+        backend.clear()
+
+        self.assertIsNone(backend.get('foo'))
+
+    @patch('src.pyhp.cache_backends.ACCESS_TIME_RESOLUTION', 0)
+    def test_least_recently_used_evicted(self):
+        backend = self.create_backend(max_bytes=10)
+        backend.set('foo', b'a' * 4)
+        backend.set('bar', b'b' * 4)
+        backend.get('foo')
+        backend.set('baz', b'c' * 4)
+
+        self.assertEqual(backend.get('foo'), b'a' * 4)
+        self.assertIsNone(backend.get('bar'))
+
+    def test_size_after_replace_and_delete(self):
+        backend = self.create_backend(max_bytes=10)
+        backend.set('foo', b'a' * 8)
+        backend.set('foo', b'a' * 2)
+        backend.set('bar', b'b' * 8)
+        self.assertEqual(backend.get('foo'), b'a' * 2)
+
+        backend.delete('bar')
+        backend.set('baz', b'c' * 8)
+        self.assertEqual(backend.get('foo'), b'a' * 2)
+
+
+class TestSQLiteCacheBackend(TestMemoryCacheBackend,
+                             TemporaryDirectoryTestCase):
+    """Tests that entries are stored in a file, and shared between backends."""
+
+    def create_backend(self, namespace: str = 'default',
+                       max_bytes: int = 100) -> CacheBackend:
+        return SQLiteCacheBackend(self.base_dir / 'cache.db', namespace,
+                                  max_bytes)
+
+    def test_shared(self):
+        self.create_backend().set('foo', b'bar')
+
+        self.assertEqual(self.create_backend().get('foo'), b'bar')
+        self.assertIsNone(self.create_backend('other').get('foo'))
+
+        self.create_backend('other').clear()
+        self.assertEqual(self.create_backend().get('foo'), b'bar')
+
+    def test_shared_templates(self):
+        self.write('index.pyhp', '<p><pyhp>print(1)</pyhp></p>')
+        file_processor = SystemFileProcessor(self.base_dir)
+        path = PurePath('index.pyhp')
+
+        first = TemplateCache(backend=self.create_backend(max_bytes=10**6))
+        second = TemplateCache(backend=self.create_backend(max_bytes=10**6))
+        template = first.get_template(file_processor, path)
+        shared_template = second.get_template(file_processor, path)
+
+        self.assertIsNot(template, shared_template)
+        self.assertEqual(shared_template.sections, template.sections)
+        self.assertEqual(shared_template.sections[1].code,
+                         template.sections[1].code)
+
+        # Templates are not shared once the file changes
+        self.write('index.pyhp', '<pyhp>print(2)</pyhp>', 2 * 10**9)
+        file_processor.invalidate()
+        self.assertEqual(
+            second.get_template(file_processor, path).sections[0].text,
+            'print(2)')
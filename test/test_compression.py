@@ -0,0 +1,192 @@
+"""
+Tests the compression of responses.
+
+TestCompression:
+    Tests that encodings are chosen from the Accept-Encoding header, and that
+    streamed bodies can be decompressed as they are sent.
+TestPrecompression:
+    Tests that compressible files are compressed ahead of time, and that a
+    compressed copy is only used while it is up to date.
+TestCompressedResponses:
+    Tests that pages are compressed as they are sent, and that precompressed
+    copies of other files are sent while they are up to date.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import gzip
+import os
+import zlib
+from pathlib import PurePath
+from unittest import TestCase, skipIf
+
+from werkzeug.http import parse_accept_header
+
+try:
+    from mocks import TemporaryDirectoryTestCase
+except ImportError:
+    from .mocks import TemporaryDirectoryTestCase
+
+from src.pyhp.compression import ENCODINGS, brotli, get_accepted_encodings, \
+    is_compressible, compress, compress_chunks, get_precompressed_file, \
+    precompress_directory
+from src.pyhp.file_processing import SystemFileProcessor
+from src.pyhp.pyhp_flask import create_app
+from src.pyhp.static_files import get_static_file
+
+
+PAGE = '<pyhp>for i in range(200):\n    print(f"<p>Row {i}</p>")</pyhp>'
+
+
+class TestCompression(TestCase):
+    """
+    Tests that encodings are chosen from the Accept-Encoding header, and
+    that streamed bodies can be decompressed as they are sent.
+    """
+
+    def test_accepted_encodings(self):
+        def get(header: str) -> list[str]:
+            return get_accepted_encodings(parse_accept_header(header))
+
+        self.assertEqual(get(''), [])
+        self.assertEqual(get('gzip, deflate'), ['gzip'])
+        self.assertEqual(get('gzip;q=0, deflate'), [])
+        self.assertEqual(get('*'), list(ENCODINGS))
+        self.assertEqual(get('gzip;q=1, br;q=0.5')[0], 'gzip')
+
+    def test_is_compressible(self):
+        self.assertTrue(is_compressible('text/html; charset=utf-8'))
+        self.assertTrue(is_compressible('Image/SVG+XML'))
+        self.assertFalse(is_compressible('image/png'))
+        self.assertFalse(is_compressible(None))
+
+    def test_compress_chunks(self):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = [b'<p>First</p>', b'<p>Second</p>']
+        compressed = compress_chunks(iter(chunks), 'gzip')
+
+        # Each chunk can be decompressed as soon as it is received
+        for chunk in chunks:
+            self.assertEqual(decompressor.decompress(next(compressed)), chunk)
+
+        decompressor.decompress(b''.join(compressed))
+        self.assertTrue(decompressor.eof)
+
+    def test_compress(self):
+        self.assertEqual(gzip.decompress(compress(b'x' * 1000, 'gzip')),
+                         b'x' * 1000)
+
+    @skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli(self):
+        self.assertEqual(brotli.decompress(compress(b'x' * 1000, 'br')),
+                         b'x' * 1000)
+        self.assertEqual(brotli.decompress(
+            b''.join(compress_chunks([b'a', b'b'], 'br'))), b'ab')
+
+
+class TestPrecompression(TemporaryDirectoryTestCase):
+    """
+    Tests that compressible files are compressed ahead of time, and that a
+    compressed copy is only used while it is up to date.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.write('index.pyhp', PAGE)
+        self.write('style.css', 'p { color: red; }\n' * 100)
+        self.write('small.css', 'p {}')
+        self.write('image.png', 'x' * 2000)
+
+    def test_precompress_directory(self):
+        written = precompress_directory(self.base_dir)
+
+        self.assertIn(PurePath('style.css.gz'), written)
+        self.assertEqual(gzip.decompress(
+            (self.base_dir / 'style.css.gz').read_bytes()),
+            b'p { color: red; }\n' * 100)
+        self.assertEqual((self.base_dir / 'style.css.gz').stat().st_mtime_ns,
+                         10**9)
+        for name in ('small.css.gz', 'image.png.gz', 'index.pyhp.gz'):
+            self.assertFalse((self.base_dir / name).exists())
+
+        # Up to date, so not written again
+        self.assertEqual(precompress_directory(self.base_dir), [])
+
+    def test_get_precompressed_file(self):
+        precompress_directory(self.base_dir)
+        file_processor = SystemFileProcessor(self.base_dir)
+        path = PurePath('style.css')
+
+        static_file = get_precompressed_file(
+            file_processor, path, get_static_file(file_processor, path),
+            ['gzip'])
+        self.assertEqual(static_file.path, self.base_dir / 'style.css.gz')
+        self.assertEqual(static_file.content_encoding, 'gzip')
+        self.assertEqual(static_file.content_type, 'text/css; charset=utf-8')
+
+        # Not used once the file has changed
+        os.utime(self.base_dir / 'style.css', ns=(2 * 10**9, 2 * 10**9))
+        file_processor.invalidate()
+        self.assertIsNone(get_precompressed_file(
+            file_processor, path, get_static_file(file_processor, path),
+            ['gzip']))
+
+
+class TestCompressedResponses(TemporaryDirectoryTestCase):
+    """
+    Tests that pages are compressed as they are sent, and that precompressed
+    copies of other files are sent while they are up to date.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.write('index.pyhp', PAGE)
+        self.write('small.pyhp', '<p>Small</p>')
+        self.write('style.css', 'p { color: red; }\n' * 100)
+
+    def get(self, path: str, config: dict = None, **headers):
+        app = create_app(str(self.base_dir),
+                         {'PYHP_COMPRESSION': True, **(config or {})})
+        response = app.test_client().get(
+            path, headers={'Accept-Encoding': 'gzip', **headers})
+        data = response.get_data()
+        response.close()
+        return response, data
+
+    def test_page(self):
+        expected = ''.join(f'<p>Row {i}</p>\n' for i in range(200)).encode()
+
+        for config in ({}, {'PYHP_STREAM_BUFFER_SIZE': 100}):
+            response, data = self.get('/', config)
+            self.assertEqual(response.content_encoding, 'gzip')
+            self.assertIn('Accept-Encoding', response.vary)
+            self.assertEqual(gzip.decompress(data), expected)
+
+    def test_not_compressed(self):
+        response, data = self.get('/small')
+        self.assertIsNone(response.content_encoding)
+        self.assertEqual(data, b'<p>Small</p>')
+
+        response, _ = self.get('/', **{'Accept-Encoding': 'identity'})
+        self.assertIsNone(response.content_encoding)
+        self.assertIn('Accept-Encoding', response.vary)
+
+        response, _ = self.get('/', {'PYHP_COMPRESSION': False})
+        self.assertIsNone(response.content_encoding)
+
+    def test_precompressed(self):
+        response, _ = self.get('/style.css')
+        self.assertIsNone(response.content_encoding)
+
+        precompress_directory(self.base_dir)
+
+        response, data = self.get('/style.css')
+        self.assertEqual(response.content_encoding, 'gzip')
+        self.assertEqual(response.content_type, 'text/css; charset=utf-8')
+        self.assertEqual(gzip.decompress(data), b'p { color: red; }\n' * 100)
+
+        # Not sent once the file has changed
+        os.utime(self.base_dir / 'style.css', ns=(2 * 10**9, 2 * 10**9))
+        response, data = self.get('/style.css')
+        self.assertIsNone(response.content_encoding)
+        self.assertEqual(data, b'p { color: red; }\n' * 100)
@@ -0,0 +1,117 @@
+"""
+Tests the system file processor.
+
+TestSystemFileProcessor:
+    Tests that paths are resolved, cached and kept inside the base directory.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import os
+from mmap import mmap
+from pathlib import PurePath
+from unittest import skipUnless
+
+try:
+    from mocks import TemporaryDirectoryTestCase
+except ImportError:
+    from .mocks import TemporaryDirectoryTestCase
+
+from src.pyhp.file_processing import SystemFileProcessor, \
+    MIN_MAPPED_FILE_SIZE, write_file_atomically
+
+
+class TestSystemFileProcessor(TemporaryDirectoryTestCase):
+    """Tests that paths are resolved, cached and kept in the base directory."""
+
+    def setUp(self):
+        super().setUp()
+        (self.base_dir / 'dir').mkdir()
+        (self.base_dir / 'index.pyhp').write_text('Hello', encoding='utf-8')
+
+    def test_get_true_path(self):
+        file_processor = SystemFileProcessor(self.base_dir)
+
+        self.assertEqual(file_processor.get_true_path(PurePath('index')),
+                         PurePath('index.pyhp'))
+        self.assertEqual(file_processor.get_true_path(PurePath('index.pyhp')),
+                         PurePath('index.pyhp'))
+
+        for path, error in (('dir', IsADirectoryError),
+                            ('missing', FileNotFoundError),
+                            ('index.pyhp/foo', FileNotFoundError)):
+            # Cached errors are raised again
+            for _ in range(2):
+                with self.assertRaises(error):
+                    file_processor.get_true_path(PurePath(path))
+
+    def test_outside_base_dir(self):
+        file_processor = SystemFileProcessor(self.base_dir / 'dir')
+
+        with self.assertRaises(RuntimeError):
+            file_processor.get_absolute_path(PurePath('../index.pyhp'))
+
+    def test_cached_until_invalidated(self):
+        file_processor = SystemFileProcessor(self.base_dir, cache_ttl=None)
+        self.assertFalse(file_processor.is_file(PurePath('new.pyhp')))
+
+        (self.base_dir / 'new.pyhp').write_text('Hi', encoding='utf-8')
+        self.assertFalse(file_processor.is_file(PurePath('new.pyhp')))
+
+        file_processor.invalidate()
+        self.assertTrue(file_processor.is_file(PurePath('new.pyhp')))
+
+    def test_uncached(self):
+        file_processor = SystemFileProcessor(self.base_dir, cache_ttl=0)
+        self.assertFalse(file_processor.is_file(PurePath('new.pyhp')))
+
+        (self.base_dir / 'new.pyhp').write_text('Hi', encoding='utf-8')
+        self.assertTrue(file_processor.is_file(PurePath('new.pyhp')))
+        self.assertEqual(file_processor.get_file_stamp(PurePath('new.pyhp'))[1],
+                         2)
+
+    def test_memory_mapped_files(self):
+        (self.base_dir / 'empty.pyhp').write_text('', encoding='utf-8')
+        file_processor = SystemFileProcessor(self.base_dir,
+                                             memory_map_files=True)
+
+        self.assertEqual(
+            bytes(file_processor.get_file_buffer(PurePath('index.pyhp'))),
+            b'Hello')
+        self.assertEqual(
+            file_processor.get_file_buffer(PurePath('empty.pyhp')), b'')
+        self.assertEqual(
+            SystemFileProcessor(self.base_dir).get_file_buffer(
+                PurePath('index.pyhp')),
+            'Hello')
+
+    @skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc/self/fd')
+    def test_mapped_file_limit(self):
+        for i in range(20):
+            (self.base_dir / f'{i}.pyhp').write_bytes(
+                b'x' * MIN_MAPPED_FILE_SIZE)
+        file_processor = SystemFileProcessor(self.base_dir,
+                                             memory_map_files=True,
+                                             max_mapped_files=5)
+
+        open_files = len(os.listdir('/proc/self/fd'))
+        buffers = [file_processor.get_file_buffer(PurePath(f'{i}.pyhp'))
+                   for i in range(20)]
+        self.assertLessEqual(len(os.listdir('/proc/self/fd')),
+                             open_files + 5)
+        self.assertTrue(all(bytes(buffer) == b'x' * MIN_MAPPED_FILE_SIZE
+                            for buffer in buffers))
+        self.assertIsInstance(buffers[0], mmap)
+
+        # Maps that are no longer used make room for others
+        buffers.clear()
+        self.assertIsInstance(
+            file_processor.get_file_buffer(PurePath('0.pyhp')), mmap)
+
+    def test_write_file_atomically(self):
+        path = self.base_dir / 'index.pyhp'
+        write_file_atomically(path, b'Replaced', (10**9, 2 * 10**9))
+
+        self.assertEqual(path.read_bytes(), b'Replaced')
+        self.assertEqual(path.stat().st_mtime_ns, 2 * 10**9)
+        self.assertFalse((self.base_dir / 'index.pyhp.tmp').exists())
@@ -0,0 +1,168 @@
+"""
+Tests watching directories for changes.
+
+TestPollingWatcher:
+    Tests that the polling watcher reports added, changed and removed files.
+TestInotifyWatcher:
+    Tests that the inotify watcher reports changes (on Linux only).
+TestChangeListeners:
+    Tests that file processors pass changes on to caches.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import os
+from unittest import skipIf
+from unittest.mock import patch
+from pathlib import PurePath
+from threading import Event
+
+try:
+    from mocks import MockFileProcessor, TemporaryDirectoryTestCase
+except ImportError:
+    from .mocks import MockFileProcessor, TemporaryDirectoryTestCase
+
+from src.pyhp.file_processing import SystemFileProcessor
+from src.pyhp.file_watching import PollingWatcher, InotifyWatcher, load_libc
+from src.pyhp.template_cache import TemplateCache
+
+
+class WatcherTestCase(TemporaryDirectoryTestCase):
+    """Sets up a temporary directory to watch."""
+
+    def setUp(self):
+        super().setUp()
+        (self.base_dir / 'sub').mkdir()
+        self.write('index.pyhp', 'Hello')
+        self.changes = []
+
+
+class TestPollingWatcher(WatcherTestCase):
+    """Tests that the polling watcher reports changed files."""
+
+    def test_poll(self):
+        watcher = PollingWatcher(self.base_dir, self.changes.append)
+        watcher.poll()
+        self.assertEqual(self.changes, [])
+
+        self.write('sub/new.pyhp', 'New')
+        self.write('index.pyhp', 'Hello World', 2 * 10**9)
+        watcher.poll()
+        self.assertEqual(sorted(self.changes),
+                         [PurePath('index.pyhp'), PurePath('sub/new.pyhp')])
+
+        self.changes.clear()
+        (self.base_dir / 'index.pyhp').unlink()
+        watcher.poll()
+        self.assertEqual(self.changes, [PurePath('index.pyhp')])
+
+    def test_callback_error(self):
+        def callback(path):
+            self.changes.append(path)
+            raise ValueError
+
+        watcher = PollingWatcher(self.base_dir, callback)
+        self.write('index.pyhp', 'Hello World', 2 * 10**9)
+
+        with self.assertLogs('src.pyhp.file_watching') as logs:
+            watcher.poll()
+
+        self.assertEqual(self.changes, [PurePath('index.pyhp')])
+        self.assertIn('ValueError', logs.output[0])
+
+
+@skipIf(load_libc() is None, 'inotify is not available')
+class TestInotifyWatcher(WatcherTestCase):
+    """Tests that the inotify watcher reports changes."""
+
+    def test_changes_reported(self):
+        changed = Event()
+
+        def callback(path):
+            self.changes.append(path)
+            changed.set()
+
+        watcher = InotifyWatcher(self.base_dir, callback)
+        watcher.start()
+        try:
+            self.write('sub/page.pyhp', 'Page')
+            self.assertTrue(changed.wait(5))
+        finally:
+            watcher.stop()
+
+        self.assertIn(PurePath('sub/page.pyhp'), self.changes)
+
+
+class TestChangeListeners(WatcherTestCase):
+    """Tests that file processors pass changes on to caches."""
+
+    def test_mock_file_processor_events(self):
+        file_processor = MockFileProcessor()
+        file_processor.add_change_listener(self.changes.append)
+
+        file_processor.notify_change(PurePath('index.pyhp'))
+        file_processor.notify_change()
+
+        self.assertEqual(self.changes, [PurePath('index.pyhp'), None])
+
+    def test_listener_error(self):
+        file_processor = MockFileProcessor()
+        file_processor.add_change_listener(lambda path: 1 / 0)
+        file_processor.add_change_listener(self.changes.append)
+
+        with self.assertLogs('src.pyhp.file_processing') as logs:
+            file_processor.notify_change(PurePath('index.pyhp'))
+
+        self.assertEqual(self.changes, [PurePath('index.pyhp')])
+        self.assertIn('ZeroDivisionError', logs.output[0])
+
+    def test_invalidated_during_lookup(self):
+        file_processor = SystemFileProcessor(self.base_dir, cache_ttl=None)
+        path = PurePath('index.pyhp')
+        real_stat = os.stat
+
+        def stat_then_invalidate(*args, **kwargs):
+            result = real_stat(*args, **kwargs)
+            # As if the watcher reported a change before the result is stored
+            file_processor.invalidate()
+            return result
+
+        with patch('src.pyhp.file_processing.os.stat', stat_then_invalidate):
+            self.assertTrue(file_processor.is_file(path))
+
+        self.assertNotIn(('stat', path), file_processor.cache)
+
+    def test_template_cache_invalidated(self):
+        file_processor = SystemFileProcessor(self.base_dir, cache_ttl=None)
+        template_cache = TemplateCache()
+        file_processor.add_change_listener(
+            lambda path: template_cache.invalidate(file_processor, path))
+
+        template_cache.get_template(file_processor, PurePath('index.pyhp'))
+        self.write('index.pyhp', 'Hello World', 2 * 10**9)
+
+        # Without a change notification, the cached stamp is trusted
+        template = template_cache.get_template(file_processor,
+                                               PurePath('index.pyhp'))
+        self.assertEqual(template.sections[0].text, 'Hello')
+
+        file_processor.notify_change(PurePath('index.pyhp'))
+        self.assertEqual(len(template_cache.cache), 0)
+
+        template = template_cache.get_template(file_processor,
+                                               PurePath('index.pyhp'))
+        self.assertEqual(template.sections[0].text, 'Hello World')
+
+    def test_start_watching(self):
+        file_processor = SystemFileProcessor(self.base_dir)
+        changed = Event()
+        file_processor.add_change_listener(lambda path: changed.set())
+
+        file_processor.start_watching(poll_interval=0.05)
+        try:
+            self.assertTrue(file_processor.is_file(PurePath('index.pyhp')))
+            (self.base_dir / 'index.pyhp').unlink()
+            self.assertTrue(changed.wait(5))
+            self.assertFalse(file_processor.is_file(PurePath('index.pyhp')))
+        finally:
+            file_processor.stop_watching()
@@ -0,0 +1,73 @@
+"""
+Tests caching the output of code blocks.
+
+TestFragmentCache:
+    Tests that cacheable code blocks are run once and replayed.
+"""
+
+# pylint: disable=missing-function-docstring
+
+from unittest import TestCase
+from pathlib import PurePath
+from typing import Optional
+
+try:
+    from mocks import MockFileProcessor
+except ImportError:
+    from .mocks import MockFileProcessor
+
+from src.pyhp.fragment_cache import FragmentCache
+from src.pyhp.namespaces import NamespaceFactory
+from src.pyhp.pyhp_interface import Pyhp
+
+
+class TestFragmentCache(TestCase):
+    """Tests that cacheable code blocks are run once and replayed."""
+
+    def setUp(self):
+        self.fragment_cache = FragmentCache()
+        # Each run of a block prints a new number, so replays can be spotted
+        self.namespace_factory = NamespaceFactory(helpers={'COUNTER': []})
+
+    def run_page(self, code: str, get: Optional[dict[str, str]] = None,
+                 debug: bool = False) -> str:
+        pyhp_class = Pyhp(PurePath(), MockFileProcessor(code), debug=debug,
+                          get=get, namespace_factory=self.namespace_factory,
+                          fragment_cache=self.fragment_cache)
+        return pyhp_class.run('index.pyhp')
+
+    def test_replayed(self):
+        code = '<pyhp cache="60">COUNTER.append(1)\nprint(len(COUNTER))' \
+               '</pyhp><pyhp>print(len(COUNTER))</pyhp>'
+
+        self.assertEqual(self.run_page(code), '1\n1\n')
+        self.assertEqual(self.run_page(code), '1\n1\n')
+
+    def test_key_and_vary_on(self):
+        code = '<pyhp cache="60" key="counter" vary_on="get:page">' \
+               'COUNTER.append(1)\nprint(len(COUNTER))</pyhp>'
+        other_code = '<pyhp cache="60" key="counter" vary_on="get:page">' \
+                     'print("other")</pyhp>'
+
+        self.assertEqual(self.run_page(code, {'page': '1'}), '1\n')
+        self.assertEqual(self.run_page(code, {'page': '2'}), '2\n')
+        # Blocks with the same key share their output
+        self.assertEqual(self.run_page(other_code, {'page': '1'}), '1\n')
+
+    def test_expired(self):
+        code = '<pyhp cache="0">COUNTER.append(1)\nprint(len(COUNTER))</pyhp>'
+
+        self.assertEqual(self.run_page(code), '1\n')
+        self.assertEqual(self.run_page(code), '2\n')
+
+    def test_errors_not_cached(self):
+        code = '<pyhp cache="60">COUNTER.append(1)\n1 / 0</pyhp>'
+
+        self.run_page(code, debug=True)
+        self.run_page(code, debug=True)
+
+        self.assertEqual(len(self.namespace_factory.create()['COUNTER']), 2)
+
+    def test_invalid_cache_time(self):
+        with self.assertRaises(ValueError):
+            self.run_page('<pyhp cache="soon">print(1)</pyhp>')
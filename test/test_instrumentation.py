@@ -0,0 +1,130 @@
+"""
+Tests the timing of each stage of a render.
+
+TestInstrumentation:
+    Tests that timings are recorded for each stage, code block and include,
+    and reported to hooks.
+TestServerTiming:
+    Tests that the timings of a request are sent in the Server-Timing header,
+    and dumped to PYHP_PROFILE_DIR in debug mode.
+"""
+
+# pylint: disable=missing-function-docstring
+
+from pathlib import PurePath
+from unittest import TestCase
+
+try:
+    from mocks import MockFileProcessor, TemporaryDirectoryTestCase
+except ImportError:
+    from .mocks import MockFileProcessor, TemporaryDirectoryTestCase
+
+from src.pyhp.instrumentation import profile_render, add_timing_hook, \
+    remove_timing_hook, is_recording
+from src.pyhp.pyhp_interface import Pyhp
+from src.pyhp.template_cache import TemplateCache
+from src.pyhp.pyhp_flask import create_app
+
+
+INDEX = '<p>Hello</p>\n<pyhp>print(1)</pyhp>\n' \
+        '<pyhp>\nprint(pyhp.include("inc.pyhp"))\n</pyhp>'
+INCLUDE = '<pyhp>print(2)</pyhp>'
+
+
+class TestInstrumentation(TestCase):
+    """
+    Tests that timings are recorded for each stage, code block and include,
+    and reported to hooks.
+    """
+
+    def render(self) -> str:
+        file_processor = MockFileProcessor({PurePath('index.pyhp'): INDEX,
+                                            PurePath('inc.pyhp'): INCLUDE})
+        # A new cache, so that every stage is run
+        return Pyhp(PurePath(), file_processor,
+                    template_cache=TemplateCache()).run('index.pyhp')
+
+    def test_profile_render(self):
+        self.assertFalse(is_recording())
+
+        with profile_render() as profile:
+            self.assertTrue(is_recording())
+            self.render()
+
+        self.assertFalse(is_recording())
+
+        stages = [(timing.stage, timing.filename, timing.depth)
+                  for timing in profile.timings
+                  if timing.stage not in ('exec', 'template')]
+        self.assertEqual(stages, [
+            ('load', 'index.pyhp', 0),
+            ('parse', 'index.pyhp', 0),
+            ('compile', 'index.pyhp', 0),
+            ('load', 'inc.pyhp', 1),
+            ('parse', 'inc.pyhp', 1),
+            ('compile', 'inc.pyhp', 1),
+            ('include', 'inc.pyhp', 0),
+        ])
+
+        blocks = [(timing.filename, timing.lines, timing.depth)
+                  for timing in profile.timings if timing.stage == 'exec']
+        self.assertEqual(blocks, [
+            ('index.pyhp', (2, 2), 0),
+            ('inc.pyhp', (1, 1), 1),
+            ('index.pyhp', (3, 5), 0),
+        ])
+
+        self.assertEqual(list(profile.get_totals()),
+                         ['template', 'load', 'parse', 'compile', 'exec',
+                          'include'])
+
+    def test_timing_hook(self):
+        timings = []
+        add_timing_hook(timings.append)
+        try:
+            self.render()
+        finally:
+            remove_timing_hook(timings.append)
+
+        self.assertEqual(len([timing for timing in timings
+                              if timing.stage == 'exec']), 3)
+
+        timings.clear()
+        self.render()
+        self.assertEqual(timings, [])
+
+
+class TestServerTiming(TemporaryDirectoryTestCase):
+    """
+    Tests that the timings of a request are sent in the Server-Timing
+    header, and dumped to PYHP_PROFILE_DIR in debug mode.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.write('index.pyhp', INDEX)
+        self.write('inc.pyhp', INCLUDE)
+
+    def test_server_timing_header(self):
+        client = create_app(str(self.base_dir),
+                            {'PYHP_SERVER_TIMING': True}).test_client()
+        header = client.get('/').headers['Server-Timing']
+
+        self.assertEqual([metric.split(';')[0]
+                          for metric in header.split(', ')],
+                         ['template', 'load', 'parse', 'compile', 'exec',
+                          'include', 'total'])
+
+        client = create_app(str(self.base_dir)).test_client()
+        self.assertNotIn('Server-Timing', client.get('/').headers)
+
+    def test_profile_dump(self):
+        profile_dir = self.base_dir / 'profiles'
+        config = {'PYHP_PROFILE_DIR': str(profile_dir)}
+
+        create_app(str(self.base_dir), config).test_client().get('/')
+        self.assertFalse(profile_dir.exists())
+
+        config['DEBUG'] = True
+        create_app(str(self.base_dir), config).test_client().get('/')
+        self.assertEqual(len(list(profile_dir.glob('*-index.prof'))), 1)
@@ -0,0 +1,152 @@
+"""
+Tests the metrics registry and the metrics endpoint.
+
+TestMetricsRegistry:
+    Tests that counters and histograms are recorded from several threads,
+    and rendered in the Prometheus text format.
+TestMetricsEndpoint:
+    Tests that the Flask app records requests, and serves the metrics to
+    clients with the token.
+"""
+
+# pylint: disable=missing-function-docstring
+
+from threading import Thread
+from unittest import TestCase
+
+try:
+    from mocks import TemporaryDirectoryTestCase
+except ImportError:
+    from .mocks import TemporaryDirectoryTestCase
+
+from src.pyhp.metrics import MetricsRegistry
+from src.pyhp.pyhp_flask import create_app
+
+
+class TestMetricsRegistry(TestCase):
+    """
+    Tests that counters and histograms are recorded from several threads,
+    and rendered in the Prometheus text format.
+    """
+
+    def test_counter(self):
+        registry = MetricsRegistry()
+        counter = registry.counter('requests_total', 'Requests.',
+                                   ('path', 'status'))
+
+        def count():
+            for _ in range(1000):
+                counter.inc('index', '200')
+
+        threads = [Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc('a"b\\c', '404', amount=2)
+
+        self.assertEqual(counter.get('index', '200'), 4000)
+        self.assertEqual(registry.render(),
+                         '# HELP requests_total Requests.\n'
+                         '# TYPE requests_total counter\n'
+                         'requests_total{path="a\\"b\\\\c",status="404"} 2\n'
+                         'requests_total{path="index",status="200"} 4000\n')
+
+    def test_histogram(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram('duration_seconds', 'Durations.',
+                                       buckets=(0.1, 1))
+
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.get_count(), 4)
+        self.assertEqual(registry.render().splitlines()[2:], [
+            'duration_seconds_bucket{le="0.1"} 2',
+            'duration_seconds_bucket{le="1"} 3',
+            'duration_seconds_bucket{le="+Inf"} 4',
+            'duration_seconds_sum 2.65',
+            'duration_seconds_count 4',
+        ])
+
+    def test_finished_threads_merged(self):
+        counter = MetricsRegistry().counter('requests_total', 'Requests.')
+
+        for _ in range(50):
+            thread = Thread(target=counter.inc)
+            thread.start()
+            thread.join()
+
+        # pylint: disable=protected-access
+        self.assertLessEqual(len(counter._shards), 1)
+        self.assertEqual(counter.get(), 50)
+
+    def test_duplicate_name(self):
+        registry = MetricsRegistry()
+        registry.counter('requests_total', 'Requests.')
+
+        with self.assertRaises(ValueError):
+            registry.histogram('requests_total', 'Requests.')
+
+
+class TestMetricsEndpoint(TemporaryDirectoryTestCase):
+    """
+    Tests that the Flask app records requests, and serves the metrics to
+    clients with the token.
+    """
+
+    def test_metrics(self):
+        self.write('index.pyhp', '<pyhp>print(pyhp.include("inc.pyhp"))'
+                                 '</pyhp>')
+        self.write('inc.pyhp', '<p>Included</p>')
+        client = create_app(str(self.base_dir),
+                            {'PYHP_METRICS_PATH': '/metrics'}).test_client()
+
+        client.get('/')
+        client.get('/')
+        client.get('/missing')
+        metrics = client.get('/metrics')
+
+        self.assertEqual(metrics.status_code, 200)
+        self.assertTrue(metrics.content_type.startswith('text/plain'))
+
+        lines = metrics.get_data(as_text=True).splitlines()
+        for line in (
+                'pyhp_requests_total{path="",status="404"} 1',
+                'pyhp_requests_total{path="index.pyhp",status="200"} 2',
+                'pyhp_request_duration_seconds_count 3',
+                'pyhp_stage_duration_seconds_count{stage="include"} 2',
+                'pyhp_stage_duration_seconds_count{stage="compile"} 2',
+                'pyhp_includes_total 2',
+                'pyhp_cache_hits_total{cache="templates"} 2',
+                'pyhp_cache_misses_total{cache="templates"} 2',
+        ):
+            self.assertIn(line, lines)
+
+        self.assertIn('pyhp_response_bytes_total '
+                      f'{len(client.get("/").data) * 2}', lines)
+
+    def test_metrics_token(self):
+        client = create_app(str(self.base_dir),
+                            {'PYHP_METRICS_PATH': '/metrics',
+                             'PYHP_METRICS_TOKEN': 'secret'}).test_client()
+
+        self.assertEqual(client.get('/metrics').status_code, 404)
+        self.assertEqual(client.get('/metrics', headers={
+            'Authorization': 'Bearer wrong'}).status_code, 404)
+        self.assertEqual(client.get('/metrics', headers={
+            'Authorization': 'Bearer secret'}).status_code, 200)
+
+        # Without a token, the client's address is not checked
+        client = create_app(str(self.base_dir),
+                            {'PYHP_METRICS_PATH': '/metrics'}).test_client()
+        self.assertEqual(
+            client.get('/metrics',
+                       environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code,
+            200)
+
+    def test_metrics_disabled(self):
+        self.write('index.pyhp', '<p>Hello</p>')
+        client = create_app(str(self.base_dir)).test_client()
+
+        self.assertEqual(client.get('/metrics').status_code, 404)
@@ -0,0 +1,85 @@
+"""
+Tests the encoded output buffer of code blocks.
+
+TestOutputWriter:
+    Tests that output is encoded into chunks of bounded size.
+TestEncodedRendering:
+    Tests that pages rendered as bytes (including the files they display)
+    produce the same output as pages rendered as text.
+"""
+
+# pylint: disable=missing-function-docstring
+
+from pathlib import PurePath
+from unittest import TestCase
+
+try:
+    from mocks import MockFileProcessor
+except ImportError:
+    from .mocks import MockFileProcessor
+
+from src.pyhp.output_writer import OutputWriter
+from src.pyhp.pyhp_interface import Pyhp
+
+
+class TestOutputWriter(TestCase):
+    """Tests that output is encoded into chunks of bounded size."""
+
+    def test_chunks(self):
+        writer = OutputWriter(chunk_size=10)
+
+        for _ in range(5):
+            writer.write('abcd')
+        writer.write('x' * 25)
+        writer.write('é')
+
+        self.assertEqual(writer.get_chunks(),
+                         [b'abcdabcdabcd', b'abcdabcd' + b'x' * 25,
+                          'é'.encode()])
+        self.assertEqual(writer.getvalue(), 'abcd' * 5 + 'x' * 25 + 'é')
+
+    def test_write_bytes(self):
+        writer = OutputWriter()
+
+        writer.write('<p>')
+        writer.write_bytes(memoryview(b'Hello'))
+        writer.write('</p>')
+
+        self.assertEqual(writer.get_chunks(), [b'<p>', b'Hello', b'</p>'])
+
+    def test_empty(self):
+        self.assertEqual(OutputWriter().get_chunks(), [])
+
+
+class TestEncodedRendering(TestCase):
+    """
+    Tests that pages rendered as bytes (including the files they display)
+    produce the same output as pages rendered as text.
+    """
+
+    def test_display(self):
+        file_processor = MockFileProcessor({
+            PurePath('index.pyhp'): '<h1>Title</h1><pyhp>\n'
+                                    'for i in range(3):\n'
+                                    '    pyhp.display("sub/item.pyhp")\n'
+                                    'print("é")\n</pyhp>',
+            PurePath('sub/item.pyhp'): '<p>Item</p><pyhp>print(1)</pyhp>',
+        })
+
+        text = ''.join(Pyhp(PurePath(), file_processor).stream('index.pyhp'))
+        chunks = list(Pyhp(PurePath(), file_processor).stream('index.pyhp',
+                                                              encoded=True))
+
+        self.assertEqual(text, '<h1>Title</h1>' + '<p>Item</p>1\n' * 3 +
+                         'é\n')
+        self.assertEqual(b''.join(chunks), text.encode())
+
+    def test_display_error(self):
+        file_processor = MockFileProcessor({
+            PurePath('index.pyhp'): '<pyhp>pyhp.display("error.pyhp")</pyhp>',
+            PurePath('error.pyhp'): '<pyhp>raise ValueError</pyhp>',
+        })
+
+        with self.assertRaises(RuntimeError):
+            list(Pyhp(PurePath(), file_processor).stream('index.pyhp',
+                                                         encoded=True))
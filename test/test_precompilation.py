@@ -0,0 +1,89 @@
+"""
+Tests compiling PyHP files ahead of time.
+
+TestPrecompilation:
+    Tests that compiled artifacts are written, loaded and validated.
+"""
+
+# pylint: disable=missing-function-docstring
+
+from pathlib import PurePath
+from functools import partial
+
+try:
+    from mocks import TemporaryDirectoryTestCase
+except ImportError:
+    from .mocks import TemporaryDirectoryTestCase
+
+from src.pyhp.precompilation import compile_directory, load_artifact, \
+    COMPILED_DIR_NAME
+from src.pyhp.file_processing import SystemFileProcessor
+from src.pyhp.template_cache import TemplateCache
+from src.pyhp.pyhp_interface import Pyhp
+
+
+class TestPrecompilation(TemporaryDirectoryTestCase):
+    """Tests that compiled artifacts are written, loaded and validated."""
+
+    def setUp(self):
+        super().setUp()
+        self.compiled_dir = self.base_dir / COMPILED_DIR_NAME
+        self.file_processor = SystemFileProcessor(self.base_dir)
+
+        (self.base_dir / 'sub').mkdir()
+        self.write('index.pyhp', '<p><pyhp cache="60">print(1 + 1)</pyhp></p>')
+        self.write('sub/page.pyhp', '<pyhp>print("page")</pyhp>')
+        self.write('style.css', 'p {}')
+
+    def load(self, name: str):
+        return load_artifact(self.compiled_dir, PurePath(name),
+                             self.file_processor.get_file_stamp(
+                                 PurePath(name)))
+
+    def test_compile_directory(self):
+        compiled = compile_directory(self.base_dir)
+
+        self.assertEqual(compiled,
+                         [PurePath('index.pyhp'), PurePath('sub/page.pyhp')])
+
+        template = self.load('index.pyhp')
+        self.assertEqual([section.text for section in template.sections],
+                         ['<p>', 'print(1 + 1)', '</p>'])
+        self.assertIsNotNone(template.sections[1].code)
+        self.assertEqual(template.sections[1].attributes, {'cache': '60'})
+
+        # Compiling again does not compile the compiled files
+        self.assertEqual(compile_directory(self.base_dir), compiled)
+
+    def test_out_of_date_artifact(self):
+        compile_directory(self.base_dir)
+        self.write('index.pyhp', '<pyhp>print(3)</pyhp>', 2 * 10**9)
+
+        self.assertIsNone(self.load('index.pyhp'))
+        self.assertIsNone(load_artifact(self.compiled_dir,
+                                        PurePath('missing.pyhp'), (0, 0)))
+
+    def test_template_cache_uses_artifacts(self):
+        compile_directory(self.base_dir)
+        loaded = []
+
+        def artifact_loader(path, stamp):
+            template = load_artifact(self.compiled_dir, path, stamp)
+            loaded.append(template is not None)
+            return template
+
+        pyhp_class = Pyhp(PurePath(), self.file_processor,
+                          template_cache=TemplateCache(
+                              artifact_loader=artifact_loader))
+
+        self.assertEqual(pyhp_class.run('index.pyhp'), '<p>2\n</p>')
+        self.assertEqual(pyhp_class.include('sub/page.pyhp'), 'page\n')
+        self.assertEqual(loaded, [True, True])
+
+    def test_template_cache_compiles_without_artifacts(self):
+        pyhp_class = Pyhp(PurePath(), self.file_processor,
+                          template_cache=TemplateCache(
+                              artifact_loader=partial(load_artifact,
+                                                      self.compiled_dir)))
+
+        self.assertEqual(pyhp_class.run('index.pyhp'), '<p>2\n</p>')
@@ -0,0 +1,143 @@
+"""
+Tests the pre-forking server.
+
+TestPreforkServer:
+    Tests that templates are preloaded, and that the server handles
+    requests and restarts gracefully.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import os
+import signal
+from functools import partial
+from http.client import HTTPConnection
+from pathlib import PurePath
+from time import monotonic, sleep
+
+try:
+    from mocks import TemporaryDirectoryTestCase
+except ImportError:
+    from .mocks import TemporaryDirectoryTestCase
+
+from src.pyhp.pyhp_flask import create_app
+from src.pyhp.precompilation import compile_directory
+from src.pyhp.prefork_server import PreforkServer, run_benchmark, fork
+
+
+class TestPreforkServer(TemporaryDirectoryTestCase):
+    """
+    Tests that templates are preloaded, and that the server handles
+    requests and restarts gracefully.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.write('index.pyhp', '<pyhp>import os\nprint(os.getpid())</pyhp>')
+        self.write('sub/page.pyhp', '<pyhp>print("page")</pyhp>')
+        self.app_factory = partial(create_app, str(self.base_dir))
+
+    def test_preload_templates(self):
+        compile_directory(self.base_dir)
+        state = create_app(str(self.base_dir)).extensions['pyhp']
+
+        self.assertEqual(state.preload_templates(),
+                         [PurePath('index.pyhp'), PurePath('sub/page.pyhp')])
+        self.assertEqual(len(state.template_cache.cache), 2)
+
+    def test_benchmark(self):
+        result = run_benchmark(self.app_factory, '/sub/page', workers=2,
+                               requests=50, concurrency=4)
+
+        self.assertEqual(result.requests, 50)
+        self.assertEqual(result.errors, 0)
+        self.assertGreater(result.requests_per_second, 0)
+
+    def test_static_file(self):
+        data = os.urandom(300_000)
+        (self.base_dir / 'data.bin').write_bytes(data)
+        server = PreforkServer(self.app_factory, port=0, workers=1)
+        server.load_app()
+        pid = fork(server.serve_forever)
+        server.close()
+
+        host, port = server.server_address
+        try:
+            for headers, status, body in (({}, 200, data),
+                                          ({'Range': 'bytes=10-19'}, 206,
+                                           data[10:20])):
+                connection = HTTPConnection(host, port, timeout=10)
+                connection.request('GET', '/data.bin', headers=headers)
+                response = connection.getresponse()
+                self.assertEqual(response.status, status)
+                self.assertEqual(response.read(), body)
+                connection.close()
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
+    def test_graceful_restart(self):
+        server = PreforkServer(self.app_factory, port=0, workers=2)
+        server.load_app()
+        host, port = server.server_address
+
+        pid = fork(server.serve_forever)
+        server.close()
+
+        def get_worker_pids() -> set[str]:
+            pids = set()
+            for _ in range(10):
+                connection = HTTPConnection(host, port, timeout=10)
+                connection.request('GET', '/')
+                response = connection.getresponse()
+                self.assertEqual(response.status, 200)
+                pids.add(response.read().decode().strip())
+                connection.close()
+            return pids
+
+        try:
+            old_pids = get_worker_pids()
+            os.kill(pid, signal.SIGHUP)
+
+            # Only the new workers are serving once the old ones have exited
+            deadline = monotonic() + 10
+            while get_worker_pids() & old_pids:
+                self.assertLess(monotonic(), deadline)
+                sleep(0.1)
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
+    def test_process_pool(self):
+        server = PreforkServer(
+            partial(create_app, str(self.base_dir),
+                    {'PYHP_RENDER_PROCESSES': 1}),
+            port=0, workers=1)
+        server.load_app()
+        host, port = server.server_address
+        # The supervisor never renders pages, so it does not start the pool
+        # pylint: disable=protected-access
+        pool = server._app.extensions['pyhp'].process_pool
+        self.assertIsNone(pool._executor)
+
+        pid = fork(server.serve_forever)
+        server.close()
+
+        def get() -> int:
+            connection = HTTPConnection(host, port, timeout=30)
+            connection.request('GET', '/')
+            response = connection.getresponse()
+            self.assertEqual(response.status, 200)
+            render_pid = int(response.read())
+            connection.close()
+            return render_pid
+
+        try:
+            # Rendered in a pool started by the worker, not the supervisor
+            self.assertNotIn(get(), (pid, os.getpid()))
+            os.kill(pid, signal.SIGHUP)
+            sleep(0.5)
+            self.assertNotIn(get(), (pid, os.getpid()))
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
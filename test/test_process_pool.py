@@ -0,0 +1,137 @@
+"""
+Tests rendering pages in a pool of worker processes.
+
+TestProcessPool:
+    Tests that pages are rendered in other processes, with the request data,
+    and that their status, cookies, redirects and cache options are returned.
+    Also tests that the pool is replaced if a worker exits or is stuck.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import asyncio
+import os
+from time import monotonic
+from pathlib import PurePath
+
+try:
+    from mocks import TemporaryDirectoryTestCase
+except ImportError:
+    from .mocks import TemporaryDirectoryTestCase
+
+from src.pyhp.process_pool import ProcessPoolRenderer
+from src.pyhp.render_limits import RenderTimeout
+from src.pyhp.pyhp_flask import create_app
+
+
+class TestProcessPool(TemporaryDirectoryTestCase):
+    """
+    Tests that pages are rendered in other processes, with the request data,
+    and that their status, cookies, redirects and cache options are
+    returned. Also tests that the pool is replaced if a worker exits or is
+    stuck.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.write('index.pyhp', '<pyhp>import os\nprint(os.getpid())</pyhp>')
+        self.write('request.pyhp', '<pyhp>\n'
+                                   'pyhp.status_code = 201\n'
+                                   'pyhp.set_cookie("b", value=pyhp.get["a"])\n'
+                                   'print(pyhp.cookies["c"], pyhp.post["d"])\n'
+                                   '</pyhp>')
+        self.write('redirect.pyhp', '<pyhp>pyhp.redirect("/index")</pyhp>')
+        self.write('cached.pyhp', '<pyhp>import os\npyhp.cache(60)\n'
+                                  'print(os.getpid())</pyhp>')
+        self.write('exit.pyhp', '<pyhp>import os\nos._exit(1)</pyhp>')
+        self.write('error.pyhp', '<pyhp>raise ValueError</pyhp>')
+        # Stuck in a call into C, which the worker cannot interrupt
+        self.write('stuck.pyhp', '<pyhp>import time\ntime.sleep(60)</pyhp>')
+
+        self.app = create_app(str(self.base_dir),
+                              {'PYHP_RENDER_PROCESSES': 2,
+                               'PYHP_RENDER_TIMEOUT': 1})
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.app.extensions['pyhp'].process_pool.shutdown()
+        super().tearDown()
+
+    def test_render_in_worker(self):
+        pids = {int(self.client.get('/').data) for _ in range(10)}
+
+        self.assertNotIn(os.getpid(), pids)
+        self.assertLessEqual(len(pids), 2)
+
+    def test_request_data(self):
+        self.client.set_cookie('c', 'cookie')
+        response = self.client.post('/request?a=get', data={'d': 'post'})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, b'cookie post\n')
+        self.assertIn('b=get', response.headers['Set-Cookie'])
+
+    def test_redirect(self):
+        response = self.client.get('/redirect')
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.location, '/index')
+
+    def test_response_cache(self):
+        cache = self.app.extensions['pyhp'].response_cache.backend.cache
+        first = self.client.get('/cached').data
+        hits = cache.hits
+
+        self.assertEqual(self.client.get('/cached').data, first)
+        self.assertGreater(cache.hits, hits)
+
+    def test_worker_exit(self):
+        pool = self.app.extensions['pyhp'].process_pool
+        self.assertIsInstance(pool, ProcessPoolRenderer)
+
+        self.assertEqual(self.client.get('/exit').status_code, 500)
+        self.assertEqual(self.client.get('/error').status_code, 500)
+        self.assertEqual(self.client.get('/').status_code, 200)
+        self.assertEqual(pool.processes, 2)
+
+        # The restarted pool is not forked from the server
+        self.client.set_cookie('c', 'cookie')
+        response = self.client.post('/request?a=get', data={'d': 'post'})
+        self.assertEqual(response.data, b'cookie post\n')
+
+    def test_warm_up(self):
+        pool = self.app.extensions['pyhp'].process_pool
+        self.assertEqual(self.client.get('/exit').status_code, 500)
+
+        # Every process of the restarted pool is started, even though each
+        # of them could have taken more than one of the warm-up calls
+        pool.start()
+        # pylint: disable=protected-access
+        self.assertEqual(len(pool._get_executor()._processes), 2)
+
+    def test_stuck_worker(self):
+        pool = self.app.extensions['pyhp'].process_pool
+        pool_pids = {int(self.client.get('/').data) for _ in range(10)}
+
+        start = monotonic()
+        self.assertEqual(self.client.get('/stuck').status_code, 503)
+        self.assertLess(monotonic() - start, 5)
+
+        # The stuck worker was stopped, and the pool replaced
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(int(response.data), pool_pids)
+        self.assertEqual(pool.processes, 2)
+
+    def test_stuck_worker_async(self):
+        state = self.app.extensions['pyhp']
+        pyhp_class = state.create_pyhp(PurePath(), False, {}, {}, {})
+
+        async def render():
+            with state.limit_render():
+                await state.process_pool.render_async(PurePath('stuck.pyhp'),
+                                                      pyhp_class)
+
+        with self.assertRaises(RenderTimeout):
+            asyncio.run(render())
+        self.assertEqual(self.client.get('/').status_code, 200)
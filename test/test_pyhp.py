@@ -13,13 +13,24 @@ TestPyhpRunParsedCode:
     Tests that the code is correctly run, including cookies, GET, POST.
 TestPyhpFileProcessing:
     Tests that PyHP can load and execute files.
+TestPyhpConcurrency:
+    Tests that pages can be rendered from several threads at once, and that
+    independent includes are rendered concurrently.
 """
 
 # pylint: disable=missing-function-docstring
 
+import asyncio
+import os
+import sys
+from importlib import import_module
 from unittest import TestCase
+from unittest.mock import patch
 from datetime import datetime
-from pathlib import PurePath
+from threading import Thread, Barrier
+from types import ModuleType
+from pathlib import PurePath, Path
+from tempfile import TemporaryDirectory
 
 try:
     from mocks import MockFileProcessor
@@ -32,6 +43,8 @@ from src.pyhp.hypertext_processing import UglySoup
 from src.pyhp.code_execution import run_parsed_code
 from src.pyhp.cookies import NewCookie, DeleteCookie
 from src.pyhp.pyhp_interface import Pyhp
+from src.pyhp.namespaces import NamespaceFactory
+from src.pyhp.file_processing import SystemFileProcessor
 
 
 class TestPyhpRemoveInitialIndentation(TestCase):
@@ -113,6 +126,19 @@ class TestPyhpPrepareContext(TestCase):
         self.assertIs(pyhp_class.globals['pyhp'],
                       pyhp_class)
 
+    def test_preloaded_modules(self):
+        file_processor = MockFileProcessor(
+            '<pyhp>print(j.dumps(os.sep), greet())</pyhp>')
+        factory = NamespaceFactory(['json as j', 'os.path'],
+                                   {'greet': lambda: 'hi'})
+        pyhp_class = Pyhp(PurePath(), file_processor,
+                          namespace_factory=factory)
+
+        self.assertEqual(pyhp_class.run(''), f'"{os.sep}" hi\n')
+        # Each page gets its own copy of the base namespace
+        pyhp_class.globals['greet'] = None
+        self.assertIsNotNone(factory.create()['greet'])
+
 
 class TestPyhpRunParsedCode(TestCase):
     """Tests that the code is correctly run, including cookies, GET, POST."""
@@ -226,7 +252,32 @@ class TestPyhpRunParsedCode(TestCase):
                              case[2])
 
     def test_include(self):
-        pass  # TODO: Finish
+        file_processor = MockFileProcessor({
+            PurePath('foo.html'): '<p>Hello</p>',
+            PurePath('sub/bar.pyhp'): '<pyhp>print(pyhp.current_dir)</pyhp>',
+        })
+        pyhp_class = Pyhp(PurePath(), file_processor)
+
+        self.assertEqual(pyhp_class.include('foo.html'), '<p>Hello</p>')
+        self.assertEqual(pyhp_class.include('sub/bar.pyhp'), 'sub\n')
+
+    def test_repeated_include_loaded_once(self):
+        loaded_paths = []
+
+        class CountingFileProcessor(MockFileProcessor):  # pylint: disable=abstract-method
+            """Records the paths of the files that are loaded."""
+            def get_file_contents(self, path: PurePath) -> str:
+                loaded_paths.append(path)
+                return super().get_file_contents(path)
+
+        file_processor = CountingFileProcessor({
+            PurePath('row.pyhp'): '<pyhp>print(1, end="")</pyhp>',
+        })
+        pyhp_class = Pyhp(PurePath(), file_processor)
+        code = '<pyhp>for _ in range(5):\n    pyhp.display("row.pyhp")</pyhp>'
+
+        self.assertEqual(run_parsed_code(UglySoup(code), pyhp_class), '11111')
+        self.assertEqual(loaded_paths, [PurePath('row.pyhp')])
 
     def test_display(self):
         file_processor = MockFileProcessor({
@@ -300,7 +351,26 @@ class TestPyhpRunParsedCode(TestCase):
             self.assertEqual(pyhp_class.get_redirect_information(), case[1])
 
     def test_import(self):
-        pass  # TODO: Test import
+        with TemporaryDirectory() as base_dir:
+            Path(base_dir, 'pages').mkdir()
+            Path(base_dir, 'pages', 'pyhp_test_module.py').write_text(
+                'VALUE = 1\n', encoding='utf-8')
+            Path(base_dir, 'pages', 'index.pyhp').write_text(
+                '<pyhp>import pyhp_test_module\nprint(pyhp_test_module.VALUE)'
+                '</pyhp>', encoding='utf-8')
+            sys_path = list(sys.path)
+
+            try:
+                pyhp_class = Pyhp(PurePath('pages'),
+                                  SystemFileProcessor(Path(base_dir)))
+                self.assertEqual(pyhp_class.run('index.pyhp'), '1\n')
+            finally:
+                sys.modules.pop('pyhp_test_module', None)
+
+            # Modules next to pages can only be imported by the pages
+            self.assertEqual(sys.path, sys_path)
+            with self.assertRaises(ImportError):
+                import_module('pyhp_test_module')
 
     def test_special_characters(self):
         cases = [
@@ -353,6 +423,79 @@ class TestPyhpFileProcessing(TestCase):
                 file_processor.get_true_path(PurePath(case[0]))
 
 
+class TestPyhpConcurrency(TestCase):
+    """
+    Tests that pages can be rendered from several threads at once, and that
+    independent includes are rendered concurrently.
+    """
+
+    def test_concurrent_output(self):
+        code = "<pyhp>print(pyhp.get['id'])\n" \
+               "pyhp.get['barrier'].wait()\n" \
+               "print(pyhp.get['id'])</pyhp>"
+        thread_count = 8
+        barrier = Barrier(thread_count)
+        outputs = {}
+
+        def render(thread_id: str):
+            pyhp_class = Pyhp(PurePath(), MockFileProcessor(code),
+                              get={'id': thread_id, 'barrier': barrier})
+            outputs[thread_id] = pyhp_class.run('index.pyhp')
+
+        threads = [Thread(target=render, args=(str(i),))
+                   for i in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for thread_id, output in outputs.items():
+            self.assertEqual(output, f'{thread_id}\n{thread_id}\n')
+        self.assertEqual(len(outputs), thread_count)
+
+    def test_include_many(self):
+        file_processor = MockFileProcessor({
+            PurePath(f'{i}.pyhp'): f'<pyhp>print({i}, end="")</pyhp>'
+            for i in range(5)
+        })
+        pyhp_class = Pyhp(PurePath(), file_processor)
+        paths = [f'{i}.pyhp' for i in range(5)]
+
+        self.assertEqual(pyhp_class.include_many(paths),
+                         ['0', '1', '2', '3', '4'])
+        self.assertEqual(asyncio.run(pyhp_class.include_many_async(paths)),
+                         ['0', '1', '2', '3', '4'])
+        self.assertEqual(pyhp_class.include_many([]), [])
+
+    def test_include_many_concurrent(self):
+        # Each include waits until all of them are running, which fails (once
+        # the barrier times out) unless they run at the same time
+        module = ModuleType('pyhp_test_barrier')
+        module.barrier = Barrier(5, timeout=10)
+        file_processor = MockFileProcessor({
+            PurePath('wait.pyhp'): '<pyhp>import pyhp_test_barrier\n'
+                                   'pyhp_test_barrier.barrier.wait()\n'
+                                   'print("done", end="")</pyhp>',
+        })
+        pyhp_class = Pyhp(PurePath(), file_processor)
+
+        with patch.dict(sys.modules, {'pyhp_test_barrier': module}):
+            outputs = pyhp_class.include_many(['wait.pyhp'] * 5)
+
+        self.assertEqual(outputs, ['done'] * 5)
+
+    def test_nested_include_many(self):
+        file_processor = MockFileProcessor({
+            PurePath('outer.pyhp'): '<pyhp>print(*pyhp.include_many('
+                                    '["inner.pyhp"] * 3), end="")</pyhp>',
+            PurePath('inner.pyhp'): '<pyhp>print("x", end="")</pyhp>',
+        })
+        pyhp_class = Pyhp(PurePath(), file_processor)
+
+        self.assertEqual(pyhp_class.include_many(['outer.pyhp'] * 3),
+                         ['x x x'] * 3)
+
+
 def create_file_processor_and_run_code(case: str):
     file_processor = MockFileProcessor(case)
     pyhp_class = Pyhp(PurePath(), file_processor)
@@ -0,0 +1,156 @@
+"""
+Tests PyHP when run as an ASGI app.
+
+TestASGIApp:
+    Tests that requests are handled in the same way as the Flask app.
+TestAsyncPages:
+    Tests that code blocks can use await, and are run concurrently.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import asyncio
+from time import perf_counter
+from typing import Any
+
+try:
+    from mocks import TemporaryDirectoryTestCase
+except ImportError:
+    from .mocks import TemporaryDirectoryTestCase
+
+from src.pyhp.pyhp_asgi import create_asgi_app
+from src.pyhp.pyhp_flask import create_app
+
+
+async def request(app, path: str = '/', method: str = 'GET', *,  # pylint: disable=too-many-arguments
+                  query_string: bytes = b'',
+                  headers: list[tuple[bytes, bytes]] = (),
+                  body: bytes = b'') -> dict[str, Any]:
+    """Send a request to the app, and return the status, headers and body."""
+    scope = {'type': 'http', 'method': method, 'path': path,
+             'query_string': query_string, 'headers': list(headers)}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+
+    return {
+        'status': messages[0]['status'],
+        'headers': [(name.decode(), value.decode())
+                    for name, value in messages[0]['headers']],
+        'body': messages[1]['body'],
+    }
+
+
+class TestASGIApp(TemporaryDirectoryTestCase):
+    """Tests that requests are handled in the same way as the Flask app."""
+
+    def get(self, path: str = '/', **kwargs) -> dict[str, Any]:
+        app = create_asgi_app(str(self.base_dir), {'DEBUG': True})
+        return asyncio.run(request(app, path, **kwargs))
+
+    def test_page(self):
+        self.write('index.pyhp', '<p><pyhp>print(pyhp.get["foo"], '
+                                 'pyhp.cookies["bar"])</pyhp></p>')
+
+        response = self.get(query_string=b'foo=1',
+                            headers=[(b'cookie', b'bar=2')])
+
+        self.assertEqual(response['status'], 200)
+        self.assertEqual(response['body'], b'<p>1 2\n</p>')
+        self.assertIn(('content-type', 'text/html; charset=utf-8'),
+                      response['headers'])
+
+    def test_post(self):
+        self.write('form.pyhp', '<pyhp>print(pyhp.post["foo"])</pyhp>')
+
+        response = self.get(
+            '/form', method='POST', body=b'foo=h%C3%A9llo',
+            headers=[(b'content-type', b'application/x-www-form-urlencoded')])
+
+        self.assertEqual(response['body'], 'héllo\n'.encode('utf-8'))
+
+    def test_cookies_and_redirects(self):
+        self.write('index.pyhp', '<pyhp>pyhp.set_cookie("foo", value="bar")\n'
+                                 'pyhp.delete_cookie("baz")</pyhp>')
+        self.write('redirect.pyhp', '<pyhp>pyhp.redirect("/foo", 301)</pyhp>')
+
+        cookies = [value for name, value in self.get()['headers']
+                   if name == 'set-cookie']
+        self.assertTrue(cookies[0].startswith('foo=bar'))
+        self.assertTrue(cookies[1].startswith('baz=;'))
+
+        response = self.get('/redirect')
+        self.assertEqual(response['status'], 301)
+        self.assertIn(('location', '/foo'), response['headers'])
+
+    def test_static_files_and_missing_files(self):
+        (self.base_dir / 'sub').mkdir()
+        self.write('style.css', 'p {}')
+
+        response = self.get('/style.css')
+        self.assertEqual(response['body'], b'p {}')
+        self.assertIn(('content-type', 'text/css; charset=utf-8'),
+                      response['headers'])
+
+        self.assertEqual(self.get('/missing')['status'], 404)
+        self.assertIn(('location', '/sub/'), self.get('/sub')['headers'])
+
+    def test_error(self):
+        # Cannot be loaded, which is an error outside of any code block
+        (self.base_dir / 'index.pyhp').write_bytes(b'\xff<p>Hello</p>')
+
+        with self.assertLogs('src.pyhp.pyhp_asgi'):
+            response = self.get()
+        self.assertEqual(response['status'], 500)
+        self.assertIn(b'UnicodeDecodeError', response['body'])
+
+
+class TestAsyncPages(TemporaryDirectoryTestCase):
+    """Tests that code blocks can use await, and are run concurrently."""
+
+    def test_await(self):
+        self.write('index.pyhp', '<pyhp>import asyncio\n'
+                                 'await asyncio.sleep(0)\nprint(1)</pyhp>'
+                                 '<pyhp>print(await pyhp.include_async('
+                                 '"other.pyhp"), end="")</pyhp>')
+        self.write('other.pyhp', '<pyhp>import asyncio\n'
+                                 'await asyncio.sleep(0)\nprint(2)</pyhp>')
+        app = create_asgi_app(str(self.base_dir))
+
+        self.assertEqual(asyncio.run(request(app))['body'], b'1\n2\n')
+
+    def test_concurrent(self):
+        self.write('index.pyhp', '<pyhp>import asyncio\n'
+                                 'await asyncio.sleep(0.2)\n'
+                                 'print(pyhp.get["id"])</pyhp>')
+        app = create_asgi_app(str(self.base_dir))
+
+        async def request_all():
+            return await asyncio.gather(*(
+                request(app, query_string=f'id={i}'.encode())
+                for i in range(50)))
+
+        start = perf_counter()
+        responses = asyncio.run(request_all())
+
+        self.assertLess(perf_counter() - start, 2)
+        self.assertEqual([response['body'] for response in responses],
+                         [f'{i}\n'.encode() for i in range(50)])
+
+    def test_await_requires_async_rendering(self):
+        self.write('index.pyhp', '<pyhp>import asyncio\n'
+                                 'await asyncio.sleep(0)</pyhp>')
+        app = create_asgi_app(str(self.base_dir), {'DEBUG': True})
+
+        # The Flask app and Pyhp.run are synchronous
+        body = create_app(str(self.base_dir),
+                          {'DEBUG': True}).test_client().get('/').data
+
+        self.assertIn(b'can only be run asynchronously', body)
+        self.assertEqual(asyncio.run(request(app))['body'], b'')
@@ -3,11 +3,29 @@ Tests PyHP when connected to a flask server.
 
 TestFileSecurity:
     Tests that the file security is correctly enforced.
+TestStreaming:
+    Tests that large pages are streamed.
+TestResponseCache:
+    Tests that pages which declare themselves cacheable are cached.
+TestIncludePool:
+    Tests that each app renders includes on its own thread pool.
 """
 
 # pylint: disable=missing-function-docstring
 
+from functools import partial
 from unittest import TestCase
+from tempfile import TemporaryDirectory
+from pathlib import Path
+
+try:
+    from mocks import TemporaryDirectoryTestCase
+except ImportError:
+    from .mocks import TemporaryDirectoryTestCase
+
+from src.pyhp.cache_backends import SQLiteCacheBackend
+from src.pyhp.precompilation import compile_directory
+from src.pyhp.pyhp_flask import create_app
 
 
 class TestFileSecurity(TestCase):
@@ -17,3 +35,141 @@ class TestFileSecurity(TestCase):
 
     def test_disallow_absolute_path_access(self):
         pass  # TODO: Finish
+
+    def test_disallow_compiled_file_access(self):
+        with TemporaryDirectory() as base_dir:
+            Path(base_dir, 'index.pyhp').write_text('<pyhp>print(1)</pyhp>',
+                                                    encoding='utf-8')
+            compile_directory(Path(base_dir))
+
+            client = create_app(base_dir).test_client()
+
+            self.assertEqual(client.get('/').data, b'1\n')
+            self.assertEqual(
+                client.get('/__pyhpcache__/index.pyhp.pyhpc').status_code,
+                404)
+
+
+class TestStreaming(TemporaryDirectoryTestCase):
+    """Tests that large pages are streamed."""
+
+    def get(self, code: str, path: str = '/', memory_map_files: bool = False):
+        self.write('index.pyhp', code)
+        app = create_app(str(self.base_dir),
+                         {'PYHP_STREAM_BUFFER_SIZE': 10,
+                          'PYHP_MEMORY_MAP_FILES': memory_map_files})
+        return app.test_client().get(path)
+
+    def test_large_page_streamed(self):
+        response = self.get('<p>Hello World</p><pyhp>print(1)</pyhp><p>!</p>')
+
+        self.assertIsNone(response.content_length)
+        self.assertEqual(response.data, b'<p>Hello World</p>1\n<p>!</p>')
+
+    def test_memory_mapped_page_streamed(self):
+        response = self.get('<p>H\u00e9llo World</p><pyhp>print("\u00e9")'
+                            '</pyhp><p>!</p>', memory_map_files=True)
+
+        self.assertIsNone(response.content_length)
+        self.assertEqual(response.data.decode('utf-8'),
+                         '<p>H\u00e9llo World</p>\u00e9\n<p>!</p>')
+
+        response = self.get('<p>\u00e9</p>', memory_map_files=True)
+
+        self.assertEqual(response.data.decode('utf-8'), '<p>\u00e9</p>')
+
+    def test_small_page_not_streamed(self):
+        response = self.get('<p>Hi</p>')
+
+        self.assertIsNotNone(response.content_length)
+        self.assertEqual(response.data, b'<p>Hi</p>')
+
+    def test_cookies_and_redirects_not_streamed(self):
+        response = self.get('<pyhp>pyhp.set_cookie("foo", value="bar")'
+                            '</pyhp><p>Hello World</p><p>!</p>')
+
+        self.assertIsNotNone(response.content_length)
+        self.assertIn('foo=bar', response.headers['Set-Cookie'])
+
+        response = self.get('<pyhp>pyhp.redirect("/foo")</pyhp>'
+                            '<p>Hello World</p>')
+
+        self.assertEqual(response.status_code, 302)
+
+
+class TestResponseCache(TemporaryDirectoryTestCase):
+    """Tests that pages which declare themselves cacheable are cached."""
+
+    def setUp(self):
+        super().setUp()
+        # Each render prints a new number, so cached renders can be spotted
+        self.write('index.pyhp',
+                   '<pyhp>pyhp.cache(60, ["get:page", "cookie:lang"])\n'
+                   'pyhp.set_cookie("seen", value="yes")\n'
+                   'COUNTER.append(1)\nprint(len(COUNTER))</pyhp>')
+        self.client = create_app(
+            str(self.base_dir),
+            {'PYHP_HELPERS': {'COUNTER': []}}).test_client()
+
+    def test_cached(self):
+        first = self.client.get('/?page=1')
+        second = self.client.get('/?page=1')
+
+        self.assertEqual(first.data, b'1\n')
+        self.assertEqual(second.data, b'1\n')
+        self.assertIn('seen=yes', second.headers['Set-Cookie'])
+
+    def test_varies(self):
+        self.assertEqual(self.client.get('/?page=1').data, b'1\n')
+        self.assertEqual(self.client.get('/?page=2').data, b'2\n')
+        self.client.set_cookie('lang', 'en')
+        self.assertEqual(self.client.get('/?page=1').data, b'3\n')
+        # Other parameters are ignored
+        self.assertEqual(self.client.get('/?page=1&foo=bar').data, b'3\n')
+
+    def test_post_not_cached(self):
+        self.assertEqual(self.client.post('/').data, b'1\n')
+        self.assertEqual(self.client.post('/').data, b'2\n')
+
+    def test_shared_between_apps(self):
+        config = {
+            'PYHP_HELPERS': {'COUNTER': []},
+            'PYHP_CACHE_BACKEND': partial(SQLiteCacheBackend,
+                                          self.base_dir / 'cache.db'),
+        }
+        first = create_app(str(self.base_dir), config).test_client()
+        second = create_app(str(self.base_dir), config).test_client()
+
+        self.assertEqual(first.get('/?page=1').data, b'1\n')
+        self.assertEqual(second.get('/?page=1').data, b'1\n')
+        self.assertEqual(second.get('/?page=2').data, b'2\n')
+
+    def test_invalid_vary_on(self):
+        self.write('index.pyhp', '<pyhp>pyhp.cache(60, ["header:foo"])</pyhp>')
+        client = create_app(str(self.base_dir),
+                            {'DEBUG': True}).test_client()
+
+        self.assertIn(b'ValueError', client.get('/').data)
+
+
+class TestIncludePool(TemporaryDirectoryTestCase):
+    """Tests that each app renders includes on its own thread pool."""
+
+    def test_pool_per_app(self):
+        self.write('index.pyhp',
+                   '<pyhp>print(*pyhp.include_many(["a.pyhp"] * 3))</pyhp>')
+        self.write('a.pyhp', 'a')
+        first = create_app(str(self.base_dir), {'PYHP_INCLUDE_MAX_WORKERS': 1})
+        second = create_app(str(self.base_dir))
+
+        self.assertEqual(first.test_client().get('/').data, b'a a a\n')
+        first_pool = first.extensions['pyhp'].include_pool
+        second_pool = second.extensions['pyhp'].include_pool
+        self.assertIsNot(first_pool, second_pool)
+        self.assertEqual(first_pool.max_workers, 1)
+
+        # Shutting one app's pool down leaves the other's running
+        executor = second_pool.get_executor()
+        first_pool.shutdown()
+        self.assertIs(second_pool.get_executor(), executor)
+        self.assertEqual(first.test_client().get('/').data, b'a a a\n')
@@ -0,0 +1,201 @@
+"""
+Tests the limits on each render.
+
+TestRenderLimits:
+    Tests that renders exceeding the timeout, CPU time, output or memory
+    limit are stopped (even once they are streaming, or have awaited), and
+    that the error is not raised after the render.
+TestLimitedResponses:
+    Tests that pages exceeding a limit get an error response and are
+    counted, without affecting the following requests.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import asyncio
+from unittest import TestCase
+from pathlib import PurePath
+from time import monotonic
+
+try:
+    from mocks import MockFileProcessor, TemporaryDirectoryTestCase
+except ImportError:
+    from .mocks import MockFileProcessor, TemporaryDirectoryTestCase
+
+from src.pyhp.render_limits import RenderLimits, RenderTimeout, \
+    CPUTimeExceeded, OutputLimitExceeded, MemoryLimitExceeded, \
+    await_interruptibly, limit_render, limit_stream
+from src.pyhp.pyhp_interface import Pyhp
+from src.pyhp.pyhp_asgi import create_asgi_app
+from src.pyhp.pyhp_flask import create_app
+
+
+LOOP = '<pyhp>\nwhile True:\n    try:\n        pass\n' \
+       '    except Exception:\n        pass\n</pyhp>'
+
+
+class TestRenderLimits(TestCase):
+    """
+    Tests that renders exceeding the timeout, CPU time, output or memory
+    limit are stopped (even once they are streaming, or have awaited), and
+    that the error is not raised after the render.
+    """
+
+    def setUp(self):
+        self.pyhp_class = Pyhp(PurePath(), MockFileProcessor({
+            PurePath('loop.pyhp'): LOOP,
+            PurePath('include.pyhp'): '<pyhp>pyhp.display("loop.pyhp")'
+                                      '</pyhp>',
+            PurePath('streamed.pyhp'): '<p>Hello</p>' + LOOP,
+            PurePath('large.pyhp'): '<pyhp>print("x" * 1000)</pyhp>',
+            PurePath('memory.pyhp'): '<pyhp>data = bytearray(10**7)</pyhp>',
+        }))
+
+    def assert_stopped(self, limits: RenderLimits, path: str,
+                       error: type[BaseException]):
+        start = monotonic()
+
+        with self.assertRaises(error):
+            with limit_render(limits):
+                list(self.pyhp_class.stream(path))
+
+        self.assertLess(monotonic() - start, 5)
+
+    def test_timeout(self):
+        self.assert_stopped(RenderLimits(timeout=0.1), 'loop.pyhp',
+                            RenderTimeout)
+        self.assert_stopped(RenderLimits(timeout=0.1), 'include.pyhp',
+                            RenderTimeout)
+
+    def test_cpu_time(self):
+        self.assert_stopped(RenderLimits(cpu_time=0.1), 'loop.pyhp',
+                            CPUTimeExceeded)
+
+    def test_output(self):
+        self.assert_stopped(RenderLimits(max_output_bytes=500), 'large.pyhp',
+                            OutputLimitExceeded)
+
+        with limit_render(RenderLimits(max_output_bytes=5000)) as budget:
+            list(self.pyhp_class.stream('large.pyhp'))
+        self.assertEqual(budget.output_size, 1001)
+
+    def test_memory(self):
+        self.assert_stopped(RenderLimits(max_memory=10**6), 'memory.pyhp',
+                            MemoryLimitExceeded)
+
+    def test_limit_stream(self):
+        with limit_render(RenderLimits(timeout=0.1)) as budget:
+            chunks = self.pyhp_class.stream('streamed.pyhp')
+            first = next(chunks)
+
+        # The rest of the page is rendered once limit_render has exited
+        errors = []
+        rest = list(limit_stream(chunks, budget, errors.append))
+
+        self.assertEqual(first, '<p>Hello</p>')
+        self.assertEqual(rest, [])
+        self.assertEqual([type(error) for error in errors], [RenderTimeout])
+
+    def test_await_interruptibly(self):
+        async def block():
+            await asyncio.sleep(0)
+            # Runs without awaiting again
+            while True:
+                pass
+
+        async def render():
+            with limit_render(RenderLimits(timeout=0.1)):
+                await await_interruptibly(block())
+
+        with self.assertRaises(RenderTimeout):
+            asyncio.run(render())
+
+    def test_not_raised_after_render(self):
+        with self.assertRaises(RenderTimeout):
+            with limit_render(RenderLimits(timeout=0.05)):
+                self.pyhp_class.run('loop.pyhp')
+
+        # Any error left pending by the watchdog would be raised here
+        deadline = monotonic() + 0.1
+        while monotonic() < deadline:
+            pass
+
+
+class TestLimitedResponses(TemporaryDirectoryTestCase):
+    """
+    Tests that pages exceeding a limit get an error response and are
+    counted, without affecting the following requests.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.write('loop.pyhp', LOOP)
+        self.write('index.pyhp', '<p>Hello</p>')
+        self.write('large.pyhp', '<pyhp>print("x" * 1000)</pyhp>')
+
+    def test_timeout(self):
+        client = create_app(str(self.base_dir),
+                            {'PYHP_RENDER_TIMEOUT': 0.1,
+                             'PYHP_METRICS_PATH': '/metrics'}).test_client()
+
+        self.assertEqual(client.get('/loop').status_code, 503)
+        self.assertEqual(client.get('/').status_code, 200)
+        self.assertIn('pyhp_render_limits_exceeded_total{limit="timeout"} 1',
+                      client.get('/metrics').get_data(as_text=True))
+
+    def test_streamed_timeout(self):
+        self.write('streamed.pyhp', '<p>' + 'x' * 100 + '</p>' + LOOP)
+        client = create_app(str(self.base_dir),
+                            {'PYHP_RENDER_TIMEOUT': 0.1,
+                             'PYHP_STREAM_BUFFER_SIZE': 10,
+                             'PYHP_METRICS_PATH': '/metrics'}).test_client()
+
+        response = client.get('/streamed')
+
+        # The status was sent before the loop started, so the page just ends
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(), b'<p>' + b'x' * 100 + b'</p>')
+        self.assertIn('pyhp_render_limits_exceeded_total{limit="timeout"} 1',
+                      client.get('/metrics').get_data(as_text=True))
+        self.assertEqual(client.get('/').status_code, 200)
+
+    def test_output(self):
+        client = create_app(str(self.base_dir),
+                            {'PYHP_MAX_OUTPUT_BYTES': 500,
+                             'DEBUG': True}).test_client()
+
+        response = client.get('/large')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.data, OutputLimitExceeded.message.encode())
+        self.assertEqual(client.get('/').status_code, 200)
+
+    def test_asgi_timeout(self):
+        app = create_asgi_app(str(self.base_dir),
+                              {'PYHP_RENDER_TIMEOUT': 0.1})
+        self.write('sleep.pyhp', '<pyhp>import asyncio\n'
+                                 'await asyncio.sleep(10)</pyhp>')
+        # Runs without awaiting again, once it has awaited
+        self.write('await_loop.pyhp', '<pyhp>import asyncio\n'
+                                      'await asyncio.sleep(0)\n'
+                                      'while True:\n    pass</pyhp>')
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request'}
+
+        async def send(message):
+            messages.append(message)
+
+        for path in ('/sleep', '/loop', '/await_loop'):
+            messages.clear()
+            asyncio.run(app({'type': 'http', 'method': 'GET', 'path': path,
+                             'query_string': b'', 'headers': []},
+                            receive, send))
+            self.assertEqual(messages[0]['status'], 503)
+
+    def test_asgi_cpu_time(self):
+        # Every page shares the event loop's thread, so the CPU time can
+        # only be limited in worker processes
+        with self.assertRaises(ValueError):
+            create_asgi_app(str(self.base_dir), {'PYHP_RENDER_CPU_TIME': 1})
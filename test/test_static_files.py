@@ -0,0 +1,153 @@
+"""
+Tests the serving of files that are not PyHP files.
+
+TestStaticFile:
+    Tests that a file's size, validators and content type are read from its
+    cached stat result, and refreshed when it is opened.
+TestStaticFiles:
+    Tests that static files are sent with validators, without setting up a
+    page, and that conditional and range requests are answered.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import asyncio
+from datetime import datetime, timezone
+from pathlib import PurePath
+from unittest.mock import patch
+
+try:
+    from mocks import TemporaryDirectoryTestCase
+except ImportError:
+    from .mocks import TemporaryDirectoryTestCase
+
+from src.pyhp.app_setup import AppState
+from src.pyhp.file_processing import SystemFileProcessor
+from src.pyhp.pyhp_asgi import create_asgi_app
+from src.pyhp.pyhp_flask import create_app
+from src.pyhp.static_files import get_content_type, get_static_file, \
+    open_static_file
+
+
+class TestStaticFile(TemporaryDirectoryTestCase):
+    """
+    Tests that a file's size, validators and content type are read from
+    its cached stat result, and refreshed when it is opened.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.write('style.css', 'body { color: red; }')
+        self.file_processor = SystemFileProcessor(self.base_dir)
+
+    def test_get_static_file(self):
+        static_file = get_static_file(self.file_processor,
+                                      PurePath('style.css'))
+
+        self.assertEqual(static_file.path, self.base_dir / 'style.css')
+        self.assertEqual(static_file.size, 20)
+        self.assertEqual(static_file.last_modified,
+                         datetime(1970, 1, 1, 0, 0, 1, tzinfo=timezone.utc))
+        self.assertEqual(static_file.etag, f'{10**9:x}-14')
+        self.assertEqual(static_file.content_type, 'text/css; charset=utf-8')
+
+        with self.assertRaises(FileNotFoundError):
+            get_static_file(self.file_processor, PurePath('missing.css'))
+
+    def test_open_static_file(self):
+        static_file = get_static_file(self.file_processor,
+                                      PurePath('style.css'))
+        # Changed since its stat result was cached
+        self.write('style.css', 'p {}', 2 * 10**9)
+
+        file, opened_file = open_static_file(static_file)
+        with file:
+            self.assertEqual(file.read(), b'p {}')
+
+        self.assertEqual(opened_file.size, 4)
+        self.assertNotEqual(opened_file.etag, static_file.etag)
+
+    def test_content_type(self):
+        self.assertEqual(get_content_type('snake.jpg'), 'image/jpeg')
+        self.assertEqual(get_content_type('README'),
+                         'application/octet-stream')
+
+
+class TestStaticFiles(TemporaryDirectoryTestCase):
+    """
+    Tests that static files are sent with validators, without setting up a
+    page, and that conditional and range requests are answered.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.write('style.css', 'body { color: red; }')
+        self.client = create_app(str(self.base_dir)).test_client()
+
+    def test_send(self):
+        with patch.object(AppState, 'create_pyhp') as create_pyhp:
+            response = self.client.get('/style.css')
+
+        create_pyhp.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'body { color: red; }')
+        self.assertEqual(response.content_type, 'text/css; charset=utf-8')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(response.headers['Last-Modified'],
+                         'Thu, 01 Jan 1970 00:00:01 GMT')
+        self.assertIsNotNone(response.get_etag()[0])
+        response.close()
+
+    def test_conditional(self):
+        response = self.client.get('/style.css')
+        etag = response.headers['ETag']
+        response.close()
+
+        for headers in ({'If-None-Match': etag},
+                        {'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:01 GMT'}):
+            response = self.client.get('/style.css', headers=headers)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+            self.assertEqual(response.headers['ETag'], etag)
+
+        response = self.client.get('/style.css',
+                                   headers={'If-None-Match': '"other"'})
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    def test_range(self):
+        response = self.client.get('/style.css', headers={'Range': 'bytes=7-11'})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, b'color')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 7-11/20')
+        response.close()
+
+        self.assertEqual(
+            self.client.get('/style.css',
+                            headers={'Range': 'bytes=50-60'}).status_code,
+            416)
+
+    def test_asgi(self):
+        app = create_asgi_app(str(self.base_dir))
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        async def receive():
+            return {'type': 'http.request'}
+
+        def get(headers: list[tuple[bytes, bytes]]) -> dict[bytes, bytes]:
+            messages.clear()
+            asyncio.run(app({'type': 'http', 'method': 'GET',
+                             'path': '/style.css', 'query_string': b'',
+                             'headers': headers}, receive, send))
+            return messages[0]
+
+        start = get([])
+        self.assertEqual(start['status'], 200)
+        self.assertEqual(messages[1]['body'], b'body { color: red; }')
+
+        etag = dict(start['headers'])[b'etag']
+        self.assertEqual(get([(b'if-none-match', etag)])['status'], 304)
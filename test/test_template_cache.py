@@ -0,0 +1,126 @@
+"""
+Tests the LRU cache and the compiled template cache.
+
+TestLRUCache:
+    Tests that entries are stored and evicted in least-recently-used order.
+TestTemplateCache:
+    Tests that templates are compiled once and invalidated when they change.
+"""
+
+# pylint: disable=missing-function-docstring
+
+from unittest import TestCase
+from pathlib import PurePath
+
+try:
+    from mocks import MockFileProcessor, TemporaryDirectoryTestCase
+except ImportError:
+    from .mocks import MockFileProcessor, TemporaryDirectoryTestCase
+
+from src.pyhp.caching import LRUCache
+from src.pyhp.file_processing import SystemFileProcessor
+from src.pyhp.template_cache import TemplateCache
+from src.pyhp.pyhp_interface import Pyhp
+
+
+class TestLRUCache(TestCase):
+    """Tests that entries are stored and evicted in LRU order."""
+
+    def test_get_and_set(self):
+        cache = LRUCache(10)
+        cache.set('foo', 1)
+
+        self.assertEqual(cache.get('foo'), 1)
+        self.assertIsNone(cache.get('bar'))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_eviction_order(self):
+        cache = LRUCache(2)
+        cache.set('foo', 1)
+        cache.set('bar', 2)
+        cache.get('foo')
+        cache.set('baz', 3)
+
+        self.assertIn('foo', cache)
+        self.assertNotIn('bar', cache)
+        self.assertIn('baz', cache)
+
+    def test_size_limit(self):
+        cache = LRUCache(10)
+        cache.set('foo', 1, 6)
+        cache.set('bar', 2, 6)
+        cache.set('baz', 3, 11)
+
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.total_size, 6)
+        self.assertNotIn('baz', cache)
+
+
+class TestTemplateCache(TemporaryDirectoryTestCase):
+    """Tests that templates are compiled once and invalidated on change."""
+
+    def setUp(self):
+        super().setUp()
+        self.file_processor = SystemFileProcessor(self.base_dir)
+
+    def test_compiled_once(self):
+        self.write('index.pyhp', '<p><pyhp>print(1)</pyhp></p>', 10**9)
+        cache = TemplateCache()
+
+        first = cache.get_template(self.file_processor, PurePath('index.pyhp'))
+        second = cache.get_template(self.file_processor, PurePath('index.pyhp'))
+
+        self.assertIs(first, second)
+        self.assertIsNotNone(first.sections[1].code)
+        self.assertEqual(first.sections[1].code.co_filename,
+                         str(self.base_dir / 'index.pyhp'))
+
+    def test_invalidated_on_change(self):
+        self.write('index.pyhp', '<pyhp>print(1)</pyhp>', 10**9)
+        cache = TemplateCache()
+        pyhp_class = Pyhp(PurePath(), self.file_processor,
+                          template_cache=cache)
+        self.assertEqual(pyhp_class.run('index.pyhp'), '1\n')
+
+        self.write('index.pyhp', '<pyhp>print(22)</pyhp>', 2 * 10**9)
+        self.file_processor.invalidate()
+        pyhp_class = Pyhp(PurePath(), self.file_processor,
+                          template_cache=cache)
+        self.assertEqual(pyhp_class.run('index.pyhp'), '22\n')
+
+    def test_syntax_error_reported_at_run_time(self):
+        self.write('index.pyhp', 'a<pyhp>x = </pyhp>b', 10**9)
+        cache = TemplateCache()
+        pyhp_class = Pyhp(PurePath(), self.file_processor, debug=True,
+                          template_cache=cache)
+
+        output = pyhp_class.run('index.pyhp')
+
+        self.assertTrue(output.startswith('a'))
+        self.assertIn('SyntaxError', output)
+
+    def test_traceback_line_numbers(self):
+        self.write('index.pyhp', '<p>\n</p>\n<pyhp>\n    x = 1\n    y = x / 0\n</pyhp>')
+        pyhp_class = Pyhp(PurePath(), self.file_processor, debug=True,
+                          template_cache=TemplateCache())
+
+        self.assertIn(f'File "{self.base_dir / "index.pyhp"}", line 5',
+                      pyhp_class.run('index.pyhp'))
+
+    def test_memory_cap(self):
+        self.write('a.pyhp', 'a' * 100, 10**9)
+        self.write('b.pyhp', 'b' * 100, 10**9)
+        cache = TemplateCache(150)
+
+        cache.get_template(self.file_processor, PurePath('a.pyhp'))
+        cache.get_template(self.file_processor, PurePath('b.pyhp'))
+
+        self.assertEqual(len(cache.cache), 1)
+
+    def test_uncacheable_files(self):
+        cache = TemplateCache()
+        file_processor = MockFileProcessor('<pyhp>print(1)</pyhp>')
+
+        cache.get_template(file_processor, PurePath('index.pyhp'))
+
+        self.assertEqual(len(cache.cache), 0)
@@ -4,6 +4,7 @@ Tests the UglySoup HTML/PyHP parser.
 
 # pylint: disable=missing-function-docstring
 
+from io import BytesIO, StringIO
 from unittest import TestCase
 
 from src.pyhp.hypertext_processing import UglySoup, Section
@@ -45,3 +46,91 @@ class TestUglySoup(TestCase):
         for html, expected_sections in cases:
             with self.subTest(html=html):
                 self.assertEqual(UglySoup(html).sections, expected_sections)
+
+    def test_strings_containing_close_tag(self):
+        cases = [
+            ('<pyhp>print("</pyhp>")</pyhp>', [Section(True, 'print("</pyhp>")')]),
+            ("<pyhp>print('</pyhp>', end='')</pyhp>!",
+             [Section(True, "print('</pyhp>', end='')"), Section(False, '!')]),
+            ('<pyhp>x = """\n</pyhp>\n"""</pyhp>', [Section(True, 'x = """\n</pyhp>\n"""')]),
+            ("<pyhp>x = '\\'</pyhp>'</pyhp>", [Section(True, "x = '\\'</pyhp>'")]),
+            ("<pyhp>x = 'a\\\n</pyhp>'</pyhp>", [Section(True, "x = 'a\\\n</pyhp>'")]),
+            ('<pyhp>x = 1\ny = "</pyhp>"</pyhp>', [Section(True, 'x = 1\ny = "</pyhp>"')]),
+        ]
+
+        for html, expected_sections in cases:
+            with self.subTest(html=html):
+                self.assertEqual(UglySoup(html).sections, expected_sections)
+
+    def test_comments(self):
+        cases = [
+            ("<pyhp>x = 1  # don't\ny = 2</pyhp>", [Section(True, "x = 1  # don't\ny = 2")]),
+            ('<pyhp>x = 1  # end </pyhp>a', [Section(True, 'x = 1  # end '), Section(False, 'a')]),
+            ("<pyhp>x = 1\n# it's </pyhp>a",
+             [Section(True, "x = 1\n# it's "), Section(False, 'a')]),
+        ]
+
+        for html, expected_sections in cases:
+            with self.subTest(html=html):
+                self.assertEqual(UglySoup(html).sections, expected_sections)
+
+    def test_unterminated(self):
+        cases = [
+            ('<pyhp>print(1)', [Section(False, '<pyhp>print(1)')]),
+            ('<pyhp>print("</pyhp>)', [Section(True, 'print("'), Section(False, ')')]),
+            ('<pyhp>print(1)</pyhp>a<pyhp>b',
+             [Section(True, 'print(1)'), Section(False, 'a<pyhp>b')]),
+        ]
+
+        for html, expected_sections in cases:
+            with self.subTest(html=html):
+                self.assertEqual(UglySoup(html).sections, expected_sections)
+
+    def test_bytes(self):
+        html = '<p>h\u00e9llo</p><pyhp>print("w\u00f6rld")</pyhp>'
+        expected_sections = [Section(False, '<p>h\u00e9llo</p>'),
+                             Section(True, 'print("w\u00f6rld")')]
+
+        for source in (html.encode('utf-8'), memoryview(html.encode('utf-8'))):
+            with self.subTest(source=source):
+                self.assertEqual(UglySoup(source).sections, expected_sections)
+
+    def test_streams(self):
+        html = '<p>h\u00e9llo</p><pyhp>print(1)</pyhp>'
+        expected_sections = [Section(False, '<p>h\u00e9llo</p>'),
+                             Section(True, 'print(1)')]
+
+        for stream in (StringIO(html), BytesIO(html.encode('utf-8'))):
+            with self.subTest(stream=stream):
+                self.assertEqual(UglySoup(stream).sections, expected_sections)
+
+    def test_offsets_and_lines(self):
+        html = '<p>\n</p>\n<pyhp>\nx = 1\n</pyhp>\n<p></p>'
+        sections = UglySoup(html).sections
+
+        self.assertEqual([(section.start, section.end) for section in sections],
+                         [(0, 9), (15, 22), (29, 37)])
+        self.assertEqual([section.line for section in sections], [1, 3, 5])
+
+    def test_data(self):
+        source = b'<p>Hello</p><pyhp>print(1)</pyhp>'
+        data = UglySoup(source).sections[0].data
+
+        # Sections of bytes refer to the source, rather than copying it
+        self.assertIsInstance(data, memoryview)
+        self.assertIs(data.obj, source)
+        self.assertEqual(bytes(data), b'<p>Hello</p>')
+        self.assertEqual(UglySoup('<p>é</p>').sections[0].data,
+                         '<p>é</p>'.encode('utf-8'))
+
+    def test_attributes(self):
+        html = '<pyhp cache="300"\n key="side bar">print(1)</pyhp><pyhp >x</pyhp>'
+        sections = UglySoup(html).sections
+
+        self.assertEqual(sections, [
+            Section(True, 'print(1)',
+                    attributes={'cache': '300', 'key': 'side bar'}),
+            Section(True, 'x'),
+        ])
+        self.assertEqual(sections[0].line, 2)
+        self.assertEqual(UglySoup(html.encode('utf-8')).sections, sections)